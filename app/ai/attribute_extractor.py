@@ -1,107 +1,293 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from typing import Any
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
 
+from app.ai.json_stream import JsonArrayStream, parse_json_array
+from app.ai.model_health import circuit_breaker, model_availability
+from app.ai.rate_limiter import estimate_tokens, rate_limiter
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# меняйте при любой правке промпта/схемы — от версии зависит ключ кэша извлечения
+PROMPT_VERSION = "v3"
 
-def extract_profile_attributes_free_text(text: str) -> list[dict[str, Any]]:
-    if not text.strip():
-        return []
+_client: AsyncOpenAI | None = None
 
-    api_key = settings.openai_api_key
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    client = OpenAI(api_key=api_key)
-    prompt = (
-        "Извлеки атрибуты из текста анкеты. Верни только JSON-массив объектов без пояснений. "
-        "Каждый объект должен содержать поля: key, value, scope, confidence, evidence. "
-        "scope только SELF или PREFERENCE. confidence от 0 до 1. evidence — короткая цитата до 80 символов. "
-        "Старайся использовать известные ключи: age, location, nationality, aqida_manhaj, marital_status, "
-        "children, polygyny_attitude, height_cm, weight_kg, prayer_level, hijab_type, relocation_ready, "
-        "partner_age_range. Не дублируй одно и то же; не более 20 пунктов.\n\n"
-        f"Текст:\n{text}"
-    )
-    base_payload = {
-        "input": [{"role": "user", "content": prompt}],
-        "response_format": {
-            "type": "json_schema",
-            "json_schema": {
-                "name": "profile_attributes",
-                "schema": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "key": {"type": "string"},
-                            "value": {"type": "string"},
-                            "scope": {"type": "string"},
-                            "confidence": {"type": "number"},
-                            "evidence": {"type": "string"},
-                        },
-                        "required": ["key", "value", "scope", "confidence", "evidence"],
-                        "additionalProperties": False,
-                    },
-                },
-            },
-        },
-    }
 
+def get_openai_client() -> AsyncOpenAI:
+    # один клиент на процесс: keep-alive соединения переиспользуются между извлечениями
+    global _client
+    if _client is None:
+        api_key = settings.openai_api_key
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(settings.openai_request_timeout, connect=settings.openai_connect_timeout),
+        )
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=settings.openai_base_url,
+            max_retries=settings.openai_max_retries,
+            http_client=http_client,
+        )
+    return _client
+
+
+async def close_openai_client() -> None:
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close()
+
+
+def _model_chain() -> list[str]:
     # determine primary model from settings with explicit fallback
     model = settings.openai_model or "gpt-5-nano"
     fallbacks = [model, "gpt-5-nano", "gpt-5-mini", "gpt-4o-mini"]
     # remove duplicates preserving order
-    seen = set()
-    models = []
-    for m in fallbacks:
-        if m not in seen:
-            seen.add(m)
-            models.append(m)
-
-    response = None
-    used_model = None
-    for candidate in models:
+    return list(dict.fromkeys(fallbacks))
+
+
+def _is_model_unavailable(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(e, "status", None) or getattr(e, "http_status", None)
+    msg = str(e)
+    return status in (403, 404) or "does not have access" in msg or "model_not_found" in msg
+
+
+def expected_model() -> str:
+    # модель, которая ответит на следующий запрос, если ничего не сломается; по ней ищем в кэше
+    return model_availability.order(_model_chain())[0]
+
+
+@asynccontextmanager
+async def _breaker_guard() -> AsyncIterator[None]:
+    # для потока вызов заканчивается, когда ответ дочитан, а не когда открыт
+    circuit_breaker.before_call()
+    try:
+        yield
+    except (asyncio.CancelledError, GeneratorExit):
+        circuit_breaker.release()
+        raise
+    except Exception:
+        circuit_breaker.record_failure()
+        raise
+    circuit_breaker.record_success()
+
+
+async def _create_response(client: AsyncOpenAI, base_payload: dict[str, Any]) -> tuple[Any, str]:
+    async with _breaker_guard():
+        return await _create_response_with_fallback(client, base_payload, _send)
+
+
+async def _send(client: AsyncOpenAI, payload: dict[str, Any]) -> Any:
+    # сырой ответ нужен ради заголовков x-ratelimit-*, по ним лимитер подстраивает бакеты
+    raw = await rate_limiter.run(
+        lambda: client.responses.with_raw_response.create(**payload, timeout=settings.openai_request_timeout),
+        estimate_tokens(payload.get("input")),
+    )
+    return raw.parse()
+
+
+@asynccontextmanager
+async def _open_stream(client: AsyncOpenAI, payload: dict[str, Any]) -> AsyncIterator[Any]:
+    async with rate_limiter.hold(
+        lambda: client.responses.with_raw_response.create(**payload, timeout=settings.openai_request_timeout),
+        estimate_tokens(payload.get("input")),
+    ) as raw:
+        async with raw.parse() as stream:
+            yield stream
+
+
+async def _create_response_with_fallback(
+    client: AsyncOpenAI,
+    base_payload: dict[str, Any],
+    send: Callable[[AsyncOpenAI, dict[str, Any]], Awaitable[Any]],
+) -> tuple[Any, str]:
+    for candidate in model_availability.order(_model_chain()):
         payload = dict(base_payload)
         payload["model"] = candidate
         try:
-            try:
-                response = client.responses.create(**payload)
-            except TypeError:
-                # some client versions might not accept response_format
-                payload.pop("response_format", None)
-                response = client.responses.create(**payload)
-            used_model = candidate
-            logger.info("AI extraction using model=%s", used_model)
-            break
+            response = await send(client, payload)
         except Exception as e:  # inspect error for retriable model issues
-            status = getattr(e, "status_code", None) or getattr(e, "status", None) or getattr(e, "http_status", None)
-            msg = str(e)
-            if status in (403, 404) or "does not have access" in msg or "model_not_found" in msg:
-                logger.warning("Model %s unavailable: %s", candidate, msg)
+            if _is_model_unavailable(e):
+                logger.warning("Model %s unavailable: %s", candidate, e)
+                model_availability.mark_unavailable(candidate)
                 continue
             raise
+        model_availability.mark_available(candidate)
+        logger.info("AI extraction using model=%s", candidate)
+        return response, candidate
+
+    raise RuntimeError("No available OpenAI model could be used for extraction")
+
+
+_INSTRUCTIONS = (
+    "Каждый объект должен содержать поля: key, value, scope, confidence, evidence. "
+    "scope только SELF или PREFERENCE. confidence от 0 до 1. evidence — короткая цитата до 80 символов. "
+    "Старайся использовать известные ключи: age, location, nationality, aqida_manhaj, marital_status, "
+    "children, polygyny_attitude, height_cm, weight_kg, prayer_level, hijab_type, relocation_ready, "
+    "partner_age_range, partner_nationality. Не дублируй одно и то же; не более 20 пунктов."
+)
 
-    if response is None:
-        raise RuntimeError("No available OpenAI model could be used for extraction")
+_ITEM_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "key": {"type": "string"},
+        "value": {"type": "string"},
+        "scope": {"type": "string"},
+        "confidence": {"type": "number"},
+        "evidence": {"type": "string"},
+    },
+    "required": ["key", "value", "scope", "confidence", "evidence"],
+    "additionalProperties": False,
+}
 
-    output_text = response.output_text.strip()
+
+def _json_schema_payload(prompt: str, name: str, field: str, items: dict[str, Any]) -> dict[str, Any]:
+    # structured outputs требуют объект в корне схемы: массив кладём в единственное поле,
+    # JsonArrayStream всё равно разбирает первый массив ответа
+    schema = {
+        "type": "object",
+        "properties": {field: {"type": "array", "items": items}},
+        "required": [field],
+        "additionalProperties": False,
+    }
+    return {
+        "input": [{"role": "user", "content": prompt}],
+        "text": {"format": {"type": "json_schema", "name": name, "schema": schema, "strict": True}},
+    }
+
+
+def _single_payload(text: str) -> dict[str, Any]:
+    prompt = (
+        "Извлеки атрибуты из текста анкеты. Верни только JSON-объект с полем attributes — массивом объектов. "
+        f"{_INSTRUCTIONS}\n\n"
+        f"Текст:\n{text}"
+    )
+    return _json_schema_payload(prompt, "profile_attributes", "attributes", _ITEM_SCHEMA)
+
+
+def _batch_payload(texts: dict[int, str]) -> dict[str, Any]:
+    blocks = "\n\n".join(f"### profile_id={pid}\n{text}" for pid, text in texts.items())
+    prompt = (
+        "Извлеки атрибуты из каждой анкеты ниже. Верни только JSON-объект с полем profiles — массивом: "
+        "по одному объекту на анкету с полями profile_id (число из заголовка) и attributes "
+        "(массив атрибутов этой анкеты). "
+        f"{_INSTRUCTIONS}\n\n"
+        f"Анкеты:\n{blocks}"
+    )
+    return _json_schema_payload(
+        prompt,
+        "profile_attributes_batch",
+        "profiles",
+        {
+            "type": "object",
+            "properties": {
+                "profile_id": {"type": "integer"},
+                "attributes": {"type": "array", "items": _ITEM_SCHEMA},
+            },
+            "required": ["profile_id", "attributes"],
+            "additionalProperties": False,
+        },
+    )
+
+
+def _batch_entry(entry: Any, texts: dict[int, str]) -> tuple[int, list[dict[str, Any]]] | None:
+    if not isinstance(entry, dict):
+        return None
     try:
-        return json.loads(output_text)
-    except json.JSONDecodeError:
-        logger.warning("AI response was not valid JSON: %s", output_text)
-        start = output_text.find("[")
-        end = output_text.rfind("]")
-        if start != -1 and end != -1 and end > start:
-            return json.loads(output_text[start : end + 1])
-        raise
+        pid = int(entry.get("profile_id"))
+    except (TypeError, ValueError):
+        return None
+    if pid not in texts or not isinstance(entry.get("attributes"), list):
+        return None
+    return pid, [item for item in entry["attributes"] if isinstance(item, dict)]
+
+
+# вместе с результатом возвращается модель, которая на самом деле ответила: под ней результат кладётся в кэш
+
+
+async def extract_profile_attributes_free_text(text: str) -> tuple[list[dict[str, Any]], str | None]:
+    if not text.strip():
+        return [], None
+    response, model = await _create_response(get_openai_client(), _single_payload(text))
+    return [item for item in parse_json_array(response.output_text) if isinstance(item, dict)], model
+
+
+async def extract_profile_attributes_batch(texts: dict[int, str]) -> tuple[dict[int, list[dict[str, Any]]], str | None]:
+    # несколько анкет в одном запросе: инструкция отправляется один раз, ответ — массив по profile_id
+    texts = {pid: t for pid, t in texts.items() if t.strip()}
+    if not texts:
+        return {}, None
+    if len(texts) == 1:
+        ((pid, text),) = texts.items()
+        items, model = await extract_profile_attributes_free_text(text)
+        return {pid: items}, model
+
+    response, model = await _create_response(get_openai_client(), _batch_payload(texts))
+    results: dict[int, list[dict[str, Any]]] = {}
+    for entry in parse_json_array(response.output_text):
+        parsed = _batch_entry(entry, texts)
+        if parsed is not None:
+            results[parsed[0]] = parsed[1]
+    return results, model
+
+
+# --- потоковый режим: элементы массива отдаются по мере прихода ответа ---
+
+
+async def _stream_array(base_payload: dict[str, Any], parser: JsonArrayStream) -> AsyncIterator[tuple[Any, str]]:
+    # слот лимитера, учёт в circuit breaker и соединение держатся, пока поток не дочитан или не закрыт
+    async with _breaker_guard(), AsyncExitStack() as stack:
+
+        async def send(client: AsyncOpenAI, payload: dict[str, Any]) -> Any:
+            return await stack.enter_async_context(_open_stream(client, payload))
+
+        stream, model = await _create_response_with_fallback(
+            get_openai_client(), {**base_payload, "stream": True}, send
+        )
+        async for event in stream:
+            kind = getattr(event, "type", "")
+            if kind == "response.output_text.delta":
+                for element in parser.feed(event.delta):
+                    yield element, model
+            elif kind in ("error", "response.failed"):
+                raise RuntimeError(f"AI streaming response failed: {event}")
+        for element in parser.close():
+            yield element, model
 
 
-async def extract_profile_attributes_free_text_async(text: str) -> list[dict[str, Any]]:
-    return await asyncio.to_thread(extract_profile_attributes_free_text, text)
+async def stream_profile_attributes_batch(
+    texts: dict[int, str],
+    parser: JsonArrayStream,
+) -> AsyncIterator[tuple[int, list[dict[str, Any]], str]]:
+    # одна анкета — отдаём каждый атрибут отдельно; пачка — атрибуты анкеты целиком, как только закрыт её объект.
+    # parser.complete после обхода показывает, дошёл ли ответ до конца массива
+    texts = {pid: t for pid, t in texts.items() if t.strip()}
+    if not texts:
+        parser.complete = True
+        return
+    if len(texts) == 1:
+        ((pid, text),) = texts.items()
+        async with aclosing(_stream_array(_single_payload(text), parser)) as items:
+            async for item, model in items:
+                if isinstance(item, dict):
+                    yield pid, [item], model
+        return
+    async with aclosing(_stream_array(_batch_payload(texts), parser)) as entries:
+        async for entry, model in entries:
+            parsed = _batch_entry(entry, texts)
+            if parsed is not None:
+                yield parsed[0], parsed[1], model
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.ai.attribute_extractor import PROMPT_VERSION
+from app.core.config import settings
+from app.db.models import ExtractionCacheEntry
+from app.db.session import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "hit_rate": round(self.hit_rate, 3)}
+
+
+cache_stats = CacheStats()
+
+
+def normalize_text(text: str) -> str:
+    text = (text or "").strip().lower().replace("ё", "е")
+    return re.sub(r"\s+", " ", text)
+
+
+def cache_key(text: str, model: str) -> str:
+    # модель — та, что ответила, а не settings.openai_model: после фолбэка ответ другой модели
+    raw = f"{PROMPT_VERSION}\x1f{model}\x1f{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def get_cached_items(session: AsyncSession, text: str, model: str) -> list[dict[str, Any]] | None:
+    if not settings.extraction_cache_enabled:
+        return None
+    entry = await session.get(ExtractionCacheEntry, cache_key(text, model))
+    now = datetime.utcnow()
+    if entry is None or entry.created_at < now - timedelta(days=settings.extraction_cache_ttl_days):
+        cache_stats.misses += 1
+        return None
+    try:
+        items = json.loads(entry.items_json)
+    except json.JSONDecodeError:
+        logger.warning("Dropping corrupted extraction cache entry %s", entry.key)
+        await session.delete(entry)
+        cache_stats.misses += 1
+        return None
+    entry.hits += 1
+    entry.last_hit_at = now
+    cache_stats.hits += 1
+    return items
+
+
+async def store_cached_items(session: AsyncSession, text: str, items: list[dict[str, Any]], model: str) -> None:
+    if not settings.extraction_cache_enabled:
+        return
+    key = cache_key(text, model)
+    now = datetime.utcnow()
+    payload = json.dumps(items, ensure_ascii=False)
+    entry = await session.get(ExtractionCacheEntry, key)
+    if entry is None:
+        # тот же текст мог закэшировать соседний воркер — его запись не хуже нашей
+        insert = dialect_insert(session)
+        await session.execute(
+            insert(ExtractionCacheEntry)
+            .values(
+                key=key,
+                model=model,
+                prompt_version=PROMPT_VERSION,
+                items_json=payload,
+                hits=0,
+                created_at=now,
+                last_hit_at=now,
+            )
+            .on_conflict_do_nothing(index_elements=[ExtractionCacheEntry.key])
+        )
+    else:
+        entry.items_json = payload
+        entry.created_at = now
+        entry.last_hit_at = now
+    cache_stats.stores += 1
+    if cache_stats.stores % max(1, settings.extraction_cache_evict_every) == 0:
+        await evict_extraction_cache(session)
+
+
+async def evict_extraction_cache(session: AsyncSession) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=settings.extraction_cache_ttl_days)
+    res = await session.execute(delete(ExtractionCacheEntry).where(ExtractionCacheEntry.created_at < cutoff))
+    removed = res.rowcount or 0
+
+    total = (await session.execute(select(func.count()).select_from(ExtractionCacheEntry))).scalar_one()
+    overflow = total - settings.extraction_cache_max_entries
+    if overflow > 0:
+        # LRU: выбрасываем записи, к которым дольше всего не обращались
+        stale = (
+            select(ExtractionCacheEntry.key)
+            .order_by(ExtractionCacheEntry.last_hit_at)
+            .limit(overflow)
+        )
+        res = await session.execute(delete(ExtractionCacheEntry).where(ExtractionCacheEntry.key.in_(stale)))
+        removed += res.rowcount or 0
+
+    if removed:
+        cache_stats.evictions += removed
+        logger.info("Evicted %s extraction cache entries", removed)
+    return removed
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.ai.model_health import CircuitOpenError
+from app.ai.rate_limiter import parse_retry_after
+from app.core.config import settings
+from app.db.models import ExtractionJob
+from app.db.session import SessionFactory
+
+logger = logging.getLogger(__name__)
+
+# обработчик получает пачку {profile_id: free_text}
+BatchHandler = Callable[[dict[int, str]], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class ClaimedJob:
+    id: int
+    profile_id: int
+    free_text: str
+    attempts: int
+
+
+def add_extraction_job(session: AsyncSession, profile_id: int, free_text: str) -> ExtractionJob:
+    # задача пишется в той же транзакции, что и анкета — после коммита она уже не потеряется
+    job = ExtractionJob(
+        profile_id=profile_id,
+        free_text=free_text,
+        status="PENDING",
+        run_after=datetime.utcnow(),
+    )
+    session.add(job)
+    return job
+
+
+def _retry_delay(attempts: int) -> float:
+    delay = settings.extraction_retry_base_delay * (2 ** max(attempts - 1, 0))
+    delay = min(delay, settings.extraction_retry_max_delay)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _outage_delay(error: BaseException) -> float | None:
+    # открытый breaker и 429 — сбой на стороне OpenAI, а не задачи: попыткой не считаем
+    if isinstance(error, CircuitOpenError):
+        return max(error.retry_after, 1.0)
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status == 429:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        retry_after = parse_retry_after(headers)
+        return retry_after if retry_after is not None else settings.extraction_retry_base_delay
+    return None
+
+
+class ExtractionQueue:
+    def __init__(self) -> None:
+        self._handler: BatchHandler | None = None
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._in_flight = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers) and not self._stopping
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def start(self, handler: BatchHandler, concurrency: int | None = None) -> None:
+        if self._workers:
+            raise RuntimeError("Extraction queue is already running")
+        self._handler = handler
+        self._stopping = False
+        recovered = await self._recover()
+        if recovered:
+            logger.info("Recovered %s interrupted extraction jobs", recovered)
+        size = max(1, concurrency or settings.extraction_concurrency)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"extraction-worker-{i}") for i in range(size)
+        ]
+        self._wakeup.set()
+        logger.info("Extraction queue started with %s workers", size)
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def stop(self, timeout: float | None = None) -> None:
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        timeout = settings.extraction_drain_timeout if timeout is None else timeout
+        done, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # прерванные задачи остаются RUNNING и будут подняты через _recover при следующем старте
+            logger.warning("Extraction queue drain timed out, cancelled %s workers", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._workers = []
+        logger.info("Extraction queue stopped")
+
+    async def pending_count(self) -> int:
+        async with SessionFactory() as session:
+            res = await session.execute(
+                select(func.count()).select_from(ExtractionJob).where(ExtractionJob.status.in_(("PENDING", "RUNNING")))
+            )
+            return res.scalar_one()
+
+    async def _recover(self) -> int:
+        async with SessionFactory() as session:
+            res = await session.execute(
+                update(ExtractionJob)
+                .where(ExtractionJob.status == "RUNNING")
+                .values(status="PENDING", claim_token=None, run_after=datetime.utcnow(), updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            return res.rowcount or 0
+
+    async def _claim_batch(self, limit: int) -> list[ClaimedJob]:
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        async with SessionFactory() as session:
+            candidates = (
+                select(ExtractionJob.id)
+                .where(ExtractionJob.status == "PENDING", ExtractionJob.run_after <= now)
+                .order_by(ExtractionJob.run_after, ExtractionJob.id)
+                .limit(limit)
+            )
+            res = await session.execute(
+                update(ExtractionJob)
+                .where(ExtractionJob.id.in_(candidates), ExtractionJob.status == "PENDING")
+                .values(status="RUNNING", claim_token=token, attempts=ExtractionJob.attempts + 1, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            if not res.rowcount:
+                return []
+            # строки, которые успел перехватить другой воркер, не получат наш token
+            rows = (
+                await session.execute(
+                    select(ExtractionJob.id, ExtractionJob.profile_id, ExtractionJob.free_text, ExtractionJob.attempts)
+                    .where(ExtractionJob.claim_token == token)
+                    .order_by(ExtractionJob.id)
+                )
+            ).all()
+        return [
+            ClaimedJob(id=r.id, profile_id=r.profile_id, free_text=r.free_text or "", attempts=r.attempts)
+            for r in rows
+        ]
+
+    async def _fill_batch(self, jobs: list[ClaimedJob]) -> list[ClaimedJob]:
+        size = max(1, settings.extraction_batch_size)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.extraction_batch_max_wait
+        while len(jobs) < size and not self._stopping:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            try:
+                jobs += await self._claim_batch(size - len(jobs))
+            except Exception:
+                # уже забранные задачи не теряем — обрабатываем то, что есть
+                logger.exception("Failed to top up extraction batch")
+                break
+        return jobs
+
+    async def _complete(self, jobs: list[ClaimedJob]) -> None:
+        async with SessionFactory() as session:
+            await session.execute(delete(ExtractionJob).where(ExtractionJob.id.in_([j.id for j in jobs])))
+            await session.commit()
+
+    async def _fail(self, jobs: list[ClaimedJob], error: BaseException) -> None:
+        now = datetime.utcnow()
+        outage = _outage_delay(error)
+        async with SessionFactory() as session:
+            for job in jobs:
+                values: dict = {"last_error": repr(error)[:2000], "claim_token": None, "updated_at": now}
+                if outage is not None:
+                    # попытку, засчитанную при захвате, возвращаем — иначе долгий простой провалит все задачи
+                    delay = outage * random.uniform(1.0, 1.5)
+                    values["status"] = "PENDING"
+                    values["attempts"] = max(job.attempts - 1, 0)
+                    values["run_after"] = now + timedelta(seconds=delay)
+                    logger.warning("Extraction job %s deferred for %.0fs: %s", job.id, delay, error)
+                elif job.attempts >= settings.extraction_max_attempts:
+                    values["status"] = "FAILED"
+                    logger.error("Extraction job %s failed permanently after %s attempts", job.id, job.attempts)
+                else:
+                    delay = _retry_delay(job.attempts)
+                    values["status"] = "PENDING"
+                    values["run_after"] = now + timedelta(seconds=delay)
+                    logger.warning(
+                        "Extraction job %s failed (attempt %s), retry in %.0fs", job.id, job.attempts, delay
+                    )
+                await session.execute(update(ExtractionJob).where(ExtractionJob.id == job.id).values(**values))
+            await session.commit()
+
+    async def _run(self, jobs: list[ClaimedJob]) -> None:
+        assert self._handler is not None
+        # повторная задача на ту же анкету: берём самый свежий текст
+        texts = {job.profile_id: job.free_text for job in jobs}
+        self._in_flight += len(jobs)
+        try:
+            await self._handler(texts)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Extraction batch failed for profiles %s", sorted(texts))
+            await self._fail(jobs, e)
+        else:
+            await self._complete(jobs)
+        finally:
+            self._in_flight -= len(jobs)
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                jobs = await self._claim_batch(max(1, settings.extraction_batch_size))
+            except Exception:
+                logger.exception("Failed to claim extraction jobs")
+                jobs = []
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.extraction_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            jobs = await self._fill_batch(jobs)
+            await self._run(jobs)
+
+
+extraction_queue = ExtractionQueue()
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable
+
+from app.ai.attribute_extractor import (
+    PROMPT_VERSION,
+    expected_model,
+    extract_profile_attributes_batch,
+    extract_profile_attributes_free_text,
+    stream_profile_attributes_batch,
+)
+from app.ai.extraction_cache import get_cached_items, store_cached_items
+from app.ai.json_stream import JsonArrayStream
+from app.ai.local_extractor import LocalExtraction, extract_local, local_extraction_stats
+from app.core.config import settings
+from app.db.attribute_service import (
+    AttributeValueInput,
+    MergeResult,
+    map_extracted_item_to_attribute,
+    merge_profile_attribute_values,
+)
+from app.db.profile_search import refresh_profile_search
+from app.db.saved_searches import refresh_saved_searches
+from app.db.session import SessionFactory
+from app.matching.engine import match_engine
+from app.matching.precompute import match_precomputer
+
+logger = logging.getLogger(__name__)
+
+
+async def _extracted_rows(session, profile_id: int, items: list[dict[str, Any]]) -> list[AttributeValueInput]:
+    rows: list[AttributeValueInput] = []
+    for item in items:
+        try:
+            attribute, normalized = await map_extracted_item_to_attribute(session, item)
+            value = str(normalized.get("value", "")).strip()
+            if not value:
+                continue
+            source = normalized.get("source") or "AI"
+            rows.append(
+                AttributeValueInput(
+                    profile_id=profile_id,
+                    attribute=attribute,
+                    value=value,
+                    option_code=None,
+                    confidence=float(normalized.get("confidence", 1.0)),
+                    evidence=normalized.get("evidence"),
+                    source=source,
+                    # ответы из кэша получены тем же промптом: версия входит в ключ кэша
+                    prompt_version=PROMPT_VERSION if source == "AI" else None,
+                )
+            )
+        except Exception:
+            logger.exception("Failed to persist extracted item: %s", item)
+    return rows
+
+
+async def _persist_extracted(results: dict[int, list[dict[str, Any]]]) -> MergeResult:
+    async with SessionFactory() as session:
+        rows: list[AttributeValueInput] = []
+        for pid, items in results.items():
+            rows += await _extracted_rows(session, pid, items)
+        merged = await merge_profile_attribute_values(session, rows)
+        await session.commit()
+    return merged
+
+
+class _StreamBuffer:
+    # потоковые атрибуты копим и пишем пачкой в одной сессии: по числу элементов или по времени
+    def __init__(self, persist: Callable[[dict[int, list[dict[str, Any]]]], Awaitable[None]]) -> None:
+        self._persist = persist
+        self._pending: dict[int, list[dict[str, Any]]] = {}
+        self._count = 0
+        self._since = 0.0
+
+    async def add(self, pid: int, items: list[dict[str, Any]]) -> None:
+        if not self._pending:
+            self._since = time.monotonic()
+        self._pending.setdefault(pid, []).extend(items)
+        self._count += len(items)
+        if (
+            self._count >= settings.extraction_stream_flush_items
+            or time.monotonic() - self._since >= settings.extraction_stream_flush_interval
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending, self._count = self._pending, {}, 0
+        await self._persist(pending)
+
+
+async def _stream_llm_results(
+    misses: dict[int, str],
+    persist: Callable[[dict[int, list[dict[str, Any]]]], Awaitable[None]],
+) -> tuple[dict[int, list[dict[str, Any]]], dict[int, str]]:
+    # разобранные элементы уходят в БД по мере прихода; оборванный хвост не отменяет уже сохранённое.
+    # второй результат — модель, ответившая по анкете, только для ответов, дошедших до конца массива
+    results: dict[int, list[dict[str, Any]]] = {}
+    models: dict[int, str] = {}
+    buffer = _StreamBuffer(persist)
+    try:
+        parser = JsonArrayStream()
+        async with aclosing(stream_profile_attributes_batch(misses, parser)) as stream:
+            async for pid, items, model in stream:
+                results.setdefault(pid, []).extend(items)
+                models[pid] = model
+                await buffer.add(pid, items)
+        complete = dict(models) if parser.complete else {}
+        for pid, text in misses.items():
+            if pid in results:
+                continue
+            # модель пропустила анкету в пачке — добираем отдельным запросом
+            single = JsonArrayStream()
+            model = None
+            async with aclosing(stream_profile_attributes_batch({pid: text}, single)) as stream:
+                async for _, items, model in stream:
+                    results.setdefault(pid, []).extend(items)
+                    await buffer.add(pid, items)
+            results.setdefault(pid, [])
+            if single.complete and model is not None:
+                complete[pid] = model
+    finally:
+        await buffer.flush()
+    return results, complete
+
+
+async def extract_and_persist_batch(texts: dict[int, str], force_llm: bool = False) -> None:
+    # ошибки извлечения пробрасываются наружу — повторы делает extraction_queue.
+    # force_llm — для перезапуска после правки промпта или атрибутов: ИИ получает все тексты,
+    # мимо отсева правилами и мимо кэша; свежие ответы кэш всё равно перезапишут
+    texts = {pid: text for pid, text in texts.items() if text and len(text) >= 10}
+    if not texts:
+        return
+
+    total = MergeResult()
+    changed: set[int] = set()
+
+    async def persist(results: dict[int, list[dict[str, Any]]]) -> None:
+        merged = await _persist_extracted(results)
+        total.written += merged.written
+        total.skipped_unchanged += merged.skipped_unchanged
+        total.skipped_downgrade += merged.skipped_downgrade
+        if merged.written:
+            changed.update(results)
+
+    # сначала правила; мимо ИИ идут только тексты, целиком разобранные правилами:
+    # в каждой фразе найдено значение и ни один важный ключ не остался нераспознанным
+    local = {
+        pid: extract_local(text) if settings.local_extraction_enabled else LocalExtraction()
+        for pid, text in texts.items()
+    }
+    llm_texts = {
+        pid: text
+        for pid, text in texts.items()
+        if force_llm or not settings.local_extraction_enabled or local[pid].needs_llm
+    }
+    local_extraction_stats.local_only += len(texts) - len(llm_texts)
+    local_extraction_stats.sent_to_llm += len(llm_texts)
+    # результат правил сохраняем сразу; из совпавших с ИИ ключей merge оставит более уверенное значение
+    await persist({pid: extraction.items for pid, extraction in local.items() if extraction.items})
+
+    cached: dict[int, list[dict[str, Any]]] = {}
+    if not force_llm:
+        model = expected_model()
+        async with SessionFactory() as session:
+            for pid, text in llm_texts.items():
+                items = await get_cached_items(session, text, model)
+                if items is not None:
+                    cached[pid] = items
+            await session.commit()
+    if cached:
+        await persist(cached)
+
+    misses = {pid: text for pid, text in llm_texts.items() if pid not in cached}
+    try:
+        if misses:
+            if settings.extraction_streaming:
+                extracted, complete = await _stream_llm_results(misses, persist)
+            else:
+                extracted, model = await extract_profile_attributes_batch(misses)
+                complete = {pid: model for pid in extracted if model is not None}
+                for pid, text in misses.items():
+                    if pid not in extracted:
+                        # модель пропустила анкету в пачке — добираем отдельным запросом
+                        extracted[pid], single_model = await extract_profile_attributes_free_text(text)
+                        if single_model is not None:
+                            complete[pid] = single_model
+                await persist(extracted)
+            async with SessionFactory() as session:
+                # в кэш — только ответы, дошедшие до конца массива, под моделью, которая их дала
+                for pid, answered_by in complete.items():
+                    await store_cached_items(session, misses[pid], extracted[pid], answered_by)
+                await session.commit()
+    finally:
+        # поиск обновляем и тогда, когда ответ оборвался: уже сохранённые атрибуты должны в нём появиться
+        if changed:
+            async with SessionFactory() as session:
+                await refresh_profile_search(session, changed)
+                await refresh_saved_searches(session, changed)
+                await session.commit()
+            match_engine.invalidate()
+            match_precomputer.schedule(changed)
+    logger.info(
+        "Extracted attributes for %s profiles: written=%s unchanged=%s downgrade=%s",
+        len(texts),
+        total.written,
+        total.skipped_unchanged,
+        total.skipped_downgrade,
+    )
+
+
+async def extract_and_persist(profile_id: int, free_text: str, force_llm: bool = False) -> None:
+    await extract_and_persist_batch({profile_id: free_text}, force_llm)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_SPACE = " \t\r\n"
+# обработанный префикс буфера выбрасываем, когда он больше этого размера
+_COMPACT_AT = 4096
+
+
+class JsonArrayStream:
+    # разбирает JSON-массив верхнего уровня по кускам: каждый законченный элемент отдаётся сразу,
+    # битый элемент пропускается, а оборванный хвост не портит уже разобранное
+    def __init__(self) -> None:
+        self.complete = False
+        self.parsed = 0
+        self.skipped = 0
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._start: int | None = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _emit(self, end: int, out: list[Any]) -> None:
+        raw = self._buf[self._start : end]
+        self._start = None
+        try:
+            out.append(json.loads(raw))
+            self.parsed += 1
+        except json.JSONDecodeError:
+            self.skipped += 1
+            logger.warning("Skipping malformed JSON array element: %s", raw[:200])
+
+    def feed(self, chunk: str) -> list[Any]:
+        out: list[Any] = []
+        if self.complete or not chunk:
+            return out
+        self._buf += chunk
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if not self._started:
+                # пояснения или ```json перед массивом пропускаем
+                self._started = ch == "["
+                i += 1
+                continue
+            if self._start is None:
+                if ch in _SPACE or ch == ",":
+                    i += 1
+                    continue
+                if ch == "]":
+                    self.complete = True
+                    i += 1
+                    break
+                self._start = i
+                self._depth = 0
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 0:
+                        self._emit(i + 1, out)
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(i + 1, out)
+            elif self._depth == 0 and (ch in _SPACE or ch in ",]"):
+                # конец числа/true/false/null; закрывающую скобку массива разберём на следующем шаге
+                self._emit(i, out)
+                continue
+            i += 1
+        self._pos = i
+        if self._start is None and self._pos > _COMPACT_AT:
+            self._buf = self._buf[self._pos :]
+            self._pos = 0
+        return out
+
+    def close(self) -> list[Any]:
+        # ответ закончился: незакрытый элемент верхнего уровня не разобрать, но число в конце ещё можно
+        out: list[Any] = []
+        if not self.complete and self._start is not None and self._depth == 0 and not self._in_string:
+            self._emit(len(self._buf), out)
+        if not self.complete:
+            logger.warning("JSON array was not closed: %s elements parsed, tail dropped", self.parsed)
+        return out
+
+
+def parse_json_array(text: str) -> list[Any]:
+    parser = JsonArrayStream()
+    return parser.feed(text) + parser.close()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from app.core.config import settings
+from app.db.option_index import normalize_option_text, stem_phrase
+from app.db.seed import CANONICAL_ATTRIBUTES
+
+SOURCE = "RULES"
+_MAX_WINDOW = 4
+_ENUM_CONFIDENCE = 0.8
+_LABELED_CONFIDENCE = 0.9
+_UNLABELED_CONFIDENCE = 0.8
+# варианты, которые в свободном тексте ничего не значат без вопроса рядом: «да», «иногда», «не указано»
+_AMBIGUOUS = {
+    "да", "нет", "0", "1", "2", "3", "3+", "есть 1", "есть 2", "есть 3+", "иногда", "не всегда", "редко",
+    "регулярно", "возможно", "зависит", "обсуждаемо", "не указано", "не знаю", "не важно", "другое", "иное",
+    "затрудняюсь", "не хочу указывать", "не обсуждал", "не обсуждала", "готов", "готова", "готов а",
+    "не готов", "не готова", "не готов а",
+}
+_NEGATIONS = {"не", "без", "ни"}
+
+# признаки того, что текст говорит об атрибуте; нашли признак, но не значение — решает ИИ
+_CUES = {
+    "age": re.compile(r"\bлет\b|\bгод|возраст"),
+    "height_cm": re.compile(r"\bрост"),
+    "weight_kg": re.compile(r"\bвес\b|\bвешу|\bкг\b"),
+    "aqida_manhaj": re.compile(r"акъ?ыд|акид|манхадж|сунн|салаф"),
+    "marital_status": re.compile(r"женат|замуж|развод|развед|вдов|холост"),
+    "children": re.compile(r"\bдет|ребен|\bсын|\bдоч"),
+    "polygyny_attitude": re.compile(r"многожен|втор\w* жен|единобрач|полиги"),
+    "prayer_level": re.compile(r"намаз|\bмол[ия]|салят"),
+    "hijab_type": re.compile(r"хиджаб|никаб|платок|покрыв|джильбаб|химар"),
+    "relocation_ready": re.compile(r"переезд|переех"),
+    "partner_age_range": re.compile(r"\b\d{2}\s*(?:-|–|—|до)\s*\d{2}\b"),
+    "partner_nationality": re.compile(r"национальн"),
+}
+
+# labeled — число после подписи («рост 175», «мне 27»), bare — число с единицей («175 см», «27 лет»)
+_AGE_RE = re.compile(r"\b(?:мне|возраст\s*[:\-—]?)\s*(?P<labeled>\d{2})\b|\b(?P<bare>\d{2})\s*(?:лет|года|год)\b")
+_HEIGHT_RE = re.compile(
+    r"\bрост\w*\s*[:\-—]?\s*(?:(?P<labeled>1\d{2}|2[0-2]\d)|1[.,](?P<meters>\d{2}))\b"
+    r"|\b(?P<bare>1\d{2}|2[0-2]\d)\s*см\b"
+)
+_WEIGHT_RE = re.compile(r"\bвес\w*\s*[:\-—]?\s*(?P<labeled>\d{2,3})\b|\b(?P<bare>\d{2,3})\s*кг\b")
+# «от 20 до 25 лет», «20-25 лет» — это предпочтение к партнёру, а не свой возраст
+_RANGE_BEFORE = re.compile(r"(?:\bот|\bдо|\d\s*[-–—])\s*$")
+_LIMITS = {"age": (16, 80), "height_cm": (130, 230), "weight_kg": (35, 200)}
+# фразы анкеты; запятая между цифрами («рост 1,75») фразу не делит
+_CLAUSE_SPLIT = re.compile(r"[.;!?\n]+|,(?!\d)")
+
+
+@dataclass
+class LocalExtraction:
+    items: list[dict[str, Any]] = field(default_factory=list)
+    # ключи, о которых текст говорит, но правила значение не нашли
+    unresolved: set[str] = field(default_factory=set)
+    # в каждой фразе правила нашли значение; фраза без значения может говорить о том, чего правила
+    # не знают вовсе (город, национальность, свободные атрибуты)
+    covered: bool = False
+
+    @property
+    def needs_llm(self) -> bool:
+        return not self.covered or bool(self.unresolved & set(settings.local_extraction_required_keys))
+
+
+@dataclass
+class LocalExtractionStats:
+    local_only: int = 0
+    sent_to_llm: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+local_extraction_stats = LocalExtractionStats()
+
+
+def _phrase_table() -> dict[str, dict[str, tuple[str, ...]]]:
+    # основа фразы -> {key: (code, ...)}; собирается из подписей и синонимов CANONICAL_ATTRIBUTES
+    table: dict[str, dict[str, set[str]]] = {}
+    for spec in CANONICAL_ATTRIBUTES:
+        if spec["value_type"] != "ENUM":
+            continue
+        phrases = [(code, label) for code, label in spec["options"]]
+        phrases += [(code, p) for code, items in (spec.get("synonyms") or {}).items() for p in items]
+        for code, phrase in phrases:
+            for variant in {re.sub(r"\(([^)]*)\)", "", phrase), re.sub(r"\(([^)]*)\)", r"\1", phrase)}:
+                normalized = normalize_option_text(variant)
+                if not normalized or normalized in _AMBIGUOUS:
+                    continue
+                table.setdefault(stem_phrase(normalized), {}).setdefault(spec["key"], set()).add(code)
+    return {stem: {key: tuple(sorted(codes)) for key, codes in keys.items()} for stem, keys in table.items()}
+
+
+_PHRASES = _phrase_table()
+
+
+def _item(key: str, value: Any, confidence: float, evidence: str) -> dict[str, Any]:
+    return {
+        "key": key,
+        "value": str(value),
+        "scope": "SELF",
+        "confidence": confidence,
+        "evidence": evidence[:80],
+        "source": SOURCE,
+    }
+
+
+def _numbers(text: str) -> list[dict[str, Any]]:
+    items: list[dict[str, Any]] = []
+    for key, pattern in (("age", _AGE_RE), ("height_cm", _HEIGHT_RE), ("weight_kg", _WEIGHT_RE)):
+        low, high = _LIMITS[key]
+        values: set[int] = set()
+        evidence = ""
+        confidence = _UNLABELED_CONFIDENCE
+        for match in pattern.finditer(text):
+            groups = match.groupdict()
+            if key == "age" and groups["bare"] and _RANGE_BEFORE.search(text[: match.start()]):
+                continue
+            if groups.get("meters"):
+                value = 100 + int(groups["meters"])
+            else:
+                value = int(groups["labeled"] or groups["bare"])
+            if not low <= value <= high:
+                continue
+            values.add(value)
+            evidence = match.group(0)
+            if not groups["bare"]:
+                confidence = _LABELED_CONFIDENCE
+        # разные числа для одного ключа — правилам не верим, пусть разбирается ИИ
+        if len(values) == 1:
+            items.append(_item(key, values.pop(), confidence, evidence))
+    return items
+
+
+def _enums(text: str) -> tuple[list[dict[str, Any]], set[str]]:
+    words: list[str] = []
+    # границы фразы каждого слова: ни совпадение, ни отрицание не переходят через запятую или точку
+    starts: list[int] = []
+    ends: list[int] = []
+    for clause in _CLAUSE_SPLIT.split(text):
+        clause_words = normalize_option_text(clause).split()
+        starts += [len(words)] * len(clause_words)
+        words += clause_words
+        ends += [len(words)] * len(clause_words)
+    stems = stem_phrase(" ".join(words)).split()
+    found: dict[str, set[str]] = {}
+    evidence: dict[str, str] = {}
+    conflicts: set[str] = set()
+    i = 0
+    while i < len(stems):
+        for size in range(min(_MAX_WINDOW, ends[i] - i), 0, -1):
+            hits = _PHRASES.get(" ".join(stems[i : i + size]))
+            if hits is None:
+                continue
+            # «не ношу хиджаб», «без никаба», «замужем не была»: отрицание в паре слов перед фразой
+            # или сразу после неё — значение оставляем ИИ; «не женат, детей нет» — «не» из соседней фразы
+            around = words[max(starts[i], i - 2) : i] + words[i + size : min(ends[i], i + size + 1)]
+            negated = bool(_NEGATIONS.intersection(around))
+            for key, codes in hits.items():
+                if negated or len(codes) > 1:
+                    conflicts.add(key)
+                    continue
+                found.setdefault(key, set()).update(codes)
+                evidence.setdefault(key, " ".join(words[max(starts[i], i - 1) : i + size]))
+            i += size
+            break
+        else:
+            i += 1
+    items: list[dict[str, Any]] = []
+    for key, codes in found.items():
+        if len(codes) == 1 and key not in conflicts:
+            items.append(_item(key, next(iter(codes)), _ENUM_CONFIDENCE, evidence[key]))
+        else:
+            conflicts.add(key)
+    return items, conflicts
+
+
+def extract_local(text: str) -> LocalExtraction:
+    lowered = (text or "").lower().replace("ё", "е")
+    if not lowered.strip():
+        return LocalExtraction()
+    items = _numbers(lowered)
+    enum_items, conflicts = _enums(lowered)
+    items += enum_items
+    resolved = {item["key"] for item in items}
+    unresolved = {key for key, cue in _CUES.items() if key not in resolved and cue.search(lowered)}
+    clauses = [c for c in _CLAUSE_SPLIT.split(lowered) if normalize_option_text(c)]
+    covered = bool(clauses) and all(_numbers(c) or _enums(c)[0] for c in clauses)
+    return LocalExtraction(items, unresolved | (conflicts - resolved), covered)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import logging
+import time
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"OpenAI circuit breaker is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# помнит, какие модели доступны, чтобы не выяснять это заново на каждом вызове
+class ModelAvailability:
+    def __init__(self, ttl: float | None = None) -> None:
+        self._ttl = ttl
+        self._available: dict[str, float] = {}
+        self._unavailable: dict[str, float] = {}
+
+    @property
+    def ttl(self) -> float:
+        return settings.openai_model_memory_ttl if self._ttl is None else self._ttl
+
+    def _fresh(self, table: dict[str, float], model: str) -> bool:
+        checked_at = table.get(model)
+        if checked_at is None:
+            return False
+        if time.monotonic() - checked_at > self.ttl:
+            # срок памяти истёк — модель будет перепроверена
+            del table[model]
+            return False
+        return True
+
+    def order(self, models: list[str]) -> list[str]:
+        # порядок цепочки не меняется: успех фолбэка не ставит его впереди основной модели,
+        # пропускаются только модели, недавно отказавшие
+        ordered = [m for m in models if not self._fresh(self._unavailable, m)]
+        # если все модели помечены недоступными, всё равно пробуем — лучше лишний запрос, чем отказ
+        return ordered or list(models)
+
+    def mark_available(self, model: str) -> None:
+        self._available[model] = time.monotonic()
+        self._unavailable.pop(model, None)
+
+    def mark_unavailable(self, model: str) -> None:
+        self._unavailable[model] = time.monotonic()
+        self._available.pop(model, None)
+
+    def snapshot(self) -> dict[str, list[str]]:
+        return {
+            "available": [m for m in list(self._available) if self._fresh(self._available, m)],
+            "unavailable": [m for m in list(self._unavailable) if self._fresh(self._unavailable, m)],
+        }
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int | None = None, cooldown: float | None = None) -> None:
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_in_flight = False
+
+    @property
+    def failure_threshold(self) -> int:
+        return settings.openai_breaker_failure_threshold if self._failure_threshold is None else self._failure_threshold
+
+    @property
+    def cooldown(self) -> float:
+        return settings.openai_breaker_cooldown if self._cooldown is None else self._cooldown
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "CLOSED"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "OPEN"
+        return "HALF_OPEN"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "OPEN":
+            raise CircuitOpenError(self.cooldown - (time.monotonic() - self._opened_at))
+        if state == "HALF_OPEN":
+            # после паузы пропускаем один пробный запрос, остальные ждут его результата
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.cooldown)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("OpenAI circuit breaker closed")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        # вызов отменён без результата — не держим пробный слот
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._probe_in_flight or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._probe_in_flight:
+                logger.warning("OpenAI circuit breaker opened for %.0fs after %s failures", self.cooldown, self._failures)
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+model_availability = ModelAvailability()
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Mapping, TypeVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+# грубая оценка для бакета токенов: ~3 символа на токен в русском тексте плюс запас на ответ
+_CHARS_PER_TOKEN = 3
+_RESPONSE_TOKENS = 1000
+
+
+def estimate_tokens(payload: Any) -> int:
+    return len(str(payload)) // _CHARS_PER_TOKEN + _RESPONSE_TOKENS
+
+
+def parse_duration(value: str | None) -> float | None:
+    # x-ratelimit-reset-*: «1s», «6m0s», «20ms»
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(headers: Mapping[str, str] | None) -> float | None:
+    if not headers:
+        return None
+    if (ms := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_of(e: Exception) -> int | None:
+    return getattr(e, "status_code", None) or getattr(e, "status", None)
+
+
+def _headers_of(obj: Any) -> Mapping[str, str] | None:
+    headers = getattr(obj, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(obj, "response", None), "headers", None)
+    return headers
+
+
+def _retriable(e: Exception) -> bool:
+    status = _status_of(e)
+    if status == 429:
+        # закончившаяся квота — не троттлинг, ожиданием не лечится
+        return getattr(e, "code", None) != "insufficient_quota"
+    return status is not None and status >= 500
+
+
+class TokenBucket:
+    # ёмкость — лимит в минуту, пополнение равномерное
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        # запрос больше ёмкости иначе ждал бы вечно — пускаем его на полном бакете
+        need = min(amount, self.capacity)
+        if self.available >= need:
+            return 0.0
+        return (need - self.available) * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= amount
+
+    def sync(self, limit: str | None, remaining: str | None) -> None:
+        # заголовки сервера точнее локального счёта
+        try:
+            if limit is not None:
+                self.capacity = max(1.0, float(limit))
+            if remaining is not None:
+                self._refill()
+                self.available = min(self.capacity, float(remaining))
+        except ValueError:
+            pass
+
+
+class AdaptiveRateLimiter:
+    def __init__(self) -> None:
+        self.requests = TokenBucket(settings.openai_rpm_limit)
+        self.tokens = TokenBucket(settings.openai_tpm_limit)
+        # AIMD: +1 к лимиту за «окно» успешных запросов, половина — на 429/5xx
+        self.concurrency = float(settings.openai_concurrency_initial)
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttled = 0
+        self._paused_until = 0.0
+        self._cond: asyncio.Condition | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self.waiting
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _acquire(self, tokens: int) -> None:
+        cond = self._condition()
+        self.waiting += 1
+        try:
+            async with cond:
+                while True:
+                    delay = max(self.paused_for, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if delay <= 0 and self.in_flight < max(1, int(self.concurrency)):
+                        break
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=delay if delay > 0 else None)
+                    except asyncio.TimeoutError:
+                        pass
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                self.in_flight += 1
+        finally:
+            self.waiting -= 1
+
+    async def _release(self) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def _observe(self, headers: Mapping[str, str] | None) -> None:
+        if not headers:
+            return
+        self.requests.sync(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"))
+        self.tokens.sync(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"))
+        # бакет пуст до сброса — не шлём запросы, которые гарантированно получат 429
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._paused_until = max(self._paused_until, time.monotonic() + reset)
+
+    def _on_success(self) -> None:
+        self.concurrency = min(float(settings.openai_concurrency_max), self.concurrency + 1.0 / self.concurrency)
+
+    def _on_throttle(self, retry_after: float) -> None:
+        self.throttled += 1
+        now = time.monotonic()
+        # пачка 429 от параллельных запросов — одно снижение на одну паузу
+        if now >= self._paused_until:
+            self.concurrency = max(1.0, self.concurrency * settings.openai_concurrency_decrease)
+            logger.warning(
+                "OpenAI throttled, pausing for %.1fs, concurrency limit now %.1f", retry_after, self.concurrency
+            )
+        self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(settings.openai_rate_limit_max_delay, settings.openai_rate_limit_base_delay * 2**attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retry_after_error(self, e: Exception, attempt: int) -> bool:
+        headers = _headers_of(e)
+        self._observe(headers)
+        if not _retriable(e) or attempt >= settings.openai_rate_limit_max_retries:
+            return False
+        retry_after = parse_retry_after(headers)
+        self._on_throttle(retry_after if retry_after is not None else self._backoff(attempt))
+        return True
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int = _RESPONSE_TOKENS) -> T:
+        # 429 и 5xx не пробрасываются сразу: вызов ждёт retry-after в очереди и повторяется
+        attempt = 0
+        while True:
+            await self._acquire(tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                if not self._retry_after_error(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            else:
+                self._observe(_headers_of(result))
+                self._on_success()
+                return result
+            finally:
+                await self._release()
+
+    @asynccontextmanager
+    async def hold(self, call: Callable[[], Awaitable[T]], tokens: int = _RESPONSE_TOKENS) -> AsyncIterator[T]:
+        # как run, но для потоковых ответов: слот занят, пока вызывающий не дочитает поток
+        attempt = 0
+        while True:
+            await self._acquire(tokens)
+            try:
+                result = await call()
+            except BaseException as e:
+                await self._release()
+                if not isinstance(e, Exception) or not self._retry_after_error(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            break
+        try:
+            self._observe(_headers_of(result))
+            self._on_success()
+            yield result
+        finally:
+            await self._release()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "concurrency": round(self.concurrency, 1),
+            "in_flight": self.in_flight,
+            "queue": self.waiting,
+            "rpm": int(self.requests.capacity),
+            "tpm": int(self.tokens.capacity),
+            "requests_left": max(0, int(self.requests.available)),
+            "tokens_left": max(0, int(self.tokens.available)),
+            "paused_for": round(self.paused_for, 1),
+            "throttled": self.throttled,
+        }
+
+
+rate_limiter = AdaptiveRateLimiter()
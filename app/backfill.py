@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import func, select
+
+from app.ai.attribute_extractor import PROMPT_VERSION, close_openai_client
+from app.ai.extraction_queue import add_extraction_job
+from app.ai.extraction_service import extract_and_persist_batch
+from app.core.config import settings
+from app.db.models import BackfillCheckpoint, Profile
+from app.db.session import SessionFactory, init_db
+
+logger = logging.getLogger("app.backfill")
+
+_CHUNK_ATTEMPTS = 3
+_RETRY_DELAY = 5.0
+_REPORT_EVERY = 10.0
+
+
+def _profiles_with_text():
+    return select(Profile.id, Profile.about_me_text).where(
+        Profile.status == "ACTIVE",
+        Profile.about_me_text.is_not(None),
+        Profile.about_me_text != "",
+    )
+
+
+async def _load_checkpoint(name: str, restart: bool) -> BackfillCheckpoint:
+    async with SessionFactory() as session:
+        checkpoint = await session.get(BackfillCheckpoint, name)
+        if checkpoint is None or restart:
+            if checkpoint is not None:
+                await session.delete(checkpoint)
+                await session.flush()
+            checkpoint = BackfillCheckpoint(name=name, last_profile_id=0, processed=0, failed=0)
+            session.add(checkpoint)
+            await session.commit()
+        return checkpoint
+
+
+async def _save_checkpoint(name: str, last_profile_id: int, processed: int, failed: int, finished: bool = False) -> None:
+    async with SessionFactory() as session:
+        checkpoint = await session.get(BackfillCheckpoint, name)
+        checkpoint.last_profile_id = last_profile_id
+        checkpoint.processed = processed
+        checkpoint.failed = failed
+        checkpoint.updated_at = datetime.utcnow()
+        if finished:
+            checkpoint.finished_at = checkpoint.updated_at
+        await session.commit()
+
+
+async def _chunks(after_id: int, size: int) -> AsyncIterator[list[tuple[int, str]]]:
+    # keyset по id: в памяти только текущая пачка текстов
+    last_id = after_id
+    while True:
+        async with SessionFactory() as session:
+            res = await session.execute(
+                _profiles_with_text().where(Profile.id > last_id).order_by(Profile.id).limit(size)
+            )
+            chunk = [(pid, text) for pid, text in res.all()]
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        yield chunk
+
+
+async def _process_chunk(chunk: list[tuple[int, str]], force_llm: bool) -> int:
+    texts = dict(chunk)
+    for attempt in range(_CHUNK_ATTEMPTS):
+        try:
+            await extract_and_persist_batch(texts, force_llm)
+            return 0
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Backfill chunk %s..%s failed (attempt %s)", chunk[0][0], chunk[-1][0], attempt + 1)
+            if attempt + 1 < _CHUNK_ATTEMPTS:
+                await asyncio.sleep(_RETRY_DELAY * 2**attempt)
+    # пачку не смогли обработать — отдаём в очередь извлечения с её повторами, а сами идём дальше
+    async with SessionFactory() as session:
+        for pid, text in texts.items():
+            add_extraction_job(session, pid, text)
+        await session.commit()
+    return len(texts)
+
+
+class _Progress:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self._started = time.perf_counter()
+        self._reported = 0.0
+
+    def add(self, done: int, failed: int) -> None:
+        self.done += done
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self._reported >= _REPORT_EVERY or self.done >= self.total:
+            self._reported = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = time.perf_counter() - self._started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        logger.info(
+            "Backfill: %s/%s profiles (%.1f%%), failed=%s, %.2f profiles/s, ETA %s",
+            self.done,
+            self.total,
+            100.0 * self.done / self.total if self.total else 100.0,
+            self.failed,
+            rate,
+            "-" if eta == float("inf") else time.strftime("%H:%M:%S", time.gmtime(eta)),
+        )
+
+
+async def run_backfill(
+    name: str, concurrency: int, chunk_size: int, restart: bool = False, force_llm: bool = False
+) -> None:
+    checkpoint = await _load_checkpoint(name, restart)
+    if checkpoint.finished_at is not None:
+        logger.info("Backfill %r already finished at %s; use --restart to run it again", name, checkpoint.finished_at)
+        return
+    last_id, processed, failed = checkpoint.last_profile_id, checkpoint.processed, checkpoint.failed
+    async with SessionFactory() as session:
+        total = await session.scalar(
+            select(func.count()).select_from(_profiles_with_text().where(Profile.id > last_id).subquery())
+        )
+    logger.info(
+        "Backfill %r: resuming after profile_id=%s, %s profiles left, concurrency=%s, chunk=%s, force_llm=%s",
+        name,
+        last_id,
+        total,
+        concurrency,
+        chunk_size,
+        force_llm,
+    )
+    progress = _Progress(total or 0)
+
+    queue: asyncio.Queue[list[tuple[int, str]] | None] = asyncio.Queue(maxsize=concurrency * 2)
+    # пачки завершаются не по порядку; чекпоинт двигаем до границы, за которой всё уже готово
+    dispatched: deque[int] = deque()
+    finished: dict[int, tuple[int, int]] = {}
+    lock = asyncio.Lock()
+
+    async def producer() -> None:
+        async for chunk in _chunks(last_id, chunk_size):
+            dispatched.append(chunk[-1][0])
+            await queue.put(chunk)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def worker() -> None:
+        nonlocal last_id, processed, failed
+        while (chunk := await queue.get()) is not None:
+            chunk_failed = await _process_chunk(chunk, force_llm)
+            async with lock:
+                finished[chunk[-1][0]] = (len(chunk), chunk_failed)
+                advanced = False
+                while dispatched and dispatched[0] in finished:
+                    last_id = dispatched.popleft()
+                    done, bad = finished.pop(last_id)
+                    processed += done
+                    failed += bad
+                    advanced = True
+                if advanced:
+                    await _save_checkpoint(name, last_id, processed, failed)
+                progress.add(len(chunk), chunk_failed)
+
+    await asyncio.gather(producer(), *(worker() for _ in range(concurrency)))
+    await _save_checkpoint(name, last_id, processed, failed, finished=True)
+    logger.info(
+        "Backfill %r finished: %s profiles, %s handed to the extraction queue. "
+        "Match lists: python -m app.matching.precompute",
+        name,
+        processed,
+        failed,
+    )
+
+
+async def main(name: str, concurrency: int, chunk_size: int, restart: bool, force_llm: bool) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    await init_db()
+    try:
+        await run_backfill(name, concurrency, chunk_size, restart, force_llm)
+    finally:
+        await close_openai_client()
+
+
+if __name__ == "__main__":
+    # python -m app.backfill — повторное извлечение атрибутов из текстов всех активных анкет
+    parser = argparse.ArgumentParser(description="Перезапустить извлечение атрибутов для всех активных анкет")
+    parser.add_argument(
+        "--name",
+        default=f"extraction-{PROMPT_VERSION}",
+        help="имя чекпоинта; по умолчанию зависит от версии промпта, и новая версия начинает с начала",
+    )
+    parser.add_argument("--concurrency", type=int, default=settings.extraction_concurrency)
+    parser.add_argument("--chunk-size", type=int, default=settings.extraction_batch_size)
+    parser.add_argument("--restart", action="store_true", help="начать заново, забыв сохранённый прогресс")
+    parser.add_argument(
+        "--no-force-llm",
+        dest="force_llm",
+        action="store_false",
+        help="пропускать через правила и кэш, как обычная очередь; по умолчанию ИИ получает все тексты",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.name, max(1, args.concurrency), max(1, args.chunk_size), args.restart, args.force_llm))
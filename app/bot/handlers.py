@@ -3,11 +3,12 @@ from __future__ import annotations
 import asyncio
 import logging
 import random
+from datetime import datetime
 from pathlib import Path
 from typing import Any
 
-from aiogram import F, Router
-from aiogram.filters import Command, CommandStart
+from aiogram import Bot, F, Router
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     CallbackQuery,
@@ -18,14 +19,36 @@ from aiogram.types import (
     ReplyKeyboardMarkup,
 )
 from aiogram.types.input_file import FSInputFile
-from sqlalchemy import select
+import numpy as np
+from sqlalchemy import or_, select
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.ai.attribute_extractor import extract_profile_attributes_free_text_async
+from app.ai.extraction_cache import cache_stats
+from app.ai.extraction_queue import add_extraction_job, extraction_queue
+from app.ai.local_extractor import local_extraction_stats
+from app.ai.model_health import circuit_breaker, model_availability
+from app.ai.rate_limiter import rate_limiter
 from app.bot.states import Questionnaire
-from app.db.attribute_service import map_extracted_item_to_attribute, get_attribute_by_key, upsert_profile_attribute_value
-from app.db.models import Profile, User
+from app.core.config import settings
+from app.db.attribute_aliases import attribute_matcher
+from app.db.attribute_registry import attribute_registry
+from app.db.attribute_service import (
+    AttributeValueInput,
+    get_attribute_by_key,
+    merge_profile_attribute_values,
+)
+from app.db import fulltext
+from app.db.compaction import supersede_previous_profiles
+from app.db.models import Profile, ProfileSearch, User
+from app.db.preferences import mutual_candidate_ids, mutual_preference_clauses
+from app.db.profile_search import refresh_profile_search
+from app.db.saved_searches import disable_saved_search, match_saved_searches, refresh_saved_searches, save_search
 from app.db.session import SessionFactory
+from app.geo.filters import GeoFilter, build_geo_filter, decode_geo_token, geo_candidate_ids, parse_geo_scope
+from app.matching.engine import match_engine
+from app.matching.precompute import match_precomputer, read_match_list
+from app.matching.seen import contains, filter_unseen, load_seen, mark_seen, reset_seen
+from app.matching.text_index import profile_vectors, store_profile_vectors, text_index
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -34,40 +57,17 @@ APP_DIR = Path(__file__).resolve().parents[1]
 BROTHER_IMG = APP_DIR / "brother.png"
 SISTER_IMG = APP_DIR / "sister.png"
 
-AQIDA_LABELS = {
-    "AHLU_SUNNA": "Ахлю-Сунна",
-    "SALAFI": "Саляфи",
-    "OTHER": "Другое",
-    "UNKNOWN": "Не знаю",
-}
-
-MARITAL_LABELS = {
-    "NEVER_MARRIED": "Не был(а) женат(а)",
-    "MARRIED": "Женат/замужем",
-    "DIVORCED": "В разводе",
-    "WIDOWED": "Вдовец/вдова",
-}
-
-CHILDREN_LABELS = {
-    "NONE": "Нет",
-    "HAS_1": "Есть: 1",
-    "HAS_2": "Есть: 2",
-    "HAS_3PLUS": "Есть: 3+",
-    "UNKNOWN": "Не хочу указывать",
-}
-
-POLYGYNY_LABELS_BROTHER = {
-    "MONOGAMY_ONLY": "Хочу только единобрачие",
-    "OPEN_TO_POLYGYNY": "Допускаю многоженство",
-    "SEEKS_POLYGYNY": "Хочу/планирую многоженство",
-    "NEUTRAL": "Не важно/не обсуждал",
-}
-
-POLYGYNY_LABELS_SISTER = {
-    "MONOGAMY_ONLY": "Хочу только единобрачие",
-    "OPEN_TO_POLYGYNY": "Допускаю многоженство",
-    "NEUTRAL": "Не важно/не обсуждала",
-}
+# сестрам не предлагаем вариант SEEKS_POLYGYNY; подписи вариантов берутся из attribute_registry
+SISTER_POLYGYNY_CODES = ("MONOGAMY_ONLY", "OPEN_TO_POLYGYNY", "NEUTRAL")
+# пауза между уведомлениями: Telegram ограничивает ~30 сообщений в секунду
+_NOTIFY_INTERVAL = 0.05
+
+
+def polygyny_codes(gender: str | None) -> list[str]:
+    codes = attribute_registry.option_codes("polygyny_attitude")
+    if gender == "SISTER":
+        return [c for c in codes if c in SISTER_POLYGYNY_CODES]
+    return codes
 
 
 def main_kb() -> ReplyKeyboardMarkup:
@@ -106,50 +106,38 @@ def kb_from_rows(rows: list[list[tuple[str, str]]]) -> InlineKeyboardMarkup:
     )
 
 
-def aqida_kb() -> InlineKeyboardMarkup:
+def options_kb(key: str, prefix: str, layout: list[list[str]]) -> InlineKeyboardMarkup:
     return kb_from_rows(
-        [
-            [("Ахлю-Сунна", "aq:AHLU_SUNNA"), ("Саляфи", "aq:SALAFI")],
-            [("Другое", "aq:OTHER"), ("Не знаю", "aq:UNKNOWN")],
-        ]
+        [[(_label(code, key), f"{prefix}:{code}") for code in row] for row in layout]
+    )
+
+
+def aqida_kb() -> InlineKeyboardMarkup:
+    return options_kb(
+        "aqida_manhaj",
+        "aq",
+        [["AHLU_SUNNA", "SALAFI"], ["OTHER", "UNKNOWN"]],
     )
 
 
 def marital_status_kb() -> InlineKeyboardMarkup:
-    return kb_from_rows(
-        [
-            [("Не был(а) женат(а)", "ms:NEVER_MARRIED")],
-            [("Женат/замужем", "ms:MARRIED")],
-            [("В разводе", "ms:DIVORCED"), ("Вдовец/вдова", "ms:WIDOWED")],
-        ]
+    return options_kb(
+        "marital_status",
+        "ms",
+        [["NEVER_MARRIED"], ["MARRIED"], ["DIVORCED", "WIDOWED"]],
     )
 
 
 def children_kb() -> InlineKeyboardMarkup:
-    return kb_from_rows(
-        [
-            [("Нет", "ch:NONE"), ("Есть: 1", "ch:HAS_1")],
-            [("Есть: 2", "ch:HAS_2"), ("Есть: 3+", "ch:HAS_3PLUS")],
-            [("Не хочу указывать", "ch:UNKNOWN")],
-        ]
+    return options_kb(
+        "children",
+        "ch",
+        [["NONE", "HAS_1"], ["HAS_2", "HAS_3PLUS"], ["UNKNOWN"]],
     )
 
 
 def polygyny_kb(gender: str | None) -> InlineKeyboardMarkup:
-    if gender == "SISTER":
-        rows = [
-            [("Хочу только единобрачие", "poly:MONOGAMY_ONLY")],
-            [("Допускаю многоженство", "poly:OPEN_TO_POLYGYNY")],
-            [("Не важно/не обсуждала", "poly:NEUTRAL")],
-        ]
-    else:
-        rows = [
-            [("Хочу только единобрачие", "poly:MONOGAMY_ONLY")],
-            [("Допускаю многоженство", "poly:OPEN_TO_POLYGYNY")],
-            [("Хочу/планирую многоженство", "poly:SEEKS_POLYGYNY")],
-            [("Не важно/не обсуждал", "poly:NEUTRAL")],
-        ]
-    return kb_from_rows(rows)
+    return options_kb("polygyny_attitude", "poly", [[code] for code in polygyny_codes(gender)])
 
 
 def preview_kb() -> InlineKeyboardMarkup:
@@ -181,10 +169,10 @@ def gender_label(gender: str | None) -> str:
     return "Брат" if gender == "BROTHER" else ("Сестра" if gender == "SISTER" else "")
 
 
-def _label(value: str | None, mapping: dict[str, str]) -> str:
+def _label(value: str | None, key: str) -> str:
     if not value:
         return "-"
-    return mapping.get(value, value)
+    return attribute_registry.option_label(key, value) or value
 
 
 def _short(text: str | None, limit: int = 300) -> str:
@@ -203,10 +191,10 @@ def build_preview_text(data: dict) -> str:
         f"🎂 <b>Возраст:</b> {data.get('age', '-')}",
         f"📍 <b>Локация:</b> {data.get('location', '-')}",
         f"🌍 <b>Национальность:</b> {data.get('nationality', '-')}",
-        f"🕌 <b>Акъыда/манхадж:</b> {_label(data.get('aqida_manhaj'), AQIDA_LABELS)}",
-        f"💍 <b>Семейное положение:</b> {_label(data.get('marital_status'), MARITAL_LABELS)}",
-        f"👶 <b>Дети:</b> {_label(data.get('children'), CHILDREN_LABELS)}",
-        f"👫 <b>Отношение к многоженству:</b> {data.get('polygyny_label', '-')}",
+        f"🕌 <b>Акъыда/манхадж:</b> {_label(data.get('aqida_manhaj'), 'aqida_manhaj')}",
+        f"💍 <b>Семейное положение:</b> {_label(data.get('marital_status'), 'marital_status')}",
+        f"👶 <b>Дети:</b> {_label(data.get('children'), 'children')}",
+        f"👫 <b>Отношение к многоженству:</b> {_label(data.get('polygyny_attitude'), 'polygyny_attitude')}",
         "──────────────────",
         f"✍️ <b>О себе:</b> {free_text}",
     ]
@@ -228,12 +216,9 @@ def random_profile_data(gender: str | None) -> dict[str, Any]:
         "Душанбе, Таджикистан",
         "Алматы, Казахстан",
     ]
-    aqida_codes = list(AQIDA_LABELS.keys())
-    marital_codes = list(MARITAL_LABELS.keys())
-    children_codes = list(CHILDREN_LABELS.keys())
-    polygyny_codes = list(
-        (POLYGYNY_LABELS_SISTER if gender == "SISTER" else POLYGYNY_LABELS_BROTHER).keys()
-    )
+    aqida_codes = attribute_registry.option_codes("aqida_manhaj")
+    marital_codes = attribute_registry.option_codes("marital_status")
+    children_codes = attribute_registry.option_codes("children")
 
     return {
         "age": str(random.randint(18, 40)),
@@ -242,7 +227,7 @@ def random_profile_data(gender: str | None) -> dict[str, Any]:
         "aqida_manhaj": random.choice(aqida_codes),
         "marital_status": random.choice(marital_codes),
         "children": random.choice(children_codes),
-        "polygyny_attitude": random.choice(polygyny_codes),
+        "polygyny_attitude": random.choice(polygyny_codes(gender)),
         "free_text": "Люблю читать, развиваться, ценю искренность и уважение. "
         "Ищу серьезные намерения и общие ценности.",
     }
@@ -284,7 +269,7 @@ async def update_user_gender(tg_id: int, username: str | None, gender: str) -> U
         return user
 
 
-async def create_profile_for_user(user: User, data: dict) -> int:
+async def create_profile_for_user(user: User, data: dict, bot: Bot | None = None) -> int:
     async with SessionFactory() as session:
         res = await session.execute(select(User).where(User.telegram_id == user.telegram_id))
         db_user = res.scalar_one_or_none()
@@ -312,6 +297,10 @@ async def create_profile_for_user(user: User, data: dict) -> int:
         session.add(profile)
         await session.flush()
 
+        # одна актуальная анкета на пользователя: прежние уходят в SUPERSEDED и позже удаляются компакцией
+        db_user.current_profile_id = profile.id
+        superseded = await supersede_previous_profiles(session, db_user.id, profile.id)
+
         canonical_keys = [
             "age",
             "location",
@@ -322,6 +311,7 @@ async def create_profile_for_user(user: User, data: dict) -> int:
             "polygyny_attitude",
         ]
         enum_keys = {"aqida_manhaj", "marital_status", "children", "polygyny_attitude"}
+        rows: list[AttributeValueInput] = []
         for key in canonical_keys:
             attr = await get_attribute_by_key(session, key)
             if attr is None:
@@ -330,50 +320,37 @@ async def create_profile_for_user(user: User, data: dict) -> int:
             if not value:
                 continue
             option_code = value if key in enum_keys else None
-            await upsert_profile_attribute_value(
-                session=session,
-                profile_id=profile.id,
-                attribute=attr,
-                value=str(value),
-                option_code=option_code,
-                confidence=1.0,
-                evidence=None,
+            rows.append(
+                AttributeValueInput(
+                    profile_id=profile.id,
+                    attribute=attr,
+                    value=str(value),
+                    option_code=option_code,
+                    confidence=1.0,
+                    evidence=None,
+                    source="USER",
+                )
             )
+        await merge_profile_attribute_values(session, rows)
+        await refresh_profile_search(session, [profile.id])
+        await refresh_saved_searches(session, [profile.id])
 
-        await session.commit()
-        return profile.id
-
+        if profile.about_me_text:
+            add_extraction_job(session, profile.id, profile.about_me_text)
 
-async def extract_and_persist(profile_id: int, free_text: str) -> None:
-    if not free_text or len(free_text) < 10:
-        return
-    try:
-        items = await extract_profile_attributes_free_text_async(free_text)
-    except Exception:
-        logger.exception("AI attribute extraction failed")
-        return
+        about_vec, looking_vec = profile_vectors(profile.about_me_text, profile.looking_for_text)
+        await store_profile_vectors(session, profile.id, about_vec, looking_vec)
 
-    async with SessionFactory() as session:
-        for item in items:
-            try:
-                attribute, normalized = await map_extracted_item_to_attribute(session, item)
-                value = str(normalized.get("value", "")).strip()
-                if not value:
-                    continue
-                confidence = float(normalized.get("confidence", 1.0))
-                evidence = normalized.get("evidence")
-                await upsert_profile_attribute_value(
-                    session=session,
-                    profile_id=profile_id,
-                    attribute=attribute,
-                    value=value,
-                    option_code=None,
-                    confidence=confidence,
-                    evidence=evidence,
-                )
-            except Exception:
-                logger.exception("Failed to persist extracted item: %s", item)
         await session.commit()
+    text_index.remove(superseded)
+    text_index.add(profile.id, db_user.gender, about_vec, looking_vec)
+    match_engine.invalidate()
+    match_precomputer.schedule([profile.id, *superseded])
+    extraction_queue.notify()
+    if bot is not None:
+        # новую анкету один раз сверяем с сохранёнными поисками; ответ пользователю не ждёт рассылки
+        _spawn(notify_saved_searches(bot, profile.id))
+    return profile.id
 
 
 async def ensure_gender_or_ask(message: Message, state: FSMContext) -> User | None:
@@ -453,18 +430,9 @@ async def handle_quick_fill(message: Message, state: FSMContext, gender: str) ->
     await state.clear()
     user = await update_user_gender(message.from_user.id, message.from_user.username, gender)
     data = random_profile_data(gender)
-    profile_id = await create_profile_for_user(user, data)
-    asyncio.create_task(extract_and_persist(profile_id, data.get("free_text") or ""))
-
-    pretty = build_preview_text(
-        {
-            **data,
-            "polygyny_label": _label(
-                data.get("polygyny_attitude"),
-                POLYGYNY_LABELS_SISTER if gender == "SISTER" else POLYGYNY_LABELS_BROTHER,
-            ),
-        }
-    )
+    await create_profile_for_user(user, data, message.bot)
+
+    pretty = build_preview_text(data)
     await send_icon_if_exists(message, user.gender)
     await message.answer(
         "✅ Анкета создана автоматически.\n\n"
@@ -574,11 +542,6 @@ async def q_free_text(message: Message, state: FSMContext) -> None:
     data = await state.get_data()
     user = await get_user(message.from_user.id)
     gender = user.gender if user else None
-    polygyny_label = _label(
-        data.get("polygyny_attitude"),
-        POLYGYNY_LABELS_SISTER if gender == "SISTER" else POLYGYNY_LABELS_BROTHER,
-    )
-    data["polygyny_label"] = polygyny_label
     pretty = build_preview_text(data)
 
     await send_icon_if_exists(message, gender)
@@ -604,11 +567,9 @@ async def preview_confirm(call: CallbackQuery, state: FSMContext) -> None:
             return
 
         data = await state.get_data()
-        free_text = (data.get("free_text") or "").strip()
-        profile_id = await create_profile_for_user(user, data)
+        await create_profile_for_user(user, data, call.bot)
 
         await state.clear()
-        asyncio.create_task(extract_and_persist(profile_id, free_text))
 
         await call.message.answer(
             "✅ Анкета сохранена.\n\nНажмите: 🔍 Найти",
@@ -627,30 +588,225 @@ async def preview_confirm(call: CallbackQuery, state: FSMContext) -> None:
         )
 
 
+def profile_caption(profile: Profile, u: User, score: float | None = None) -> str:
+    polygyny_label = _label(profile.polygyny, "polygyny_attitude")
+    header = f"Анкета #{profile.id}\n"
+    if score is not None:
+        header += f"💞 Совпадение: {round(score * 100)}%\n"
+    return (
+        header
+        + f"🧑‍⚕️ {gender_label(u.gender)}\n\n"
+        f"🎂 <b>Возраст:</b> {profile.age or '-'}\n"
+        f"🌍 <b>Национальность:</b> {profile.nationality or '-'}\n"
+        f"💍 <b>Семейное положение:</b> {_label(profile.marital_status, 'marital_status')}\n"
+        f"📍 <b>Локация:</b> {profile.city or '-'}\n"
+        f"🕌 <b>Акъыда/манхадж:</b> {_label(profile.aqida, 'aqida_manhaj')}\n"
+        f"👶 <b>Дети:</b> {_label(profile.children, 'children')}\n"
+        f"👫 <b>Многоженство:</b> {polygyny_label}\n"
+        "──────────────────\n"
+        f"✍️ <b>О себе:</b> {_short(profile.about_me_text)}\n"
+    )
+
+
+async def send_profile_card(message: Message, profile: Profile, u: User, score: float | None = None) -> None:
+    img = icon_path(u.gender)
+    caption = profile_caption(profile, u, score)
+    if img and img.exists():
+        await message.answer_photo(
+            FSInputFile(img),
+            caption=caption[:1024],
+            parse_mode="HTML",
+        )
+    else:
+        await message.answer(caption, parse_mode="HTML")
+
+
+async def get_current_profile(session, user: User) -> Profile | None:
+    if user.current_profile_id is not None:
+        profile = await session.get(Profile, user.current_profile_id)
+        if profile is not None:
+            return profile
+    stmt = (
+        select(Profile)
+        .where(Profile.user_id == user.id)
+        .order_by(Profile.created_at.desc())
+        .limit(1)
+    )
+    return (await session.execute(stmt)).scalar_one_or_none()
+
+
+async def load_profiles_with_users(session, profile_ids: list[int]) -> list[tuple[Profile, User]]:
+    if not profile_ids:
+        return []
+    stmt = select(Profile, User).join(User, User.id == Profile.user_id).where(Profile.id.in_(profile_ids))
+    by_id = {profile.id: (profile, u) for profile, u in (await session.execute(stmt)).all()}
+    return [by_id[pid] for pid in profile_ids if pid in by_id]
+
+
+FIND_MORE_PREFIX = "find:more"
+SEARCH_SAVE = "search:save"
+SEARCH_OFF = "search:off"
+_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+# страница добирается пачками по limit * _BROWSE_OVERFETCH ключей, не больше _BROWSE_MAX_SCANS пачек
+_BROWSE_OVERFETCH = 4
+_BROWSE_MAX_SCANS = 10
+FIND_USAGE = (
+    "Поиск: /find — лучшие совпадения, /find город — из вашего города, "
+    "/find страна — из вашей страны, /find 100 — в радиусе 100 км."
+)
+
+
+def encode_cursor(position: tuple[datetime, int]) -> str:
+    created_at, profile_id = position
+    return f"{created_at.strftime(_CURSOR_FORMAT)}:{profile_id}"
+
+
+def decode_cursor(raw: str) -> tuple[datetime, int] | None:
+    try:
+        ts, pid = raw.split(":", 1)
+        return datetime.strptime(ts, _CURSOR_FORMAT), int(pid)
+    except ValueError:
+        return None
+
+
+def find_more_kb(cursor: str | None, with_save: bool = False, geo: GeoFilter | None = None) -> InlineKeyboardMarkup:
+    data = f"{FIND_MORE_PREFIX}:{cursor}" if cursor else FIND_MORE_PREFIX
+    if geo is not None:
+        # гео-фильтр едет вместе с курсором, чтобы следующие страницы были из того же города/радиуса
+        data = f"{data}/{geo.scope.token}"
+    rows = [[("➡️ Показать ещё", data)]]
+    if with_save:
+        rows.append([("🔔 Сообщать о новых анкетах", SEARCH_SAVE)])
+    return kb_from_rows(rows)
+
+
+async def browse_page(
+    session,
+    target_gender: str,
+    viewer_user_id: int,
+    cursor: tuple[datetime, int] | None,
+    limit: int,
+    own: ProfileSearch | None = None,
+    seen: np.ndarray | None = None,
+    geo: GeoFilter | None = None,
+) -> tuple[list[tuple[Profile, User]], tuple[datetime, int] | None]:
+    # ключи страницы — из profile_search по индексу (gender, created_at, profile_id), карточки — по PK
+    stmt = select(ProfileSearch.profile_id, ProfileSearch.created_at, ProfileSearch.lat, ProfileSearch.lon).where(
+        ProfileSearch.gender == target_gender,
+        ProfileSearch.user_id != viewer_user_id,
+    )
+    if own is not None:
+        stmt = stmt.where(*await mutual_preference_clauses(session, own))
+    if geo is not None:
+        stmt = stmt.where(*geo.clauses())
+    stmt = stmt.order_by(ProfileSearch.created_at.desc(), ProfileSearch.profile_id.desc())
+
+    # просмотренные отсекаем на стороне Python по отсортированному массиву: NOT IN на тысячи id медленнее
+    batch = limit * _BROWSE_OVERFETCH
+    found: list[int] = []
+    position = cursor
+    exhausted = False
+    for _ in range(_BROWSE_MAX_SCANS):
+        page = stmt
+        if position is not None:
+            created_at, last_id = position
+            # keyset: строго «после» последней просмотренной анкеты в порядке (created_at DESC, id DESC)
+            page = page.where(
+                ProfileSearch.created_at <= created_at,
+                or_(ProfileSearch.created_at < created_at, ProfileSearch.profile_id < last_id),
+            )
+        keys = (await session.execute(page.limit(batch))).all()
+        hidden = contains(seen, [pid for pid, *_ in keys]) if seen is not None else [False] * len(keys)
+        for (pid, created_at, lat, lon), was_seen in zip(keys, hidden):
+            position = (created_at, pid)
+            if not was_seen and (geo is None or geo.accepts(lat, lon)):
+                found.append(pid)
+                if len(found) == limit:
+                    break
+        if len(found) == limit:
+            break
+        if len(keys) < batch:
+            exhausted = True
+            break
+    rows = await load_profiles_with_users(session, found)
+    return rows, None if exhausted else position
+
+
 @router.message(Command("find"))
 @router.message(F.text == "🔍 Найти")
-async def find_handler(message: Message, state: FSMContext) -> None:
+async def find_handler(message: Message, state: FSMContext, command: CommandObject | None = None) -> None:
     user = await ensure_gender_or_ask(message, state)
     if user is None:
         return
 
+    try:
+        scope = parse_geo_scope(command.args if command is not None else None)
+    except ValueError:
+        await message.answer(FIND_USAGE)
+        return
+
     target_gender = "SISTER" if user.gender == "BROTHER" else "BROTHER"
 
+    scores: dict[int, float] = {}
+    next_cursor: str | None = None
+    rows: list[tuple[Profile, User]] = []
+    geo: GeoFilter | None = None
     async with SessionFactory() as session:
-        stmt = (
-            select(Profile, User)
-            .join(User, User.id == Profile.user_id)
-            .where(
-                Profile.status == "ACTIVE",
-                User.gender == target_gender,
-                User.telegram_id != message.from_user.id,
+        seen = await load_seen(session, user.id)
+        own = await get_current_profile(session, user)
+        if scope is not None and own is not None:
+            geo = build_geo_filter(await session.get(ProfileSearch, own.id), scope)
+        if scope is not None and geo is None:
+            # своя локация не распознана — фильтровать не от чего
+            if own is None:
+                await message.answer("Сначала заполните анкету: 📝 Заполнить/обновить анкету")
+            else:
+                await message.answer(
+                    "Не удалось определить ваш город по анкете. "
+                    "Укажите локацию в виде «Город, Страна», например «Казань, Россия»."
+                )
+            return
+        if own is not None:
+            geo_ids = await geo_candidate_ids(session, geo, target_gender, user.id) if geo is not None else None
+            stored = await read_match_list(session, own.id, settings.match_precompute_k)
+            if geo_ids is not None:
+                nearby = set(geo_ids)
+                stored = [m for m in stored if m[0] in nearby]
+            unseen = set(filter_unseen(seen, [pid for pid, _ in stored]))
+            matches = [m for m in stored if m[0] in unseen][: settings.match_top_k]
+            if not matches or (geo_ids is not None and len(matches) < settings.match_top_k):
+                # список ещё не посчитан или уже весь просмотрен — считаем на лету без просмотренных
+                allowed = await mutual_candidate_ids(session, own.id, target_gender)
+                if geo_ids is not None:
+                    allowed = geo_ids if allowed is None else sorted(set(allowed) & set(geo_ids))
+                matches = await match_engine.top_matches(
+                    session, own.id, target_gender, settings.match_top_k, exclude_ids=seen, allowed_ids=allowed
+                )
+            scores = dict(matches)
+            rows = await load_profiles_with_users(session, [pid for pid, _ in matches])
+        else:
+            # без своей анкеты сравнивать не с чем — показываем новые анкеты
+            rows, position = await browse_page(
+                session, target_gender, user.id, None, settings.find_page_size, seen=seen
             )
-            .order_by(Profile.created_at.desc())
-            .limit(5)
-        )
-        rows = (await session.execute(stmt)).all()
+            if position is not None:
+                next_cursor = encode_cursor(position)
+        if rows:
+            await mark_seen(session, user.id, [profile.id for profile, _ in rows])
+            await session.commit()
 
     if not rows:
+        if geo is not None:
+            await message.answer(
+                "Рядом пока нет новых подходящих анкет. Попробуйте /find страна или /find без фильтра."
+            )
+            return
+        if len(seen):
+            await message.answer(
+                "✨ Новых анкет пока нет — все подходящие вы уже видели.\n"
+                "Показать их заново: /reset_seen"
+            )
+            return
         await message.answer(
             "Пока нет анкет подходящего пола в базе.\n"
             "Для теста создайте анкету с другого аккаунта."
@@ -660,34 +816,196 @@ async def find_handler(message: Message, state: FSMContext) -> None:
     await message.answer("🔍 Результаты поиска (ник/username скрыт):")
 
     for profile, u in rows:
-        img = icon_path(u.gender)
-        polygyny_label = _label(
-            profile.polygyny,
-            POLYGYNY_LABELS_SISTER if u.gender == "SISTER" else POLYGYNY_LABELS_BROTHER,
-        )
-        caption = (
-            f"Анкета #{profile.id}\n"
-            f"🧑‍⚕️ {gender_label(u.gender)}\n\n"
-            f"🎂 <b>Возраст:</b> {profile.age or '-'}\n"
-            f"🌍 <b>Национальность:</b> {profile.nationality or '-'}\n"
-            f"💍 <b>Семейное положение:</b> {_label(profile.marital_status, MARITAL_LABELS)}\n"
-            f"📍 <b>Локация:</b> {profile.city or '-'}\n"
-            f"🕌 <b>Акъыда/манхадж:</b> {_label(profile.aqida, AQIDA_LABELS)}\n"
-            f"👶 <b>Дети:</b> {_label(profile.children, CHILDREN_LABELS)}\n"
-            f"👫 <b>Многоженство:</b> {polygyny_label}\n"
-            "──────────────────\n"
-            f"✍️ <b>О себе:</b> {_short(profile.about_me_text)}\n"
+        await send_profile_card(message, profile, u, scores.get(profile.id))
+
+    await message.answer(
+        "✨ Хотите посмотреть другие анкеты? Нажмите «Показать ещё». "
+        "Обновить свою — 👤 Моя анкета.",
+        reply_markup=find_more_kb(next_cursor, with_save=True, geo=geo),
+    )
+
+
+@router.callback_query(F.data.startswith(FIND_MORE_PREFIX))
+async def find_more(call: CallbackQuery) -> None:
+    await call.answer()
+    user = await get_user(call.from_user.id)
+    if user is None or not user.gender:
+        await call.message.answer("Сначала выберите: вы брат или сестра.", reply_markup=gender_kb())
+        return
+
+    raw, _, token = call.data[len(FIND_MORE_PREFIX) :].lstrip(":").partition("/")
+    cursor = decode_cursor(raw) if raw else None
+    scope = decode_geo_token(token)
+    target_gender = "SISTER" if user.gender == "BROTHER" else "BROTHER"
+
+    async with SessionFactory() as session:
+        own = await session.get(ProfileSearch, user.current_profile_id) if user.current_profile_id else None
+        geo = build_geo_filter(own, scope) if scope is not None else None
+        seen = await load_seen(session, user.id)
+        rows, position = await browse_page(
+            session, target_gender, user.id, cursor, settings.find_page_size, own, seen, geo
         )
-        if img and img.exists():
-            await message.answer_photo(
-                FSInputFile(img),
-                caption=caption[:1024],
-                parse_mode="HTML",
-            )
-        else:
-            await message.answer(caption, parse_mode="HTML")
+        if rows:
+            await mark_seen(session, user.id, [profile.id for profile, _ in rows])
+            await session.commit()
+
+    try:
+        await call.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+
+    if not rows:
+        await call.message.answer("✨ Больше анкет нет. Загляните позже.")
+        return
+
+    for profile, u in rows:
+        await send_profile_card(call.message, profile, u)
 
-    await message.answer("✨ Это все найденные анкеты. Хотите обновить свою? Нажмите 👤 Моя анкета.")
+    if position is None:
+        await call.message.answer("✨ Это все анкеты на сегодня.")
+        return
+    await call.message.answer(
+        "Показать следующие анкеты?",
+        reply_markup=find_more_kb(encode_cursor(position), geo=geo),
+    )
+
+
+@router.message(Command("search"))
+async def search_handler(message: Message, state: FSMContext, command: CommandObject) -> None:
+    user = await ensure_gender_or_ask(message, state)
+    if user is None:
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Напишите слова для поиска по тексту анкет, например: /search хафиз Корана")
+        return
+    if not fulltext.fulltext_enabled:
+        await message.answer("Поиск по тексту анкет сейчас недоступен.")
+        return
+
+    target_gender = "SISTER" if user.gender == "BROTHER" else "BROTHER"
+    async with SessionFactory() as session:
+        ids = await fulltext.search_profile_ids(session, query, target_gender, user.id, settings.find_page_size)
+        rows = await load_profiles_with_users(session, ids)
+
+    if not rows:
+        await message.answer(f"По запросу «{query}» ничего не нашлось.")
+        return
+
+    await message.answer(f"🔎 Анкеты по запросу «{query}»:")
+    for profile, u in rows:
+        await send_profile_card(message, profile, u)
+
+
+@router.message(Command("similar"))
+async def similar_handler(message: Message, state: FSMContext) -> None:
+    user = await ensure_gender_or_ask(message, state)
+    if user is None:
+        return
+
+    target_gender = "SISTER" if user.gender == "BROTHER" else "BROTHER"
+    async with SessionFactory() as session:
+        own = await get_current_profile(session, user)
+        matches = text_index.top_k(own.id, target_gender, settings.find_page_size) if own is not None else []
+        rows = await load_profiles_with_users(session, [pid for pid, _ in matches])
+
+    if own is None:
+        await message.answer("Сначала заполните анкету: 📝 Заполнить/обновить анкету")
+        return
+    if not rows:
+        await message.answer("Пока не нашлось анкет, похожих по тексту. Расскажите о себе подробнее в анкете.")
+        return
+
+    scores = dict(matches)
+    await message.answer("📝 Анкеты, близкие по тексту «О себе»:")
+    for profile, u in rows:
+        await send_profile_card(message, profile, u, scores.get(profile.id))
+
+
+@router.message(Command("reset_seen"))
+async def reset_seen_handler(message: Message, state: FSMContext) -> None:
+    user = await ensure_gender_or_ask(message, state)
+    if user is None:
+        return
+    async with SessionFactory() as session:
+        await reset_seen(session, user.id)
+        await session.commit()
+    await message.answer("🔄 Готово. Просмотренные анкеты снова будут показываться в поиске.")
+
+
+@router.callback_query(F.data == SEARCH_SAVE)
+async def on_search_save(call: CallbackQuery) -> None:
+    user = await get_user(call.from_user.id)
+    if user is None or not user.gender:
+        await call.answer()
+        await call.message.answer("Сначала выберите: вы брат или сестра.", reply_markup=gender_kb())
+        return
+    target_gender = "SISTER" if user.gender == "BROTHER" else "BROTHER"
+    async with SessionFactory() as session:
+        search = await save_search(session, user, target_gender)
+        await session.commit()
+    if search is None:
+        await call.answer()
+        await call.message.answer("Сначала заполните анкету: 📝 Заполнить/обновить анкету")
+        return
+    await call.answer("Поиск сохранён")
+    await call.message.answer(
+        "🔔 Готово. Когда появится подходящая анкета, я пришлю её сюда.",
+        reply_markup=kb_from_rows([[("🔕 Отключить уведомления", SEARCH_OFF)]]),
+    )
+
+
+@router.callback_query(F.data == SEARCH_OFF)
+async def on_search_off(call: CallbackQuery) -> None:
+    user = await get_user(call.from_user.id)
+    disabled = False
+    if user is not None:
+        async with SessionFactory() as session:
+            disabled = await disable_saved_search(session, user.id)
+            await session.commit()
+    await call.answer("Уведомления отключены" if disabled else "Уведомления уже отключены")
+    try:
+        await call.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> None:
+    # держим ссылку, иначе задачу может собрать сборщик мусора до завершения
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def notify_saved_searches(bot: Bot, profile_id: int) -> None:
+    try:
+        async with SessionFactory() as session:
+            recipients = await match_saved_searches(session, profile_id)
+            await session.commit()
+            rows = await load_profiles_with_users(session, [profile_id]) if recipients else []
+    except Exception:
+        logger.exception("Saved search matching failed for profile %s", profile_id)
+        return
+    if not rows:
+        return
+
+    profile, u = rows[0]
+    caption = "🔔 Новая анкета по вашему поиску\n\n" + profile_caption(profile, u)
+    off_kb = kb_from_rows([[("🔕 Отключить уведомления", SEARCH_OFF)]])
+    sent = 0
+    for _, telegram_id in recipients:
+        try:
+            await bot.send_message(telegram_id, caption, parse_mode="HTML", reply_markup=off_kb)
+            sent += 1
+        except Exception as e:
+            # пользователь мог заблокировать бота — остальным всё равно отправляем
+            logger.warning("Saved search notification to %s failed: %s", telegram_id, e)
+        await asyncio.sleep(_NOTIFY_INTERVAL)
+    logger.info("Profile %s matched %s saved searches, notified %s", profile_id, len(recipients), sent)
 
 
 @router.message(Command("my_profile"))
@@ -698,30 +1016,21 @@ async def my_profile(message: Message, state: FSMContext) -> None:
         return
 
     async with SessionFactory() as session:
-        stmt = (
-            select(Profile)
-            .where(Profile.user_id == user.id)
-            .order_by(Profile.created_at.desc())
-            .limit(1)
-        )
-        profile = (await session.execute(stmt)).scalar_one_or_none()
+        profile = await get_current_profile(session, user)
 
     if profile is None:
         await message.answer("У вас пока нет анкеты. Нажмите: 📝 Заполнить/обновить анкету")
         return
 
-    polygyny_label = _label(
-        profile.polygyny,
-        POLYGYNY_LABELS_SISTER if user.gender == "SISTER" else POLYGYNY_LABELS_BROTHER,
-    )
+    polygyny_label = _label(profile.polygyny, "polygyny_attitude")
     caption = (
         "🧾 Ваша анкета:\n\n"
         f"🎂 <b>Возраст:</b> {profile.age or '-'}\n"
         f"🌍 <b>Национальность:</b> {profile.nationality or '-'}\n"
-        f"💍 <b>Семейное положение:</b> {_label(profile.marital_status, MARITAL_LABELS)}\n"
+        f"💍 <b>Семейное положение:</b> {_label(profile.marital_status, 'marital_status')}\n"
         f"📍 <b>Локация:</b> {profile.city or '-'}\n"
-        f"🕌 <b>Акъыда/манхадж:</b> {_label(profile.aqida, AQIDA_LABELS)}\n"
-        f"👶 <b>Дети:</b> {_label(profile.children, CHILDREN_LABELS)}\n"
+        f"🕌 <b>Акъыда/манхадж:</b> {_label(profile.aqida, 'aqida_manhaj')}\n"
+        f"👶 <b>Дети:</b> {_label(profile.children, 'children')}\n"
         f"👫 <b>Многоженство:</b> {polygyny_label}\n"
         "──────────────────\n"
         f"✍️ <b>О себе:</b> {_short(profile.about_me_text)}\n"
@@ -745,6 +1054,39 @@ async def my_profile_edit(call: CallbackQuery, state: FSMContext) -> None:
     await start_questionnaire(call.message, state)
 
 
+def is_admin(message: Message) -> bool:
+    return bool(settings.admin_chat_id) and message.chat.id == settings.admin_chat_id
+
+
+@router.message(Command("stats"))
+async def stats_handler(message: Message) -> None:
+    if not is_admin(message):
+        await message.answer("Используйте кнопки меню или /start", reply_markup=main_kb())
+        return
+
+    pending = await extraction_queue.pending_count()
+    cache = cache_stats.as_dict()
+    limits = rate_limiter.snapshot()
+    lines = [
+        "📊 Статистика",
+        f"Очередь извлечения: {pending} в ожидании, {extraction_queue.in_flight} в работе",
+        f"Кэш извлечения: hits={cache['hits']} misses={cache['misses']} "
+        f"hit_rate={cache['hit_rate']:.0%} evictions={cache['evictions']}",
+        f"Извлечение правилами: {local_extraction_stats.local_only} без ИИ, "
+        f"{local_extraction_stats.sent_to_llm} отправлено в ИИ",
+        f"Атрибуты: {len(attribute_registry.all())}, алиасов {len(attribute_matcher.aliases)}, "
+        f"сопоставлено по алиасам {attribute_matcher.stats.alias_hits}, "
+        f"по опечаткам {attribute_matcher.stats.fuzzy_hits}",
+        f"Списки кандидатов: {match_precomputer.pending_count} ждут пересчёта",
+        f"OpenAI: breaker={circuit_breaker.state}, "
+        f"недоступные модели={', '.join(model_availability.snapshot()['unavailable']) or '-'}",
+        f"Лимитер OpenAI: параллельно {limits['in_flight']}/{limits['concurrency']}, очередь {limits['queue']}, "
+        f"RPM {limits['requests_left']}/{limits['rpm']}, TPM {limits['tokens_left']}/{limits['tpm']}, "
+        f"пауза {limits['paused_for']}s, 429/5xx={limits['throttled']}",
+    ]
+    await message.answer("\n".join(lines))
+
+
 @router.message()
 async def fallback(message: Message) -> None:
     await message.answer("Используйте кнопки меню или /start", reply_markup=main_kb())
@@ -7,6 +7,101 @@ class Settings(BaseSettings):
     db_url: str = "sqlite+aiosqlite:///./bot.db"
     openai_api_key: str | None = None
     openai_model: str = "gpt-5-nano"
+    # base_url можно направить на локальный stub-сервер
+    openai_base_url: str | None = None
+    openai_request_timeout: float = 60.0
+    openai_connect_timeout: float = 10.0
+    openai_max_retries: int = 0
+    openai_max_connections: int = 20
+    openai_max_keepalive_connections: int = 10
+    openai_keepalive_expiry: float = 60.0
+    openai_model_memory_ttl: float = 3600.0
+    openai_breaker_failure_threshold: int = 5
+    openai_breaker_cooldown: float = 60.0
+    # лимитер запросов: стартовые RPM/TPM (дальше берутся из заголовков x-ratelimit-*),
+    # AIMD-лимит параллельных запросов и повторы на 429/5xx
+    openai_rpm_limit: int = 500
+    openai_tpm_limit: int = 200000
+    openai_concurrency_initial: int = 4
+    openai_concurrency_max: int = 32
+    openai_concurrency_decrease: float = 0.5
+    openai_rate_limit_max_retries: int = 6
+    openai_rate_limit_base_delay: float = 1.0
+    openai_rate_limit_max_delay: float = 60.0
+
+    # очередь ИИ-извлечения
+    extraction_concurrency: int = 4
+    extraction_max_attempts: int = 5
+    extraction_retry_base_delay: float = 10.0
+    extraction_retry_max_delay: float = 900.0
+    extraction_poll_interval: float = 5.0
+    extraction_drain_timeout: float = 30.0
+    # сколько анкет отправлять в одном запросе и сколько ждать добора пачки
+    extraction_batch_size: int = 8
+    extraction_batch_max_wait: float = 2.0
+    # разбирать ответ модели потоком и сохранять атрибуты по мере прихода
+    extraction_streaming: bool = True
+    # потоковые атрибуты пишутся в БД пачками: по стольку элементов или не реже, чем раз в столько секунд
+    extraction_stream_flush_items: int = 10
+    extraction_stream_flush_interval: float = 0.3
+
+    # кэш результатов извлечения
+    extraction_cache_enabled: bool = True
+    extraction_cache_ttl_days: int = 30
+    extraction_cache_max_entries: int = 20000
+    extraction_cache_evict_every: int = 200
+
+    # локальное извлечение правилами; ИИ не вызывается, только если правила нашли значение в каждой фразе
+    # и ни один ключ из списка не упомянут без распознанного значения
+    local_extraction_enabled: bool = True
+    local_extraction_required_keys: list[str] = [
+        "age",
+        "height_cm",
+        "weight_kg",
+        "aqida_manhaj",
+        "marital_status",
+        "children",
+        "polygyny_attitude",
+        "prayer_level",
+        "hijab_type",
+        "relocation_ready",
+        "partner_age_range",
+        "partner_nationality",
+    ]
+
+    # слияние дубликатов динамических атрибутов (синонимы, транслит, опечатки)
+    attribute_consolidation_interval: float = 21600.0
+    # слитый дубликат удаляется не раньше, чем через столько секунд: процессы со старым реестром
+    # (воркеры, backfill) успевают перечитать его или их запоздалые записи будут перенесены
+    attribute_merged_retention: float = 86400.0
+
+    # компакция заменённых анкет
+    profile_compaction_interval: float = 3600.0
+    profile_compaction_retention_days: int = 7
+    profile_compaction_batch_size: int = 500
+
+    # подбор анкет (/find)
+    match_top_k: int = 5
+    find_page_size: int = 5
+    match_refresh_interval: float = 30.0
+    # длина заранее посчитанного списка кандидатов и пауза для накопления изменений
+    match_precompute_k: int = 50
+    match_precompute_debounce: float = 2.0
+    match_rebuild_chunk_size: int = 200
+    # локальный индекс текстового сходства: размерность хэш-векторов и путь к memmap-файлам
+    text_vector_dim: int = 512
+    text_index_path: str = "./data/text_index"
+    # /find по расстоянию: верхняя граница радиуса, км
+    geo_max_radius_km: int = 500
+    match_weights: dict[str, float] = {
+        "age": 3.0,
+        "aqida_manhaj": 3.0,
+        "polygyny_attitude": 2.0,
+        "marital_status": 1.0,
+        "children": 1.0,
+        "relocation_ready": 1.0,
+        "location": 2.0,
+    }
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db.attribute_registry import AttributeEntry, attribute_registry
+from app.db.models import AttributeAlias
+from app.db.option_index import stem_phrase
+from app.db.session import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "attribute_aliases_pending"
+
+_TRANSLIT = str.maketrans(
+    {
+        "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+        "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+        "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "",
+        "э": "e", "ю": "yu", "я": "ya",
+    }
+)
+# единицы в ключах и подписях: «height_cm», «Рост (см)» и «рост» — один атрибут
+_UNIT_TOKENS = {"cm", "sm", "kg", "km", "let", "years"}
+# опечатка в одну букву допустима от 7 символов, в две — от 14; «height» и «weight» так не склеятся
+_FUZZY_STEPS = ((14, 2), (7, 1))
+
+
+def transliterate(text: str) -> str:
+    return (text or "").lower().translate(_TRANSLIT)
+
+
+def _latin_stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _tokens(text: str) -> list[str]:
+    # русские слова сначала режем по окончаниям, потом транслитерируем: «рост партнёра» -> rost_partner
+    words = (re.sub(r"[^a-z0-9]+", "", _latin_stem(transliterate(w))) for w in stem_phrase(text).split())
+    return [w for w in words if w and w not in _UNIT_TOKENS]
+
+
+def alias_key(text: str) -> str:
+    return "_".join(_tokens(text))[:128]
+
+
+def _variants(text: str) -> set[str]:
+    # «Рост (см)» -> «Рост», «Рост см»; «Национальность/этнос» -> ещё и каждая часть отдельно
+    text = text or ""
+    variants = {text, re.sub(r"\(([^)]*)\)", "", text)}
+    for variant in list(variants):
+        if "/" in variant:
+            variants.update(variant.split("/"))
+    return variants
+
+
+def alias_forms(text: str) -> tuple[set[str], set[str]]:
+    # (формы с исходным порядком слов — по ним ищутся опечатки, все формы включая отсортированные)
+    ordered: set[str] = set()
+    forms: set[str] = set()
+    for variant in _variants(text):
+        tokens = _tokens(variant)
+        if not tokens:
+            continue
+        ordered.add("_".join(tokens)[:128])
+        forms.add("_".join(sorted(tokens))[:128])
+    return ordered, forms | ordered
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    # Левенштейн с перестановкой соседних букв («stauts») и отсечением: больше limit — это limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before: list[int] = []
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _fuzzy_limit(form: str) -> int:
+    for length, limit in _FUZZY_STEPS:
+        if len(form) >= length:
+            return limit
+    return 0
+
+
+class AliasIndex:
+    # формы ключей и подписей атрибутов; порядок добавления — приоритет при совпадении форм
+    def __init__(self) -> None:
+        self._forms: dict[str, list[AttributeEntry]] = {}
+        self._by_length: dict[int, list[tuple[str, AttributeEntry]]] = {}
+
+    def add(self, entry: AttributeEntry) -> None:
+        ordered, forms = alias_forms(entry.key)
+        title_ordered, title_forms = alias_forms(entry.title)
+        for form in forms | title_forms:
+            self._forms.setdefault(form, []).append(entry)
+        for form in ordered | title_ordered:
+            self._by_length.setdefault(len(form), []).append((form, entry))
+
+    def lookup(self, text: str, scope: str) -> AttributeEntry | None:
+        ordered, forms = alias_forms(text)
+        for form in [*sorted(ordered), *sorted(forms - ordered)]:
+            for entry in self._forms.get(form, ()):
+                if entry.scope == scope:
+                    return entry
+        return None
+
+    def closest(self, text: str, scope: str) -> AttributeEntry | None:
+        # ближайший по расстоянию правки; два разных атрибута на одном расстоянии — не угадываем
+        ordered, _ = alias_forms(text)
+        best = None
+        found: dict[int, AttributeEntry] = {}
+        for form in ordered:
+            limit = _fuzzy_limit(form)
+            for length in range(len(form) - limit, len(form) + limit + 1):
+                for candidate, entry in self._by_length.get(length, ()):
+                    if entry.scope != scope or candidate[0] != form[0]:
+                        continue
+                    distance = edit_distance(form, candidate, limit)
+                    if distance > limit or (best is not None and distance > best):
+                        continue
+                    if best is None or distance < best:
+                        best, found = distance, {}
+                    found[entry.id] = entry
+        if len(found) != 1:
+            return None
+        return next(iter(found.values()))
+
+
+def build_alias_index(entries: list[AttributeEntry]) -> AliasIndex:
+    index = AliasIndex()
+    # канонические раньше динамических, старые раньше новых
+    for entry in sorted(entries, key=lambda e: (not e.is_canonical, e.id)):
+        index.add(entry)
+    return index
+
+
+@dataclass
+class MatcherStats:
+    alias_hits: int = 0
+    fuzzy_hits: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class AttributeMatcher:
+    # индекс над реестром атрибутов; пересобирается, только когда реестр изменился
+    def __init__(self) -> None:
+        self.aliases: dict[str, int] = {}
+        self.stats = MatcherStats()
+        self._index = AliasIndex()
+        self._version = -1
+
+    async def load(self, session: AsyncSession) -> None:
+        res = await session.execute(select(AttributeAlias.alias, AttributeAlias.attribute_id))
+        self.aliases = {alias: attribute_id for alias, attribute_id in res.all()}
+        logger.info("Attribute aliases loaded: %s", len(self.aliases))
+
+    def add_alias(self, alias: str, attribute_id: int) -> None:
+        self.aliases[alias] = attribute_id
+
+    def repoint(self, attribute_id: int, target_id: int) -> None:
+        for alias, aid in self.aliases.items():
+            if aid == attribute_id:
+                self.aliases[alias] = target_id
+
+    def _current(self) -> AliasIndex:
+        if self._version != attribute_registry.version:
+            self._index = build_alias_index(attribute_registry.all())
+            self._version = attribute_registry.version
+        return self._index
+
+    def lookup(self, raw_key: str, scope: str) -> AttributeEntry | None:
+        # явный алиас знает, какой атрибут имелся в виду, и scope не проверяет
+        attribute_id = self.aliases.get(alias_key(raw_key))
+        if attribute_id is not None and (entry := attribute_registry.get_by_id(attribute_id)) is not None:
+            self.stats.alias_hits += 1
+            return entry
+        entry = self._current().lookup(raw_key, scope)
+        if entry is not None:
+            self.stats.alias_hits += 1
+        return entry
+
+    def closest(self, raw_key: str, scope: str) -> AttributeEntry | None:
+        entry = self._current().closest(raw_key, scope)
+        if entry is not None:
+            self.stats.fuzzy_hits += 1
+        return entry
+
+
+attribute_matcher = AttributeMatcher()
+
+
+async def save_aliases(session: AsyncSession, aliases: dict[str, int], replace: bool = False) -> None:
+    # в память алиасы попадают после коммита, как и новые атрибуты в реестр
+    aliases = {alias: aid for alias, aid in aliases.items() if alias}
+    if not aliases:
+        return
+    insert = dialect_insert(session)
+    stmt = insert(AttributeAlias).values([{"alias": alias, "attribute_id": aid} for alias, aid in aliases.items()])
+    if replace:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[AttributeAlias.alias], set_={"attribute_id": stmt.excluded.attribute_id}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[AttributeAlias.alias])
+    await session.execute(stmt)
+    session.info.setdefault(_PENDING_KEY, []).extend((alias, aid, replace) for alias, aid in aliases.items())
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    for alias, attribute_id, replace in session.info.pop(_PENDING_KEY, ()):
+        if replace or alias not in attribute_matcher.aliases:
+            attribute_matcher.add_alias(alias, attribute_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from app.core.config import settings
+from app.db.attribute_aliases import AliasIndex, attribute_matcher
+from app.db.attribute_registry import AttributeEntry, attribute_registry
+from app.db.attribute_service import merge_attribute_into, normalize_key, purge_merged_attribute
+from app.db.models import Attribute
+from app.db.profile_search import refresh_profile_search
+from app.db.saved_searches import refresh_saved_searches
+from app.db.session import SessionFactory
+from app.matching.engine import match_engine
+from app.matching.precompute import match_precomputer
+
+logger = logging.getLogger(__name__)
+
+# ключи из старого normalize_key для кириллицы — по ним ничего не сопоставить, только по подписи
+_HASHED_KEY_RE = re.compile(r"^dyn_[0-9a-f]{8}$")
+
+
+@dataclass
+class ConsolidationResult:
+    merged: int = 0
+    purged: int = 0
+    renamed: int = 0
+    values_written: int = 0
+    values_skipped: int = 0
+
+
+def _names(entry: AttributeEntry) -> list[str]:
+    return [entry.title] if _HASHED_KEY_RE.match(entry.key) else [entry.key, entry.title]
+
+
+def plan_consolidation(entries: list[AttributeEntry]) -> list[tuple[AttributeEntry, AttributeEntry]]:
+    # остаются канонические и самые старые из дубликатов; слияние всегда в уже оставленный атрибут,
+    # поэтому цепочек не бывает
+    index = AliasIndex()
+    plan: list[tuple[AttributeEntry, AttributeEntry]] = []
+    for entry in sorted(entries, key=lambda e: (not e.is_canonical, e.status != "ACTIVE", e.id)):
+        if not entry.is_canonical:
+            names = _names(entry)
+            target = next((t for name in names if (t := index.lookup(name, entry.scope)) is not None), None)
+            if target is None:
+                target = next((t for name in names if (t := index.closest(name, entry.scope)) is not None), None)
+            if target is not None:
+                plan.append((entry, target))
+                continue
+        index.add(entry)
+    return plan
+
+
+async def _rename_hashed(result: ConsolidationResult) -> None:
+    # dyn_<hash> оставшихся атрибутов получает читаемый ключ, который теперь даёт normalize_key
+    for entry in attribute_registry.all():
+        if not _HASHED_KEY_RE.match(entry.key):
+            continue
+        key = normalize_key(entry.title)
+        if _HASHED_KEY_RE.match(key) or attribute_registry.get(key) is not None:
+            continue
+        async with SessionFactory() as session:
+            await session.execute(update(Attribute).where(Attribute.id == entry.id).values(key=key))
+            await session.commit()
+        attribute_registry.remove(entry.id)
+        attribute_registry.put(dataclasses.replace(entry, key=key))
+        result.renamed += 1
+
+
+async def _purge_merged(result: ConsolidationResult, touched: set[int]) -> None:
+    # дубликаты, слитые в прошлые проходы: запоздалые значения переносим, сам атрибут удаляем
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.attribute_merged_retention)
+    for source in attribute_registry.merged():
+        target = attribute_registry.redirect(source)
+        if target.id == source.id:
+            continue
+        async with SessionFactory() as session:
+            merged_at = await session.scalar(select(Attribute.merged_at).where(Attribute.id == source.id))
+            if merged_at is not None and merged_at > cutoff:
+                continue
+            merged, profile_ids = await purge_merged_attribute(session, source, target)
+            await session.commit()
+        attribute_registry.remove(source.id)
+        result.purged += 1
+        result.values_written += merged.written
+        result.values_skipped += merged.skipped
+        if target.is_canonical and merged.written:
+            touched.update(profile_ids)
+
+
+async def consolidate_attributes() -> ConsolidationResult:
+    result = ConsolidationResult()
+    touched: set[int] = set()
+    await _purge_merged(result, touched)
+    for source, target in plan_consolidation(attribute_registry.all()):
+        # коммит на каждый атрибут — не держим долгую блокировку записи в SQLite
+        async with SessionFactory() as session:
+            merged, profile_ids = await merge_attribute_into(session, source, target)
+            await session.commit()
+        # дубликат остаётся в реестре со ссылкой на target — записи по его id уходят туда
+        attribute_registry.put(dataclasses.replace(source, status="MERGED", merged_into_id=target.id))
+        attribute_matcher.repoint(source.id, target.id)
+        result.merged += 1
+        result.values_written += merged.written
+        result.values_skipped += merged.skipped
+        logger.info("Merged attribute %r into %r: %s values written", source.key, target.key, merged.written)
+        # в поиске и матчинге участвуют только канонические атрибуты
+        if target.is_canonical and merged.written:
+            touched.update(profile_ids)
+    await _rename_hashed(result)
+    if touched:
+        async with SessionFactory() as session:
+            await refresh_profile_search(session, touched)
+            await refresh_saved_searches(session, touched)
+            await session.commit()
+        match_engine.invalidate()
+        match_precomputer.schedule(touched)
+    return result
+
+
+async def run_consolidation_loop() -> None:
+    while True:
+        try:
+            result = await consolidate_attributes()
+            if result.merged or result.purged or result.renamed:
+                logger.info(
+                    "Attribute consolidation: merged=%s purged=%s renamed=%s values written=%s skipped=%s",
+                    result.merged,
+                    result.purged,
+                    result.renamed,
+                    result.values_written,
+                    result.values_skipped,
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Attribute consolidation failed")
+        await asyncio.sleep(settings.attribute_consolidation_interval)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from functools import cached_property
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+from app.db.models import Attribute, AttributeOption
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "attribute_registry_pending"
+
+
+@dataclass(frozen=True)
+class OptionEntry:
+    id: int
+    attribute_id: int
+    code: str
+    label: str
+
+    @classmethod
+    def from_model(cls, option: AttributeOption) -> "OptionEntry":
+        return cls(id=option.id, attribute_id=option.attribute_id, code=option.code, label=option.label)
+
+
+# снимок строки Attribute, не привязанный к сессии; поля совпадают с моделью
+@dataclass(frozen=True)
+class AttributeEntry:
+    id: int
+    key: str
+    title: str
+    scope: str
+    value_type: str
+    is_canonical: bool
+    is_primary: bool
+    status: str
+    options: tuple[OptionEntry, ...] = ()
+    merged_into_id: int | None = None
+
+    @cached_property
+    def _options_by_code(self) -> dict[str, OptionEntry]:
+        return {o.code: o for o in self.options}
+
+    @classmethod
+    def from_model(cls, attr: Attribute, options: list[AttributeOption] | None = None) -> "AttributeEntry":
+        return cls(
+            id=attr.id,
+            key=attr.key,
+            title=attr.title,
+            scope=attr.scope,
+            value_type=attr.value_type,
+            is_canonical=bool(attr.is_canonical),
+            is_primary=bool(attr.is_primary),
+            status=attr.status or "ACTIVE",
+            options=tuple(OptionEntry.from_model(o) for o in sorted(options or [], key=lambda o: o.id)),
+            merged_into_id=attr.merged_into_id,
+        )
+
+    def option_by_code(self, code: str | None) -> OptionEntry | None:
+        if not code:
+            return None
+        return self._options_by_code.get(code)
+
+
+class AttributeRegistry:
+    def __init__(self) -> None:
+        self._by_key: dict[str, AttributeEntry] = {}
+        self._by_id: dict[int, AttributeEntry] = {}
+        self.loaded = False
+        # растёт при каждом изменении — по нему зависимые индексы понимают, что пора пересобраться
+        self.version = 0
+
+    async def load(self, session: AsyncSession) -> None:
+        result = await session.execute(select(Attribute).options(selectinload(Attribute.options)))
+        by_key: dict[str, AttributeEntry] = {}
+        for attr in result.scalars().all():
+            by_key[attr.key] = AttributeEntry.from_model(attr, list(attr.options))
+        self._by_key = by_key
+        self._by_id = {entry.id: entry for entry in by_key.values()}
+        self.loaded = True
+        self.version += 1
+        logger.info("Attribute registry loaded: %s attributes", len(by_key))
+
+    def put(self, entry: AttributeEntry) -> None:
+        previous = self._by_key.get(entry.key)
+        if previous is not None and previous.id != entry.id:
+            self._by_id.pop(previous.id, None)
+        self._by_key[entry.key] = entry
+        self._by_id[entry.id] = entry
+        self.version += 1
+
+    def remove(self, attribute_id: int) -> None:
+        entry = self._by_id.pop(attribute_id, None)
+        if entry is not None and self._by_key.get(entry.key) is entry:
+            del self._by_key[entry.key]
+        self.version += 1
+
+    def get(self, key: str) -> AttributeEntry | None:
+        return self._by_key.get(key)
+
+    def get_by_id(self, attribute_id: int) -> AttributeEntry | None:
+        return self._by_id.get(attribute_id)
+
+    def all(self) -> list[AttributeEntry]:
+        # слитые дубликаты остаются в реестре только ради redirect
+        return [entry for entry in self._by_key.values() if entry.merged_into_id is None]
+
+    def merged(self) -> list[AttributeEntry]:
+        return [entry for entry in self._by_key.values() if entry.merged_into_id is not None]
+
+    def redirect(self, entry: AttributeEntry) -> AttributeEntry:
+        # снимок у вызывающего мог устареть: атрибут успели слить в другой — пишем туда
+        current = self._by_id.get(entry.id, entry)
+        for _ in range(len(self._by_id)):
+            if current.merged_into_id is None:
+                break
+            target = self._by_id.get(current.merged_into_id)
+            if target is None:
+                break
+            current = target
+        return current
+
+    def options(self, key: str) -> tuple[OptionEntry, ...]:
+        entry = self._by_key.get(key)
+        return entry.options if entry is not None else ()
+
+    def option_codes(self, key: str) -> list[str]:
+        return [o.code for o in self.options(key)]
+
+    def option_label(self, key: str, code: str | None) -> str | None:
+        entry = self._by_key.get(key)
+        if entry is None:
+            return None
+        option = entry.option_by_code(code)
+        return option.label if option is not None else None
+
+
+attribute_registry = AttributeRegistry()
+
+
+# Новые атрибуты попадают в реестр только после коммита транзакции, которая их создала:
+# при откате реестр не должен ссылаться на несуществующие id.
+def register_pending(session: AsyncSession, entry: AttributeEntry) -> None:
+    session.info.setdefault(_PENDING_KEY, []).append(entry)
+
+
+def find_pending(session: AsyncSession, key: str) -> AttributeEntry | None:
+    for entry in session.info.get(_PENDING_KEY, ()):
+        if entry.key == key:
+            return entry
+    return None
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    for entry in session.info.pop(_PENDING_KEY, ()):
+        attribute_registry.put(entry)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -2,29 +2,54 @@ from __future__ import annotations
 
 import hashlib
 import re
-from typing import Any
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable, NamedTuple
 
-from sqlalchemy import select
+from sqlalchemy import delete, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from app.db.models import Attribute, AttributeOption, ProfileAttributeValue
+from app.db.attribute_aliases import alias_forms, alias_key, attribute_matcher, save_aliases, transliterate
+from app.db.attribute_registry import (
+    AttributeEntry,
+    OptionEntry,
+    attribute_registry,
+    find_pending,
+    register_pending,
+)
+from app.db.models import Attribute, AttributeAlias, AttributeOption, ProfileAttributeValue
+from app.db.option_index import resolve_option
+from app.db.session import dialect_insert
 
 
 def normalize_key(raw: str) -> str:
     original = (raw or "").strip()
-    raw = original.lower()
+    # кириллицу транслитерируем: «рост_партнера» -> rost_partnera, а не безымянный dyn_<hash>
+    raw = transliterate(original)
     raw = re.sub(r"\s+", "_", raw)
     raw = re.sub(r"[^a-z0-9_]+", "", raw)
-    raw = re.sub(r"_+", "_", raw).strip("_")
+    raw = re.sub(r"_+", "_", raw).strip("_")[:64].strip("_")
     if not raw:
         digest = hashlib.sha1((original or "empty").encode("utf-8")).hexdigest()[:8]
         return f"dyn_{digest}"
     return raw
 
 
-async def get_attribute_by_key(session: AsyncSession, key: str) -> Attribute | None:
-    result = await session.execute(select(Attribute).where(Attribute.key == key))
-    return result.scalar_one_or_none()
+async def get_attribute_by_key(session: AsyncSession, key: str) -> AttributeEntry | None:
+    entry = attribute_registry.get(key) or find_pending(session, key)
+    if entry is not None:
+        return entry
+    # промах реестра (например, атрибут добавлен другим процессом) — читаем из базы и запоминаем
+    result = await session.execute(
+        select(Attribute).options(selectinload(Attribute.options)).where(Attribute.key == key)
+    )
+    attr = result.scalar_one_or_none()
+    if attr is None:
+        return None
+    entry = AttributeEntry.from_model(attr, list(attr.options))
+    attribute_registry.put(entry)
+    return entry
 
 
 async def get_or_create_dynamic_attribute(
@@ -33,7 +58,7 @@ async def get_or_create_dynamic_attribute(
     title: str,
     scope: str,
     value_type: str = "TEXT",
-) -> Attribute:
+) -> AttributeEntry:
     safe_key = normalize_key(key)
     existing = await get_attribute_by_key(session, safe_key)
     if existing is not None:
@@ -49,35 +74,21 @@ async def get_or_create_dynamic_attribute(
     )
     session.add(attr)
     await session.flush()
-    return attr
+    entry = AttributeEntry.from_model(attr)
+    register_pending(session, entry)
+    return entry
 
 
-async def _find_option_for_value(
-    session: AsyncSession,
-    attribute_id: int,
+def _find_option_for_value(
+    attribute: AttributeEntry,
     option_code: str | None,
     value: str,
-) -> AttributeOption | None:
-    if option_code:
-        result = await session.execute(
-            select(AttributeOption).where(
-                AttributeOption.attribute_id == attribute_id,
-                AttributeOption.code == option_code,
-            )
-        )
-        option = result.scalar_one_or_none()
-        if option is not None:
-            return option
-    if not value:
-        return None
-    normalized = value.strip().lower()
-    result = await session.execute(
-        select(AttributeOption).where(AttributeOption.attribute_id == attribute_id)
-    )
-    for option in result.scalars().all():
-        if option.code.lower() == normalized or option.label.lower() == normalized:
-            return option
-    return None
+) -> OptionEntry | None:
+    option = attribute.option_by_code(option_code)
+    if option is not None:
+        return option
+    # код, подпись, синонимы и словоформы — через предрассчитанный индекс, без обращения к базе
+    return resolve_option(attribute, value)
 
 
 def _extract_int(value: str) -> int | None:
@@ -103,22 +114,42 @@ def _extract_bool(value: str) -> bool | None:
     return None
 
 
-async def upsert_profile_attribute_value(
-    session: AsyncSession,
-    profile_id: int,
-    attribute: Attribute,
-    value: str,
-    option_code: str | None,
-    confidence: float,
-    evidence: str | None,
-) -> None:
+class AttributeValueInput(NamedTuple):
+    profile_id: int
+    attribute: AttributeEntry
+    value: str
+    option_code: str | None = None
+    confidence: float = 1.0
+    evidence: str | None = None
+    # USER — ответ кнопками/анкетой, AI — результат извлечения, RULES — локальные правила
+    source: str = "USER"
+    prompt_version: str | None = None
+
+
+@dataclass
+class MergeResult:
+    written: int = 0
+    skipped_unchanged: int = 0
+    skipped_downgrade: int = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.skipped_unchanged + self.skipped_downgrade
+
+
+_TYPED_COLUMNS = ("option_id", "value_text", "value_int", "value_bool")
+_VALUE_COLUMNS = (*_TYPED_COLUMNS, "confidence", "evidence", "source", "prompt_version")
+_BULK_CHUNK = 500
+
+
+def _typed_value(attribute: AttributeEntry, value: str, option_code: str | None) -> dict[str, Any]:
     value_text: str | None = None
     value_int: int | None = None
     value_bool: bool | None = None
     option_id: int | None = None
 
     if attribute.value_type == "ENUM":
-        option = await _find_option_for_value(session, attribute.id, option_code, value)
+        option = _find_option_for_value(attribute, option_code, value)
         if option is not None:
             option_id = option.id
         else:
@@ -134,50 +165,145 @@ async def upsert_profile_attribute_value(
     else:
         value_text = value
 
-    result = await session.execute(
-        select(ProfileAttributeValue).where(
-            ProfileAttributeValue.profile_id == profile_id,
-            ProfileAttributeValue.attribute_id == attribute.id,
+    return {
+        "option_id": option_id,
+        "value_text": value_text,
+        "value_int": value_int,
+        "value_bool": value_bool,
+    }
+
+
+def _record(row: AttributeValueInput, now: datetime) -> dict[str, Any]:
+    attribute = attribute_registry.redirect(row.attribute)
+    # код варианта относится к исходному атрибуту; у цели значение разбирается заново
+    option_code = row.option_code if attribute.id == row.attribute.id else None
+    return {
+        "profile_id": row.profile_id,
+        "attribute_id": attribute.id,
+        **_typed_value(attribute, row.value, option_code),
+        "confidence": row.confidence,
+        "evidence": row.evidence,
+        "source": row.source,
+        "prompt_version": row.prompt_version,
+        "created_at": now,
+    }
+
+
+async def _upsert_records(session: AsyncSession, values: list[dict[str, Any]]) -> None:
+    insert = dialect_insert(session)
+    for i in range(0, len(values), _BULK_CHUNK):
+        stmt = insert(ProfileAttributeValue).values(values[i : i + _BULK_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ProfileAttributeValue.profile_id, ProfileAttributeValue.attribute_id],
+            set_={col: stmt.excluded[col] for col in _VALUE_COLUMNS},
         )
-    )
-    existing = result.scalar_one_or_none()
-    if existing is None:
-        session.add(
-            ProfileAttributeValue(
-                profile_id=profile_id,
-                attribute_id=attribute.id,
-                option_id=option_id,
-                value_text=value_text,
-                value_int=value_int,
-                value_bool=value_bool,
-                confidence=confidence,
-                evidence=evidence,
-            )
+        await session.execute(stmt)
+
+
+def _is_user_sourced(source: str | None, confidence: float | None, evidence: str | None) -> bool:
+    if source is not None:
+        return source == "USER"
+    # строки до появления колонки source: ответы анкеты писались с confidence=1.0 и без evidence
+    return evidence is None and (confidence or 0.0) >= 1.0
+
+
+def _prompt_rank(version: str | None) -> int:
+    # "v3" -> 3; строки ИИ до появления колонки считаются старше любой версии
+    digits = re.sub(r"\D", "", version or "")
+    return int(digits) if digits else -1
+
+
+def _wins(new: dict[str, Any], old: dict[str, Any]) -> bool:
+    if new["source"] == "USER":
+        return True
+    if _is_user_sourced(old.get("source"), old.get("confidence"), old.get("evidence")):
+        return False
+    old_source = old.get("source") or "AI"
+    if new["source"] == old_source == "AI" and new.get("prompt_version") != old.get("prompt_version"):
+        # исправленный промпт заменяет ответы старого, как бы уверенно тот ни отвечал;
+        # уверенность сравниваем только между ответами одной версии
+        return _prompt_rank(new.get("prompt_version")) > _prompt_rank(old.get("prompt_version"))
+    return (new["confidence"] or 0.0) >= (old.get("confidence") or 0.0)
+
+
+async def merge_profile_attribute_values(
+    session: AsyncSession,
+    rows: Iterable[AttributeValueInput],
+) -> MergeResult:
+    # Пишем только то, что действительно меняет данные: одинаковое типизированное значение не перезаписываем,
+    # а догадка ИИ не вытесняет ответ пользователя или более уверенное значение.
+    now = datetime.utcnow()
+    incoming: dict[tuple[int, int], dict[str, Any]] = {}
+    for row in rows:
+        record = _record(row, now)
+        key = (row.profile_id, record["attribute_id"])
+        current = incoming.get(key)
+        if current is None or _wins(record, current):
+            incoming[key] = record
+    result = MergeResult()
+    if not incoming:
+        return result
+
+    profile_ids = {pid for pid, _ in incoming}
+    attribute_ids = {aid for _, aid in incoming}
+    existing_rows = await session.execute(
+        select(
+            ProfileAttributeValue.profile_id,
+            ProfileAttributeValue.attribute_id,
+            *(getattr(ProfileAttributeValue, col) for col in _VALUE_COLUMNS),
+        ).where(
+            ProfileAttributeValue.profile_id.in_(profile_ids),
+            ProfileAttributeValue.attribute_id.in_(attribute_ids),
         )
-        return
+    )
+    existing = {(r.profile_id, r.attribute_id): r._asdict() for r in existing_rows}
+
+    to_write: list[dict[str, Any]] = []
+    for key, record in incoming.items():
+        old = existing.get(key)
+        if old is None:
+            to_write.append(record)
+        elif all(old[col] == record[col] for col in _TYPED_COLUMNS):
+            result.skipped_unchanged += 1
+        elif _wins(record, old):
+            to_write.append(record)
+        else:
+            result.skipped_downgrade += 1
 
-    existing.option_id = option_id
-    existing.value_text = value_text
-    existing.value_int = value_int
-    existing.value_bool = value_bool
-    existing.confidence = confidence
-    existing.evidence = evidence
+    if to_write:
+        await _upsert_records(session, to_write)
+    result.written = len(to_write)
+    return result
 
 
 async def map_extracted_item_to_attribute(
     session: AsyncSession,
     item: dict[str, Any],
-) -> tuple[Attribute, dict[str, Any]]:
+) -> tuple[AttributeEntry, dict[str, Any]]:
     raw_key = str(item.get("key", "")).strip()
+    scope = str(item.get("scope") or "SELF")
+    normalized_key = normalize_key(raw_key)
     attribute = None
     if raw_key:
-        attribute = await get_attribute_by_key(session, raw_key)
-    normalized_key = normalize_key(raw_key)
+        attribute = (
+            attribute_registry.get(raw_key)
+            or attribute_registry.get(normalized_key)
+            or find_pending(session, normalized_key)
+        )
+        # незнакомый ключ: синонимы, транслит и опечатки разбираем в памяти, до запросов к базе
+        if attribute is None:
+            attribute = attribute_matcher.lookup(raw_key, scope)
+        if attribute is None:
+            attribute = attribute_matcher.closest(raw_key, scope)
+            if attribute is not None:
+                # найденное по опечатке запоминаем — в следующий раз это точное совпадение
+                await save_aliases(session, {alias_key(raw_key): attribute.id})
+        if attribute is None:
+            attribute = await get_attribute_by_key(session, raw_key)
     if attribute is None:
         attribute = await get_attribute_by_key(session, normalized_key)
     if attribute is None:
         title = raw_key or normalized_key
-        scope = str(item.get("scope") or "SELF")
         attribute = await get_or_create_dynamic_attribute(
             session=session,
             key=normalized_key,
@@ -185,6 +311,75 @@ async def map_extracted_item_to_attribute(
             scope=scope,
             value_type="TEXT",
         )
+    attribute = attribute_registry.redirect(attribute)
     normalized_item = dict(item)
     normalized_item["key"] = attribute.key
     return attribute, normalized_item
+
+
+def _stored_value(attribute: AttributeEntry, row: ProfileAttributeValue) -> str | None:
+    if row.option_id is not None:
+        option = next((o for o in attribute.options if o.id == row.option_id), None)
+        if option is not None:
+            return option.label
+    if row.value_int is not None:
+        return str(row.value_int)
+    if row.value_bool is not None:
+        return "да" if row.value_bool else "нет"
+    return row.value_text
+
+
+async def _move_values(
+    session: AsyncSession,
+    source: AttributeEntry,
+    target: AttributeEntry,
+) -> tuple[MergeResult, set[int]]:
+    res = await session.execute(select(ProfileAttributeValue).where(ProfileAttributeValue.attribute_id == source.id))
+    rows: list[AttributeValueInput] = []
+    for row in res.scalars().all():
+        value = _stored_value(source, row)
+        if not value:
+            continue
+        origin = row.source or ("USER" if _is_user_sourced(None, row.confidence, row.evidence) else "AI")
+        rows.append(
+            AttributeValueInput(
+                row.profile_id, target, value, None, row.confidence, row.evidence, origin, row.prompt_version
+            )
+        )
+    merged = await merge_profile_attribute_values(session, rows)
+    await session.execute(delete(ProfileAttributeValue).where(ProfileAttributeValue.attribute_id == source.id))
+    return merged, {row.profile_id for row in rows}
+
+
+async def merge_attribute_into(
+    session: AsyncSession,
+    source: AttributeEntry,
+    target: AttributeEntry,
+) -> tuple[MergeResult, set[int]]:
+    # значения дубликата переписываются на target по обычным правилам merge, его ключ и подпись
+    # остаются алиасами target. Сам дубликат только помечается MERGED: воркеры и backfill со старым
+    # реестром могут ещё писать по его id — такие значения доберёт и удалит purge_merged_attribute
+    merged, profile_ids = await _move_values(session, source, target)
+    await session.execute(
+        update(AttributeAlias).where(AttributeAlias.attribute_id == source.id).values(attribute_id=target.id)
+    )
+    names = alias_forms(source.key)[0] | alias_forms(source.title)[0]
+    await save_aliases(session, {name: target.id for name in names}, replace=True)
+    await session.execute(
+        update(Attribute)
+        .where(Attribute.id == source.id)
+        .values(status="MERGED", merged_into_id=target.id, merged_at=datetime.utcnow())
+    )
+    return merged, profile_ids
+
+
+async def purge_merged_attribute(
+    session: AsyncSession,
+    source: AttributeEntry,
+    target: AttributeEntry,
+) -> tuple[MergeResult, set[int]]:
+    # значения, записанные по id дубликата уже после слияния, переносятся ещё раз, затем он удаляется
+    merged, profile_ids = await _move_values(session, source, target)
+    await session.execute(delete(AttributeOption).where(AttributeOption.attribute_id == source.id))
+    await session.execute(delete(Attribute).where(Attribute.id == source.id))
+    return merged, profile_ids
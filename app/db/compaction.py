@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.fulltext import prune_fulltext
+from app.db.models import (
+    ExtractionJob,
+    Profile,
+    ProfileAttributeValue,
+    ProfileMatch,
+    ProfilePreferenceTerm,
+    ProfileSearch,
+    ProfileTextVector,
+    User,
+)
+from app.db.profile_search import remove_from_profile_search
+from app.db.session import SessionFactory
+from app.matching.seen import prune_seen_sets
+from app.matching.text_index import text_index
+
+logger = logging.getLogger(__name__)
+
+
+async def supersede_previous_profiles(session: AsyncSession, user_id: int, current_profile_id: int) -> list[int]:
+    res = await session.execute(
+        select(Profile.id).where(
+            Profile.user_id == user_id,
+            Profile.status == "ACTIVE",
+            Profile.id != current_profile_id,
+        )
+    )
+    ids = list(res.scalars().all())
+    if not ids:
+        return ids
+    await session.execute(
+        update(Profile)
+        .where(Profile.id.in_(ids))
+        .values(status="SUPERSEDED", superseded_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    # извлекать атрибуты для заменённой анкеты уже незачем
+    await session.execute(delete(ExtractionJob).where(ExtractionJob.profile_id.in_(ids)))
+    await remove_from_profile_search(session, ids)
+    return ids
+
+
+async def backfill_current_profiles(session: AsyncSession) -> int:
+    # базы до появления current_profile_id: актуальной считаем последнюю ACTIVE анкету, остальные заменены
+    latest = (
+        select(func.max(Profile.id))
+        .where(Profile.user_id == User.id, Profile.status == "ACTIVE")
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(User).where(User.current_profile_id.is_(None)).values(current_profile_id=latest)
+    )
+    current_ids = select(User.current_profile_id).where(User.current_profile_id.is_not(None))
+    res = await session.execute(
+        update(Profile)
+        .where(Profile.status == "ACTIVE", Profile.id.not_in(current_ids))
+        .values(status="SUPERSEDED", superseded_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(delete(ProfileSearch).where(ProfileSearch.profile_id.not_in(current_ids)))
+    await session.execute(delete(ProfilePreferenceTerm).where(ProfilePreferenceTerm.profile_id.not_in(current_ids)))
+    await prune_fulltext(session)
+    await session.commit()
+    return res.rowcount or 0
+
+
+async def compact_superseded_profiles(session: AsyncSession) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=settings.profile_compaction_retention_days)
+    removed = 0
+    while True:
+        res = await session.execute(
+            select(Profile.id)
+            .where(Profile.status == "SUPERSEDED", Profile.superseded_at < cutoff)
+            .order_by(Profile.id)
+            .limit(settings.profile_compaction_batch_size)
+        )
+        ids = list(res.scalars().all())
+        if not ids:
+            break
+        await session.execute(delete(ProfileAttributeValue).where(ProfileAttributeValue.profile_id.in_(ids)))
+        await session.execute(delete(ExtractionJob).where(ExtractionJob.profile_id.in_(ids)))
+        await remove_from_profile_search(session, ids)
+        await session.execute(delete(ProfileMatch).where(ProfileMatch.profile_id.in_(ids)))
+        await session.execute(delete(ProfileTextVector).where(ProfileTextVector.profile_id.in_(ids)))
+        await session.execute(
+            delete(Profile).where(Profile.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        # коммит на каждую пачку — не держим долгую блокировку записи в SQLite
+        await session.commit()
+        removed += len(ids)
+    return removed
+
+
+async def run_compaction_loop() -> None:
+    first = True
+    while True:
+        try:
+            async with SessionFactory() as session:
+                if first:
+                    superseded = await backfill_current_profiles(session)
+                    if superseded:
+                        logger.info("Marked %s legacy duplicate profiles as superseded", superseded)
+                    first = False
+                removed = await compact_superseded_profiles(session)
+                if removed:
+                    pruned = await prune_seen_sets(session)
+                    await session.commit()
+            if removed:
+                logger.info("Compacted %s superseded profiles, pruned %s seen ids", removed, pruned)
+            # строки удалённых и заменённых анкет в индексе текстов — «дырки» до этого момента
+            reclaimed = text_index.compact()
+            if reclaimed:
+                logger.info("Reclaimed %s text index rows", reclaimed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Profile compaction failed")
+        await asyncio.sleep(settings.profile_compaction_interval)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import logging
+import re
+from typing import Iterable
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.db.models import Profile
+from app.db.option_index import stem_phrase
+
+logger = logging.getLogger(__name__)
+
+# FTS5 есть только в SQLite; в индексе лежат основы слов — русского стеммера у FTS5 нет,
+# поэтому документ и запрос проходят через тот же stem_phrase, что и варианты ENUM
+FTS_TABLE = "profile_fts"
+_MAX_QUERY_TERMS = 8
+# в запросе режем окончания агрессивнее: префиксный поиск всё равно найдёт полную основу документа
+_QUERY_MIN_STEM = 3
+
+fulltext_enabled = False
+
+
+async def ensure_fulltext(conn: AsyncConnection) -> bool:
+    global fulltext_enabled
+    if conn.dialect.name != "sqlite":
+        return False
+    exists = (
+        await conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE})
+    ).first()
+    if exists:
+        fulltext_enabled = True
+        return False
+    try:
+        await conn.execute(
+            text(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')")
+        )
+    except Exception as e:
+        logger.warning("FTS5 is not available, /search is disabled: %s", e)
+        return False
+    fulltext_enabled = True
+    return True
+
+
+def _words(value: str | None) -> str:
+    return " ".join(re.findall(r"\w+", (value or "").lower()))
+
+
+def fts_document(*texts: str | None) -> str:
+    return stem_phrase(" ".join(_words(t) for t in texts))
+
+
+def fts_query(value: str | None) -> str | None:
+    stems = [s for s in stem_phrase(_words(value), _QUERY_MIN_STEM).split() if len(s) >= 2][:_MAX_QUERY_TERMS]
+    if not stems:
+        return None
+    # все слова обязательны; префикс добирает формы, которые стеммер обрезал иначе
+    return " ".join(f'"{s}"*' for s in stems)
+
+
+async def sync_fulltext(session: AsyncSession, active_ids: Iterable[int], gone_ids: Iterable[int] = ()) -> None:
+    if not fulltext_enabled:
+        return
+    active = list(active_ids)
+    stale = list(gone_ids) + active
+    if stale:
+        await session.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": stale},
+        )
+    if not active:
+        return
+    res = await session.execute(
+        select(Profile.id, Profile.about_me_text, Profile.looking_for_text).where(Profile.id.in_(active))
+    )
+    docs = [{"rowid": pid, "body": fts_document(about, looking)} for pid, about, looking in res.all()]
+    docs = [d for d in docs if d["body"]]
+    if docs:
+        await session.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, body) VALUES (:rowid, :body)"), docs)
+
+
+async def clear_fulltext(session: AsyncSession) -> None:
+    if fulltext_enabled:
+        await session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+
+
+async def prune_fulltext(session: AsyncSession) -> None:
+    # строки анкет, которых уже нет в profile_search
+    if fulltext_enabled:
+        await session.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT profile_id FROM profile_search)")
+        )
+
+
+async def search_profile_ids(
+    session: AsyncSession,
+    query: str,
+    target_gender: str,
+    viewer_user_id: int,
+    limit: int,
+) -> list[int]:
+    match = fts_query(query)
+    if not fulltext_enabled or match is None:
+        return []
+    # в profile_search только ACTIVE анкеты — фильтр статуса вместе с полом берётся оттуда
+    res = await session.execute(
+        text(
+            f"SELECT f.rowid FROM {FTS_TABLE} AS f "
+            "JOIN profile_search AS s ON s.profile_id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match AND s.gender = :gender AND s.user_id != :viewer "
+            f"ORDER BY bm25({FTS_TABLE}) LIMIT :limit"
+        ),
+        {"match": match, "gender": target_gender, "viewer": viewer_user_id, "limit": limit},
+    )
+    return [row[0] for row in res.all()]
@@ -2,7 +2,19 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import BigInteger, Boolean, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db.base import Base
@@ -18,6 +30,9 @@ class User(Base):
     # BROTHER / SISTER
     gender: Mapped[str | None] = mapped_column(String(10), nullable=True, index=True)
 
+    # актуальная анкета пользователя; без FK, чтобы не зацикливать users <-> profiles
+    current_profile_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     profiles: Mapped[list["Profile"]] = relationship(back_populates="user")
@@ -53,7 +68,9 @@ class Profile(Base):
     about_me_text: Mapped[str] = mapped_column(Text, default="")
     looking_for_text: Mapped[str] = mapped_column(Text, default="")
 
+    # ACTIVE / SUPERSEDED (заменена новой анкетой, ждёт компакции)
     status: Mapped[str] = mapped_column(String(16), default="ACTIVE", index=True)
+    superseded_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     user: Mapped["User"] = relationship(back_populates="profiles")
@@ -75,6 +92,9 @@ class Attribute(Base):
     is_primary: Mapped[bool] = mapped_column(Boolean, default=False)
     status: Mapped[str] = mapped_column(String(16), default="ACTIVE")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # слитый дубликат (status=MERGED): запись ещё нужна процессам со старым реестром, удаляется позже
+    merged_into_id: Mapped[int | None] = mapped_column(ForeignKey("attributes.id"), nullable=True)
+    merged_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     options: Mapped[list["AttributeOption"]] = relationship(
         back_populates="attribute",
@@ -96,6 +116,15 @@ class AttributeOption(Base):
     values: Mapped[list["ProfileAttributeValue"]] = relationship(back_populates="option")
 
 
+# другие написания ключа атрибута (опечатки, транслит, слитые дубликаты) -> атрибут
+class AttributeAlias(Base):
+    __tablename__ = "attribute_aliases"
+
+    alias: Mapped[str] = mapped_column(String(128), primary_key=True)
+    attribute_id: Mapped[int] = mapped_column(ForeignKey("attributes.id"), index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class ProfileAttributeValue(Base):
     __tablename__ = "profile_attribute_values"
     __table_args__ = (UniqueConstraint("profile_id", "attribute_id"),)
@@ -109,8 +138,178 @@ class ProfileAttributeValue(Base):
     value_bool: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
     confidence: Mapped[float] = mapped_column(Float, default=1.0)
     evidence: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # USER / AI; NULL у строк, записанных до появления колонки
+    source: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    # версия промпта, давшего значение ИИ; у остальных источников NULL
+    prompt_version: Mapped[str | None] = mapped_column(String(16), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     profile: Mapped["Profile"] = relationship(back_populates="attribute_values")
     attribute: Mapped["Attribute"] = relationship(back_populates="values")
     option: Mapped["AttributeOption"] = relationship(back_populates="values")
+
+
+# плоская типизированная копия актуальных анкет для поиска и матчинга; только ACTIVE анкеты,
+# обновляется при сохранении анкеты и после извлечения атрибутов (app/db/profile_search.py)
+class ProfileSearch(Base):
+    __tablename__ = "profile_search"
+    __table_args__ = (
+        Index("ix_profile_search_gender_created_at_id", "gender", "created_at", "profile_id"),
+        Index("ix_profile_search_gender_age", "gender", "age"),
+        Index("ix_profile_search_gender_nationality_key", "gender", "nationality_key"),
+        Index("ix_profile_search_gender_city_id", "gender", "city_id"),
+        Index("ix_profile_search_gender_country_code", "gender", "country_code"),
+        Index("ix_profile_search_gender_geo_cell", "gender", "geo_cell"),
+    )
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, index=True)
+    gender: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+
+    age: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height_cm: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    weight_kg: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    location: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    # location_hash нормализованной локации, 0 — не указана
+    location_id: Mapped[int] = mapped_column(BigInteger, default=0, index=True)
+    # локация, распознанная по справочнику app/geo/gazetteer.json; NULL — не распознана
+    city_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    country_code: Mapped[str | None] = mapped_column(String(2), nullable=True)
+    lat: Mapped[float | None] = mapped_column(Float, nullable=True)
+    lon: Mapped[float | None] = mapped_column(Float, nullable=True)
+    # номер ячейки сетки (app/geo/gazetteer.py: grid_cell) для поиска по радиусу
+    geo_cell: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    nationality: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # stem_phrase(nationality) — сравнивается с profile_preference_terms
+    nationality_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+
+    # коды вариантов ENUM-атрибутов
+    aqida_manhaj: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    marital_status: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    children: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    polygyny_attitude: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    prayer_level: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    hijab_type: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    relocation_ready: Mapped[str | None] = mapped_column(String(32), nullable=True)
+
+    # разобранные предпочтения к партнёру (app/db/preferences.py); NULL/0 — без ограничения
+    pref_age_min: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    pref_age_max: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    pref_nationality_count: Mapped[int] = mapped_column(Integer, default=0)
+
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+# множества допустимых значений из предпочтений: (profile_id, "nationality", ключ)
+class ProfilePreferenceTerm(Base):
+    __tablename__ = "profile_preference_terms"
+    __table_args__ = (Index("ix_profile_preference_terms_key_value", "key", "value", "profile_id"),)
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id"), primary_key=True)
+    key: Mapped[str] = mapped_column(String(32), primary_key=True)
+    value: Mapped[str] = mapped_column(String(64), primary_key=True)
+
+
+# заранее посчитанный top-K кандидатов для анкеты (app/matching/precompute.py)
+class ProfileMatch(Base):
+    __tablename__ = "profile_matches"
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id"), primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # по candidate_id находим списки, которые надо пересчитать при изменении кандидата
+    candidate_id: Mapped[int] = mapped_column(Integer, index=True)
+    score: Mapped[float] = mapped_column(Float)
+    computed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+# сохранённый поиск пользователя; критерии лежат в saved_search_terms
+class SavedSearch(Base):
+    __tablename__ = "saved_searches"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), unique=True, index=True)
+    target_gender: Mapped[str] = mapped_column(String(10))
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_notified_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+# инвертированный индекс: (атрибут, значение) -> поиски; "*" — любое значение
+class SavedSearchTerm(Base):
+    __tablename__ = "saved_search_terms"
+
+    attribute: Mapped[str] = mapped_column(String(32), primary_key=True)
+    value: Mapped[str] = mapped_column(String(64), primary_key=True)
+    search_id: Mapped[int] = mapped_column(ForeignKey("saved_searches.id"), primary_key=True, index=True)
+
+
+# векторы хэшированных символьных n-грамм текстов анкеты (float32, app/matching/text_index.py)
+class ProfileTextVector(Base):
+    __tablename__ = "profile_text_vectors"
+
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id"), primary_key=True)
+    dim: Mapped[int] = mapped_column(Integer)
+    # «о себе»; пустой текст — NULL
+    about_vec: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    # «кого ищу», при пустом тексте — копия about_vec
+    looking_vec: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+# уже показанные пользователю анкеты: отсортированный массив uint32 (little-endian), 4 байта на анкету
+class UserSeenSet(Base):
+    __tablename__ = "user_seen"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    profile_ids: Mapped[bytes] = mapped_column(LargeBinary, default=b"")
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ExtractionJob(Base):
+    __tablename__ = "extraction_jobs"
+    __table_args__ = (Index("ix_extraction_jobs_status_run_after", "status", "run_after"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id"), index=True)
+    free_text: Mapped[str] = mapped_column(Text, default="")
+
+    # PENDING / RUNNING / FAILED (успешные задачи удаляются)
+    status: Mapped[str] = mapped_column(String(16), default="PENDING")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    # метка воркера, забравшего задачу в пачку
+    claim_token: Mapped[str | None] = mapped_column(String(32), nullable=True, index=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ExtractionCacheEntry(Base):
+    __tablename__ = "extraction_cache"
+
+    # sha256(prompt_version + model + нормализованный текст)
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(64))
+    prompt_version: Mapped[str] = mapped_column(String(16))
+    items_json: Mapped[str] = mapped_column(Text)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    last_hit_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+# прогресс перезапуска извлечения (app/backfill.py): все анкеты с id <= last_profile_id уже обработаны
+class BackfillCheckpoint(Base):
+    __tablename__ = "backfill_checkpoints"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    last_profile_id: Mapped[int] = mapped_column(Integer, default=0)
+    processed: Mapped[int] = mapped_column(Integer, default=0)
+    # анкеты, которые не удалось обработать и которые переданы в очередь извлечения
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
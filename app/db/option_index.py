@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+import re
+
+from app.db.attribute_registry import AttributeEntry, OptionEntry
+from app.db.seed import CANONICAL_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+# окончания, которые срезаются при построении ключа (длинные раньше коротких)
+_ENDINGS = sorted(
+    {
+        "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+        "ой", "ей", "ий", "ый", "ом", "ем", "ах", "ях", "ов", "ев", "ка", "ки", "ку", "ке", "ит",
+        "а", "я", "ы", "и", "е", "о", "у", "ю", "ь",
+    },
+    key=len,
+    reverse=True,
+)
+# сведение вариантов транслитерации: «саляфи» и «салафи» должны дать один ключ
+_FOLD = str.maketrans({"я": "а", "ю": "у", "ё": "е", "ы": "и", "э": "е", "й": "и"})
+_MIN_STEM = 4
+_MAX_WINDOW = 4
+_NEGATIONS = {"не", "без", "ни"}
+
+
+def normalize_option_text(text: str) -> str:
+    text = (text or "").lower().replace("ё", "е")
+    text = re.sub(r"[\-_/,.;:!?«»\"'()]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _stem_word(word: str, min_stem: int = _MIN_STEM) -> str:
+    for _ in range(2):
+        for ending in _ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= min_stem:
+                word = word[: -len(ending)]
+                break
+        else:
+            break
+    return word.translate(_FOLD)
+
+
+def stem_phrase(text: str, min_stem: int = _MIN_STEM) -> str:
+    return " ".join(_stem_word(w, min_stem) for w in normalize_option_text(text).split())
+
+
+def _label_variants(label: str) -> set[str]:
+    # «Готов(а)» -> «готов», «готова»; «Не был(а) женат(а)» -> оба варианта целиком
+    variants = {re.sub(r"\(([^)]*)\)", "", label), re.sub(r"\(([^)]*)\)", r"\1", label), label}
+    return {normalize_option_text(v) for v in variants if normalize_option_text(v)}
+
+
+_SYNONYMS: dict[str, dict[str, list[str]]] = {
+    spec["key"]: spec.get("synonyms") or {} for spec in CANONICAL_ATTRIBUTES
+}
+
+
+class OptionIndex:
+    def __init__(self, attribute: AttributeEntry, synonyms: dict[str, list[str]] | None = None) -> None:
+        self.attribute = attribute
+        self._exact: dict[str, OptionEntry] = {}
+        self._stemmed: dict[str, OptionEntry] = {}
+        by_code = {o.code: o for o in attribute.options}
+        for option in attribute.options:
+            self._add(option.code.lower(), option)
+            self._add(option.code.lower().replace("_", " "), option)
+            for variant in _label_variants(option.label):
+                self._add(variant, option)
+        for code, phrases in (synonyms or {}).items():
+            option = by_code.get(code)
+            if option is None:
+                continue
+            for phrase in phrases:
+                self._add(normalize_option_text(phrase), option)
+
+    def _add(self, phrase: str, option: OptionEntry) -> None:
+        if not phrase:
+            return
+        existing = self._exact.setdefault(phrase, option)
+        if existing.id != option.id:
+            logger.debug("Ambiguous option phrase %r for %s", phrase, self.attribute.key)
+        self._stemmed.setdefault(stem_phrase(phrase), option)
+
+    @staticmethod
+    def _negated(words: list[str], start: int, end: int) -> bool:
+        return bool(_NEGATIONS.intersection(words[max(0, start - 2) : start])) or (
+            end < len(words) and words[end] in _NEGATIONS
+        )
+
+    def resolve(self, value: str | None) -> OptionEntry | None:
+        normalized = normalize_option_text(value or "")
+        if not normalized:
+            return None
+        option = self._exact.get(normalized) or self._stemmed.get(stem_phrase(normalized))
+        if option is not None:
+            return option
+        # ищем известную фразу внутри свободного текста: сначала длинные окна
+        words = [_stem_word(w) for w in normalized.split()]
+        for size in range(min(_MAX_WINDOW, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                window = " ".join(words[start : start + size])
+                if size == 1 and len(window) < 3:
+                    continue
+                option = self._stemmed.get(window)
+                # «не ношу хиджаб», «замужем не была»: отрицание рядом с фразой — опцию не выбираем,
+                # значение останется текстом
+                if option is not None and not self._negated(words, start, start + size):
+                    return option
+        return None
+
+
+_indexes: dict[int, OptionIndex] = {}
+
+
+def get_option_index(attribute: AttributeEntry) -> OptionIndex:
+    index = _indexes.get(attribute.id)
+    # после перезагрузки реестра снимок атрибута новый — индекс пересобирается
+    if index is None or index.attribute is not attribute:
+        index = OptionIndex(attribute, _SYNONYMS.get(attribute.key))
+        _indexes[attribute.id] = index
+    return index
+
+
+def resolve_option(attribute: AttributeEntry, value: str | None) -> OptionEntry | None:
+    if not attribute.options:
+        return None
+    return get_option_index(attribute).resolve(value)
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import re
+from typing import Any
+
+from sqlalchemy import exists, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ProfilePreferenceTerm, ProfileSearch
+from app.db.option_index import normalize_option_text, stem_phrase
+
+# допустимый возраст анкеты, как в опроснике
+AGE_MIN = 16
+AGE_MAX = 80
+
+_ANY_PHRASES = {"любая", "любой", "любые", "неважно", "не важно", "без разницы", "все равно", "всё равно", "any"}
+_SPLIT = re.compile(r"[,;/|+]|\s+или\s+|\s+и\s+")
+
+_AGE_MARKERS = {
+    "от": "min",
+    "старше": "min",
+    "не младше": "min",
+    ">": "min",
+    "+": "min",
+    "и старше": "min",
+    "до": "max",
+    "младше": "max",
+    "не старше": "max",
+    "<": "max",
+    "и младше": "max",
+}
+_AGE_BOUND = re.compile(
+    r"(?:(?P<before>(?<!\w)(?:не младше|не старше|от|до|старше|младше)|[<>])\s*)?"
+    r"(?<!\d)(?P<num>\d{1,3})(?!\d)"
+    r"(?:\s*(?P<after>\+|и старше|и младше))?"
+)
+# «Русский(ая) мусульманин(ка)» — вера не часть национальности
+_RELIGION_WORDS = re.compile(r"(?<!\w)(?:мусульман\w*|муслим\w*)")
+
+
+# мужская, женская и множественная формы одной национальности должны дать один ключ:
+# по нему предпочтения партнёра жёстко отсекают анкеты в SQL
+_NATIONALITY_ALIASES: dict[str, list[str]] = {
+    "tajik": ["таджик", "таджичка", "таджики", "таджикский", "tajik"],
+    "uzbek": ["узбек", "узбечка", "узбеки", "узбекский", "uzbek"],
+    "kazakh": ["казах", "казашка", "казахи", "казахский", "kazakh"],
+    "kyrgyz": ["киргиз", "киргизка", "кыргыз", "кыргызка", "киргизы", "кыргызы", "kyrgyz"],
+    "turkmen": ["туркмен", "туркменка", "туркмены", "turkmen"],
+    "uyghur": ["уйгур", "уйгурка", "уйгуры", "uyghur"],
+    "tatar": ["татарин", "татарка", "татары", "tatar"],
+    "bashkir": ["башкир", "башкирка", "башкиры", "bashkir"],
+    "chechen": ["чеченец", "чеченка", "чеченцы", "chechen"],
+    "ingush": ["ингуш", "ингушка", "ингуши", "ingush"],
+    "dagestani": ["дагестанец", "дагестанка", "дагестанцы"],
+    "avar": ["аварец", "аварка", "аварцы", "avar"],
+    "dargin": ["даргинец", "даргинка", "даргинцы"],
+    "lezgin": ["лезгин", "лезгинка", "лезгины"],
+    "kumyk": ["кумык", "кумычка", "кумыки"],
+    "kabardian": ["кабардинец", "кабардинка", "кабардинцы"],
+    "circassian": ["черкес", "черкешенка", "черкесы", "адыг", "адыгейка", "адыгеец"],
+    "karachay": ["карачаевец", "карачаевка", "карачаевцы"],
+    "balkar": ["балкарец", "балкарка", "балкарцы"],
+    "ossetian": ["осетин", "осетинка", "осетины"],
+    "azerbaijani": ["азербайджанец", "азербайджанка", "азербайджанцы", "азери"],
+    "turk": ["турок", "турчанка", "турки", "turk"],
+    "arab": ["араб", "арабка", "арабы", "arab"],
+    "afghan": ["афганец", "афганка", "афганцы"],
+    "russian": ["русский", "русская", "русские", "russian"],
+    "ukrainian": ["украинец", "украинка", "украинцы"],
+}
+_NATIONALITY_INDEX: dict[str, str] = {
+    stem_phrase(form): code for code, forms in _NATIONALITY_ALIASES.items() for form in forms
+}
+
+
+def _fold_gender(stem: str) -> str:
+    # для национальностей вне таблицы: «аварец»/«авар(ка)», «узбеч(ка)»/«узбек»
+    if stem.endswith("ец") and len(stem) > 5:
+        stem = stem[:-2]
+    if stem.endswith("ч"):
+        stem = stem[:-1] + "к"
+    return stem
+
+
+def nationality_key(value: str | None) -> str | None:
+    # «Таджик(ка)» — обе формы сразу, берём основную
+    stem = stem_phrase(_RELIGION_WORDS.sub("", re.sub(r"\([^)]*\)", "", (value or "").lower())))
+    if not stem:
+        return None
+    code = _NATIONALITY_INDEX.get(stem)
+    if code is not None:
+        return code
+    return " ".join(_fold_gender(word) for word in stem.split())[:64]
+
+
+def parse_age_range(text: str | None) -> tuple[int | None, int | None]:
+    raw = (text or "").lower()
+    # у каждого числа своя метка: та, что стоит прямо перед ним («от 20 до 30») или после («25+»)
+    bounds: list[tuple[str | None, int]] = []
+    for m in _AGE_BOUND.finditer(raw):
+        marker = m.group("before") or m.group("after")
+        bounds.append((_AGE_MARKERS.get(marker), int(m.group("num"))))
+    if len(bounds) >= 2 and not any(kind for kind, _ in bounds):
+        # «25-30» — первые два числа задают диапазон
+        low, high = sorted(value for _, value in bounds[:2])
+        bounds = [("min", low), ("max", high)]
+    elif len(bounds) == 2:
+        # «25 до 30» — число без метки становится второй границей
+        marked = next(kind for kind, _ in bounds if kind)
+        other = "max" if marked == "min" else "min"
+        bounds = [(kind or other, value) for kind, value in bounds]
+
+    low = high = None
+    for kind, value in bounds:
+        # невозможная граница («до 100») отбрасывается сама по себе, вторая остаётся на своём месте;
+        # одно число без уточнения («30») — не знаем, граница это или ориентир; не ограничиваем
+        if not AGE_MIN <= value <= AGE_MAX:
+            continue
+        if kind == "min" and low is None:
+            low = value
+        elif kind == "max" and high is None:
+            high = value
+    if low is not None and high is not None and low > high:
+        low, high = high, low
+    return low, high
+
+
+def parse_nationality_set(text: str | None) -> set[str]:
+    normalized = (text or "").lower().replace("ё", "е").strip()
+    if not normalized or normalize_option_text(normalized) in _ANY_PHRASES:
+        return set()
+    keys = set()
+    for part in _SPLIT.split(normalized):
+        if normalize_option_text(part) in _ANY_PHRASES:
+            # «чеченка или любая» — ограничения нет
+            return set()
+        key = nationality_key(part)
+        if key:
+            keys.add(key)
+    return keys
+
+
+def preference_fields(age_range: str | None, nationalities: str | None) -> tuple[dict[str, Any], set[str]]:
+    low, high = parse_age_range(age_range)
+    nationality_set = parse_nationality_set(nationalities)
+    fields = {"pref_age_min": low, "pref_age_max": high, "pref_nationality_count": len(nationality_set)}
+    return fields, nationality_set
+
+
+async def mutual_preference_clauses(session: AsyncSession, own: ProfileSearch) -> list[Any]:
+    # незаполненное поле не отсекает анкету ни с одной стороны: иначе половина базы пропадёт из выдачи
+    candidate = ProfileSearch
+    clauses: list[Any] = []
+
+    # я подхожу под их предпочтения
+    if own.age is not None:
+        clauses.append(or_(candidate.pref_age_min.is_(None), candidate.pref_age_min <= own.age))
+        clauses.append(or_(candidate.pref_age_max.is_(None), candidate.pref_age_max >= own.age))
+    if own.nationality_key:
+        clauses.append(
+            or_(
+                candidate.pref_nationality_count == 0,
+                exists().where(
+                    ProfilePreferenceTerm.profile_id == candidate.profile_id,
+                    ProfilePreferenceTerm.key == "nationality",
+                    ProfilePreferenceTerm.value == own.nationality_key,
+                ),
+            )
+        )
+
+    # они подходят под мои
+    if own.pref_age_min is not None:
+        clauses.append(or_(candidate.age.is_(None), candidate.age >= own.pref_age_min))
+    if own.pref_age_max is not None:
+        clauses.append(or_(candidate.age.is_(None), candidate.age <= own.pref_age_max))
+    if own.pref_nationality_count:
+        res = await session.execute(
+            select(ProfilePreferenceTerm.value).where(
+                ProfilePreferenceTerm.profile_id == own.profile_id,
+                ProfilePreferenceTerm.key == "nationality",
+            )
+        )
+        wanted = list(res.scalars().all())
+        if wanted:
+            clauses.append(or_(candidate.nationality_key.is_(None), candidate.nationality_key.in_(wanted)))
+    return clauses
+
+
+async def mutual_candidate_ids(session: AsyncSession, profile_id: int, target_gender: str) -> list[int] | None:
+    own = await session.get(ProfileSearch, profile_id)
+    if own is None:
+        return None
+    clauses = await mutual_preference_clauses(session, own)
+    if not clauses:
+        # ограничений нет ни с одной стороны — фильтр не нужен
+        return None
+    res = await session.execute(
+        select(ProfileSearch.profile_id).where(ProfileSearch.gender == target_gender, *clauses)
+    )
+    return list(res.scalars().all())
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Iterable
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.attribute_registry import attribute_registry
+from app.db.fulltext import clear_fulltext, sync_fulltext
+from app.db.models import Profile, ProfileAttributeValue, ProfilePreferenceTerm, ProfileSearch, User
+from app.db.preferences import nationality_key, preference_fields
+from app.db.saved_searches import refresh_saved_searches
+from app.db.session import SessionFactory, dialect_insert
+from app.geo.gazetteer import gazetteer, grid_cell
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INT_KEYS = ("age", "height_cm", "weight_kg")
+# текстовые ключи и длина колонки
+_TEXT_LIMITS = {"location": 128, "nationality": 64}
+SEARCH_TEXT_KEYS = tuple(_TEXT_LIMITS)
+SEARCH_ENUM_KEYS = (
+    "aqida_manhaj",
+    "marital_status",
+    "children",
+    "polygyny_attitude",
+    "prayer_level",
+    "hijab_type",
+    "relocation_ready",
+)
+# предпочтения хранятся разобранными: диапазон возраста и множество национальностей
+SEARCH_PREFERENCE_KEYS = ("partner_age_range", "partner_nationality")
+# колонки Profile, из которых берём значение, если в EAV его нет (анкеты до появления атрибутов)
+_PROFILE_FALLBACK = {
+    "age": "age",
+    "location": "city",
+    "nationality": "nationality",
+    "aqida_manhaj": "aqida",
+    "marital_status": "marital_status",
+    "children": "children",
+    "polygyny_attitude": "polygyny",
+    "partner_age_range": "partner_age",
+    "partner_nationality": "partner_nationality_pref",
+}
+_REBUILD_BATCH = 500
+
+
+def location_hash(value: str | None) -> int:
+    normalized = re.sub(r"\s+", " ", (value or "").strip().lower().replace("ё", "е"))
+    if not normalized:
+        return 0
+    # 0 зарезервирован под «не указано»
+    return zlib.crc32(normalized.encode("utf-8")) + 1
+
+
+def _to_int(value: Any) -> int | None:
+    if value is None:
+        return None
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+async def build_search_rows(
+    session: AsyncSession,
+    profile_ids: Iterable[int],
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    ids = sorted(set(profile_ids))
+    if not ids:
+        return [], []
+    profiles = (
+        await session.execute(
+            select(Profile, User.gender)
+            .join(User, User.id == Profile.user_id)
+            .where(Profile.id.in_(ids), Profile.status == "ACTIVE")
+        )
+    ).all()
+    if not profiles:
+        return [], []
+
+    attrs = {
+        key: entry
+        for key in (*SEARCH_INT_KEYS, *SEARCH_TEXT_KEYS, *SEARCH_ENUM_KEYS, *SEARCH_PREFERENCE_KEYS)
+        if (entry := attribute_registry.get(key)) is not None
+    }
+    key_by_attr_id = {entry.id: key for key, entry in attrs.items()}
+    option_codes = {o.id: o.code for entry in attrs.values() for o in entry.options}
+
+    values: dict[int, dict[str, Any]] = {}
+    if key_by_attr_id:
+        pav = await session.execute(
+            select(
+                ProfileAttributeValue.profile_id,
+                ProfileAttributeValue.attribute_id,
+                ProfileAttributeValue.option_id,
+                ProfileAttributeValue.value_int,
+                ProfileAttributeValue.value_text,
+            ).where(
+                ProfileAttributeValue.profile_id.in_([p.id for p, _ in profiles]),
+                ProfileAttributeValue.attribute_id.in_(list(key_by_attr_id)),
+            )
+        )
+        for profile_id, attribute_id, option_id, value_int, value_text in pav.all():
+            key = key_by_attr_id[attribute_id]
+            if key in SEARCH_ENUM_KEYS:
+                value = option_codes.get(option_id)
+            elif key in SEARCH_INT_KEYS:
+                value = value_int if value_int is not None else _to_int(value_text)
+            elif key in _TEXT_LIMITS:
+                value = (value_text or "").strip()[: _TEXT_LIMITS[key]] or None
+            else:
+                value = (value_text or "").strip() or None
+            if value is not None:
+                values.setdefault(profile_id, {})[key] = value
+
+    now = datetime.utcnow()
+    rows: list[dict[str, Any]] = []
+    terms: list[dict[str, Any]] = []
+    for profile, gender in profiles:
+        own = values.get(profile.id, {})
+        for key, column in _PROFILE_FALLBACK.items():
+            if own.get(key) is None:
+                fallback = getattr(profile, column)
+                own[key] = _to_int(fallback) if key in SEARCH_INT_KEYS else (fallback or None)
+        place = gazetteer.resolve(own.get("location"))
+        city = place.city if place is not None else None
+        row = {
+            "profile_id": profile.id,
+            "user_id": profile.user_id,
+            "gender": gender,
+            "created_at": profile.created_at,
+            # «Moscow» и «г. Москва» дают один location_id — хэшируем каноническое название города
+            "location_id": location_hash(city.name if city is not None else own.get("location")),
+            "city_id": city.id if city is not None else None,
+            "country_code": place.country if place is not None else None,
+            "lat": city.lat if city is not None else None,
+            "lon": city.lon if city is not None else None,
+            "geo_cell": grid_cell(city.lat, city.lon) if city is not None else None,
+            "nationality_key": nationality_key(own.get("nationality")),
+            "updated_at": now,
+        }
+        for key in (*SEARCH_INT_KEYS, *SEARCH_TEXT_KEYS, *SEARCH_ENUM_KEYS):
+            row[key] = own.get(key)
+        fields, nationalities = preference_fields(own.get("partner_age_range"), own.get("partner_nationality"))
+        row.update(fields)
+        rows.append(row)
+        terms += [{"profile_id": profile.id, "key": "nationality", "value": v} for v in sorted(nationalities)]
+    return rows, terms
+
+
+async def refresh_profile_search(session: AsyncSession, profile_ids: Iterable[int]) -> int:
+    ids = sorted(set(profile_ids))
+    if not ids:
+        return 0
+    rows, terms = await build_search_rows(session, ids)
+    # анкеты, ставшие неактивными или удалённые, из поиска убираем
+    gone = set(ids) - {r["profile_id"] for r in rows}
+    if gone:
+        await session.execute(delete(ProfileSearch).where(ProfileSearch.profile_id.in_(gone)))
+    await session.execute(delete(ProfilePreferenceTerm).where(ProfilePreferenceTerm.profile_id.in_(ids)))
+    if terms:
+        await session.execute(insert(ProfilePreferenceTerm), terms)
+    if rows:
+        stmt = dialect_insert(session)(ProfileSearch).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ProfileSearch.profile_id],
+            set_={c: stmt.excluded[c] for c in rows[0] if c != "profile_id"},
+        )
+        await session.execute(stmt)
+    await sync_fulltext(session, [r["profile_id"] for r in rows], gone)
+    return len(rows)
+
+
+async def remove_from_profile_search(session: AsyncSession, profile_ids: Iterable[int]) -> None:
+    ids = list(profile_ids)
+    if ids:
+        await session.execute(delete(ProfileSearch).where(ProfileSearch.profile_id.in_(ids)))
+        await session.execute(delete(ProfilePreferenceTerm).where(ProfilePreferenceTerm.profile_id.in_(ids)))
+        await sync_fulltext(session, (), ids)
+
+
+async def rebuild_profile_search(batch_size: int = _REBUILD_BATCH) -> int:
+    started = time.perf_counter()
+    total = 0
+    async with SessionFactory() as session:
+        await session.execute(delete(ProfileSearch))
+        await session.execute(delete(ProfilePreferenceTerm))
+        await clear_fulltext(session)
+        await session.commit()
+        last_id = 0
+        while True:
+            res = await session.execute(
+                select(Profile.id)
+                .where(Profile.status == "ACTIVE", Profile.id > last_id)
+                .order_by(Profile.id)
+                .limit(batch_size)
+            )
+            ids = list(res.scalars().all())
+            if not ids:
+                break
+            total += await refresh_profile_search(session, ids)
+            # термы сохранённых поисков берутся из ключей предпочтений — после пересборки они могли измениться
+            await refresh_saved_searches(session, ids)
+            await session.commit()
+            last_id = ids[-1]
+    logger.info("Profile search rebuilt: %s profiles in %.1fs", total, time.perf_counter() - started)
+    return total
+
+
+async def _nationality_keys_stale(session: AsyncSession) -> bool:
+    # правила nationality_key поменялись — ключи в таблице и термы предпочтений надо пересчитать
+    res = await session.execute(
+        select(ProfileSearch.nationality, ProfileSearch.nationality_key)
+        .where(ProfileSearch.nationality.is_not(None))
+        .distinct()
+    )
+    return any(nationality_key(value) != key for value, key in res.all())
+
+
+async def ensure_profile_search(session: AsyncSession, force: bool = False) -> None:
+    # первая сборка для баз, где таблица только что появилась, получила новые колонки или устаревшие ключи
+    if (
+        not force
+        and await session.scalar(select(func.count()).select_from(ProfileSearch))
+        and not await _nationality_keys_stale(session)
+    ):
+        return
+    if not await session.scalar(select(func.count()).select_from(Profile).where(Profile.status == "ACTIVE")):
+        return
+    await rebuild_profile_search()
+
+
+async def _main() -> None:
+    from app.db.session import init_db
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    await init_db()
+    await rebuild_profile_search()
+
+
+if __name__ == "__main__":
+    # python -m app.db.profile_search — полная пересборка таблицы поиска
+    asyncio.run(_main())
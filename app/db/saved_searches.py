@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import and_, delete, distinct, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ProfilePreferenceTerm, ProfileSearch, SavedSearch, SavedSearchTerm, User
+from app.db.preferences import AGE_MAX, AGE_MIN, mutual_preference_clauses
+
+ANY = "*"
+# у каждого поиска есть хотя бы один терм по каждому атрибуту (конкретный или "*")
+SEARCH_ATTRIBUTES = ("gender", "age", "nationality")
+
+
+async def _search_terms(session: AsyncSession, search: SavedSearch, own: ProfileSearch) -> list[tuple[str, str]]:
+    terms = [("gender", search.target_gender)]
+    if own.pref_age_min is None and own.pref_age_max is None:
+        terms.append(("age", ANY))
+    else:
+        low = own.pref_age_min or AGE_MIN
+        high = own.pref_age_max or AGE_MAX
+        # диапазон раскладываем по годам — поиск по возрасту новой анкеты остаётся точечным
+        terms += [("age", str(age)) for age in range(low, high + 1)]
+    res = await session.execute(
+        select(ProfilePreferenceTerm.value).where(
+            ProfilePreferenceTerm.profile_id == own.profile_id,
+            ProfilePreferenceTerm.key == "nationality",
+        )
+    )
+    nationalities = list(res.scalars().all())
+    terms += [("nationality", value) for value in nationalities] or [("nationality", ANY)]
+    return terms
+
+
+async def _write_terms(session: AsyncSession, search: SavedSearch, own: ProfileSearch) -> None:
+    await session.execute(delete(SavedSearchTerm).where(SavedSearchTerm.search_id == search.id))
+    terms = await _search_terms(session, search, own)
+    await session.execute(
+        insert(SavedSearchTerm),
+        [{"attribute": attribute, "value": value, "search_id": search.id} for attribute, value in terms],
+    )
+    search.updated_at = datetime.utcnow()
+
+
+async def save_search(session: AsyncSession, user: User, target_gender: str) -> SavedSearch | None:
+    # критерии берутся из предпочтений своей анкеты — без анкеты сохранять нечего
+    own = await session.get(ProfileSearch, user.current_profile_id) if user.current_profile_id else None
+    if own is None:
+        return None
+    search = (await session.execute(select(SavedSearch).where(SavedSearch.user_id == user.id))).scalar_one_or_none()
+    if search is None:
+        search = SavedSearch(user_id=user.id, target_gender=target_gender)
+        session.add(search)
+        await session.flush()
+    search.target_gender = target_gender
+    search.is_active = True
+    await _write_terms(session, search, own)
+    return search
+
+
+async def disable_saved_search(session: AsyncSession, user_id: int) -> bool:
+    res = await session.execute(
+        update(SavedSearch)
+        .where(SavedSearch.user_id == user_id, SavedSearch.is_active.is_(True))
+        .values(is_active=False, updated_at=datetime.utcnow())
+    )
+    await session.execute(
+        delete(SavedSearchTerm).where(
+            SavedSearchTerm.search_id.in_(select(SavedSearch.id).where(SavedSearch.user_id == user_id))
+        )
+    )
+    return bool(res.rowcount)
+
+
+async def refresh_saved_searches(session: AsyncSession, profile_ids: Iterable[int]) -> None:
+    # предпочтения анкеты изменились — переписываем термы поисков её владельцев
+    ids = list(profile_ids)
+    if not ids:
+        return
+    res = await session.execute(
+        select(SavedSearch, ProfileSearch)
+        .join(User, User.id == SavedSearch.user_id)
+        .join(ProfileSearch, ProfileSearch.profile_id == User.current_profile_id)
+        .where(SavedSearch.is_active.is_(True), ProfileSearch.profile_id.in_(ids))
+    )
+    for search, own in res.all():
+        await _write_terms(session, search, own)
+
+
+async def match_saved_searches(session: AsyncSession, profile_id: int) -> list[tuple[int, int]]:
+    row = await session.get(ProfileSearch, profile_id)
+    if row is None or not row.gender:
+        return []
+    # незаполненный атрибут новой анкеты поиск не отсекает — как и в /find
+    probes = [("gender", row.gender)]
+    if row.age is not None:
+        probes += [("age", str(row.age)), ("age", ANY)]
+    if row.nationality_key:
+        probes += [("nationality", row.nationality_key), ("nationality", ANY)]
+    required = len({attribute for attribute, _ in probes})
+
+    hits = (
+        select(SavedSearchTerm.search_id)
+        .where(or_(*(and_(SavedSearchTerm.attribute == a, SavedSearchTerm.value == v) for a, v in probes)))
+        .group_by(SavedSearchTerm.search_id)
+        .having(func.count(distinct(SavedSearchTerm.attribute)) == required)
+    )
+    # обратное направление: владелец поиска должен подходить под предпочтения новой анкеты
+    stmt = (
+        select(SavedSearch.id, User.id, User.telegram_id)
+        .join(User, User.id == SavedSearch.user_id)
+        .join(ProfileSearch, ProfileSearch.profile_id == User.current_profile_id)
+        .where(
+            SavedSearch.id.in_(hits),
+            SavedSearch.is_active.is_(True),
+            User.id != row.user_id,
+            *await mutual_preference_clauses(session, row),
+        )
+    )
+    matched = (await session.execute(stmt)).all()
+    if matched:
+        await session.execute(
+            update(SavedSearch)
+            .where(SavedSearch.id.in_([search_id for search_id, _, _ in matched]))
+            .values(last_notified_at=datetime.utcnow())
+        )
+    return [(user_id, telegram_id) for _, user_id, telegram_id in matched]
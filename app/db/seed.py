@@ -3,6 +3,7 @@ from __future__ import annotations
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.db.attribute_registry import attribute_registry
 from app.db.models import Attribute, AttributeOption
 
 CANONICAL_ATTRIBUTES: list[dict] = [
@@ -42,6 +43,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("OTHER", "Другое"),
             ("UNKNOWN", "Не знаю"),
         ],
+        "synonyms": {
+            "AHLU_SUNNA": ["ахлю сунна валь джамаа", "ахль сунна", "ахлюс сунна", "суннит", "суннитка", "sunni", "ahlus sunnah"],
+            "SALAFI": ["салафи", "салафит", "салафитка", "салафия", "манхадж салафов", "salafi"],
+            "OTHER": ["другое", "иное"],
+            "UNKNOWN": ["не знаю", "затрудняюсь"],
+        },
     },
     {
         "key": "marital_status",
@@ -55,6 +62,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("DIVORCED", "В разводе"),
             ("WIDOWED", "Вдовец/вдова"),
         ],
+        "synonyms": {
+            "NEVER_MARRIED": ["не был женат", "не была замужем", "не женат", "не замужем", "холост", "холостой", "single"],
+            "MARRIED": ["женат", "замужем", "married"],
+            "DIVORCED": ["разведен", "разведена", "разводе", "divorced"],
+            "WIDOWED": ["вдовец", "вдова", "widowed"],
+        },
     },
     {
         "key": "children",
@@ -69,6 +82,13 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("HAS_3PLUS", "Есть: 3+"),
             ("UNKNOWN", "Не хочу указывать"),
         ],
+        "synonyms": {
+            "NONE": ["нет детей", "детей нет", "без детей", "0"],
+            "HAS_1": ["1", "один ребенок", "одна дочь", "один сын", "есть ребенок"],
+            "HAS_2": ["2", "двое детей", "два ребенка"],
+            "HAS_3PLUS": ["3", "3+", "трое детей", "четверо детей", "многодетный", "многодетная"],
+            "UNKNOWN": ["не хочу указывать", "не указано"],
+        },
     },
     {
         "key": "polygyny_attitude",
@@ -82,6 +102,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("SEEKS_POLYGYNY", "Хочу/планирую многоженство"),
             ("NEUTRAL", "Не важно/не обсуждала(л)"),
         ],
+        "synonyms": {
+            "MONOGAMY_ONLY": ["единобрачие", "только единобрачие", "против многоженства", "моногамия"],
+            "OPEN_TO_POLYGYNY": ["допускаю многоженство", "не против многоженства", "согласна на многоженство"],
+            "SEEKS_POLYGYNY": ["планирую многоженство", "хочу многоженство", "ищу вторую жену", "вторая жена"],
+            "NEUTRAL": ["не важно", "не обсуждал", "не обсуждала"],
+        },
     },
     {
         "key": "height_cm",
@@ -111,6 +137,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("RARELY", "Редко/не совершаю"),
             ("UNKNOWN", "Не указано"),
         ],
+        "synonyms": {
+            "REGULAR": ["регулярно", "пятикратно", "5 раз в день", "совершаю намаз", "соблюдаю намаз"],
+            "SOMETIMES": ["иногда", "не всегда"],
+            "RARELY": ["редко", "не совершаю", "не молюсь"],
+            "UNKNOWN": ["не указано"],
+        },
     },
     {
         "key": "hijab_type",
@@ -124,6 +156,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("SHARIA", "Шариатский хиджаб"),
             ("NONE", "Не указано"),
         ],
+        "synonyms": {
+            "NIQAB": ["никаб", "в никабе"],
+            "HIJAB": ["хиджаб", "в хиджабе", "платок"],
+            "SHARIA": ["шариатский хиджаб", "джильбаб", "химар"],
+            "NONE": ["не указано", "без хиджаба"],
+        },
     },
     {
         "key": "relocation_ready",
@@ -137,6 +175,12 @@ CANONICAL_ATTRIBUTES: list[dict] = [
             ("DEPENDS", "Зависит"),
             ("UNKNOWN", "Не указано"),
         ],
+        "synonyms": {
+            "YES": ["готов к переезду", "готова к переезду", "готов переехать", "готова переехать", "да"],
+            "NO": ["не готов", "не готова", "не готов к переезду", "не готова к переезду", "нет"],
+            "DEPENDS": ["зависит", "обсуждаемо", "возможно"],
+            "UNKNOWN": ["не указано"],
+        },
     },
     {
         "key": "partner_age_range",
@@ -146,6 +190,14 @@ CANONICAL_ATTRIBUTES: list[dict] = [
         "is_primary": False,
         "options": [],
     },
+    {
+        "key": "partner_nationality",
+        "title": "Национальность партнера",
+        "scope": "PREFERENCE",
+        "value_type": "TEXT",
+        "is_primary": False,
+        "options": [],
+    },
 ]
 
 
@@ -196,3 +248,4 @@ async def seed_canonical_attributes(session: AsyncSession) -> None:
                     )
 
     await session.commit()
+    await attribute_registry.load(session)
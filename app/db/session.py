@@ -14,20 +14,42 @@ SessionFactory: async_sessionmaker[AsyncSession] = async_sessionmaker(
 )
 
 
+def dialect_insert(session: AsyncSession):
+    # INSERT ... ON CONFLICT есть только в диалектных insert
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"Bulk upsert is not supported for dialect {dialect!r}")
+    return insert
+
+
 async def _get_columns(conn, table_name: str) -> set[str]:
     rows = (await conn.execute(text(f"PRAGMA table_info({table_name});"))).fetchall()
     return {r[1] for r in rows}
 
 
-async def _ensure_column(conn, table: str, col: str, sql_type: str) -> None:
+async def _ensure_column(conn, table: str, col: str, sql_type: str) -> bool:
     cols = await _get_columns(conn, table)
     if col not in cols:
         await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {sql_type};"))
+        return True
+    return False
+
+
+async def _ensure_index(conn, name: str, table: str, cols: list[str]) -> None:
+    # create_all не добавляет индексы в уже существующие таблицы
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)});"))
 
 
 async def init_db() -> None:
     # важно: импортируем модели, чтобы Base.metadata знала о таблицах
     from app.db import models  # noqa: F401
+    from app.db.attribute_aliases import attribute_matcher
+    from app.db.fulltext import ensure_fulltext
+    from app.db.profile_search import ensure_profile_search
     from app.db.seed import seed_canonical_attributes
 
     async with engine.begin() as conn:
@@ -35,6 +57,7 @@ async def init_db() -> None:
 
         # users
         await _ensure_column(conn, "users", "gender", "VARCHAR(10)")
+        await _ensure_column(conn, "users", "current_profile_id", "INTEGER")
 
         # profiles — добавляем колонки, если база старая
         await _ensure_column(conn, "profiles", "name", "VARCHAR(64)")
@@ -56,6 +79,41 @@ async def init_db() -> None:
 
         await _ensure_column(conn, "profiles", "about_me_text", "TEXT")
         await _ensure_column(conn, "profiles", "looking_for_text", "TEXT")
+        await _ensure_column(conn, "profiles", "superseded_at", "DATETIME")
+
+        # /find листает profile_search, индекс для keyset-пагинации по profiles больше не нужен
+        await conn.execute(text("DROP INDEX IF EXISTS ix_profiles_status_created_at_id;"))
+
+        await _ensure_column(conn, "profile_attribute_values", "source", "VARCHAR(16)")
+        await _ensure_column(conn, "profile_attribute_values", "prompt_version", "VARCHAR(16)")
+
+        await _ensure_column(conn, "attributes", "merged_into_id", "INTEGER")
+        await _ensure_column(conn, "attributes", "merged_at", "DATETIME")
+
+        await _ensure_column(conn, "extraction_jobs", "claim_token", "VARCHAR(32)")
+
+        # новые колонки profile_search заполняются полной пересборкой
+        search_added = [
+            await _ensure_column(conn, "profile_search", "nationality_key", "VARCHAR(64)"),
+            await _ensure_column(conn, "profile_search", "pref_age_min", "INTEGER"),
+            await _ensure_column(conn, "profile_search", "pref_age_max", "INTEGER"),
+            await _ensure_column(conn, "profile_search", "pref_nationality_count", "INTEGER DEFAULT 0"),
+            await _ensure_column(conn, "profile_search", "city_id", "INTEGER"),
+            await _ensure_column(conn, "profile_search", "country_code", "VARCHAR(2)"),
+            await _ensure_column(conn, "profile_search", "lat", "FLOAT"),
+            await _ensure_column(conn, "profile_search", "lon", "FLOAT"),
+            await _ensure_column(conn, "profile_search", "geo_cell", "INTEGER"),
+        ]
+        await _ensure_index(
+            conn, "ix_profile_search_gender_nationality_key", "profile_search", ["gender", "nationality_key"]
+        )
+        await _ensure_index(conn, "ix_profile_search_gender_city_id", "profile_search", ["gender", "city_id"])
+        await _ensure_index(conn, "ix_profile_search_gender_country_code", "profile_search", ["gender", "country_code"])
+        await _ensure_index(conn, "ix_profile_search_gender_geo_cell", "profile_search", ["gender", "geo_cell"])
+        # полнотекстовый индекс заполняется той же пересборкой
+        search_added.append(await ensure_fulltext(conn))
 
     async with SessionFactory() as session:
         await seed_canonical_attributes(session)
+        await attribute_matcher.load(session)
+        await ensure_profile_search(session, force=any(search_added))
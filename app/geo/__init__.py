@@ -0,0 +1 @@
+"""Offline geocoding package."""
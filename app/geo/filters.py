@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import ProfileSearch
+from app.geo.gazetteer import cells_within, haversine_km
+
+SCOPE_CITY = "city"
+SCOPE_COUNTRY = "country"
+SCOPE_RADIUS = "radius"
+
+_CITY_WORDS = {"город", "city", "мой город"}
+_COUNTRY_WORDS = {"страна", "country", "моя страна"}
+_RADIUS_RE = re.compile(r"^(\d{1,5})\s*(км|km|к|k)?$")
+
+
+@dataclass(frozen=True)
+class GeoScope:
+    kind: str
+    radius_km: int = 0
+
+    @property
+    def token(self) -> str:
+        # компактная форма для callback_data «Показать ещё»
+        return f"r{self.radius_km}" if self.kind == SCOPE_RADIUS else self.kind
+
+
+def parse_geo_scope(text: str | None) -> GeoScope | None:
+    # "город" / "страна" / "100" / "100 км"; ValueError — аргумент не распознан
+    value = re.sub(r"\s+", " ", (text or "").strip().lower())
+    if not value:
+        return None
+    if value in _CITY_WORDS:
+        return GeoScope(SCOPE_CITY)
+    if value in _COUNTRY_WORDS:
+        return GeoScope(SCOPE_COUNTRY)
+    match = _RADIUS_RE.match(value)
+    if match is None:
+        raise ValueError(value)
+    return GeoScope(SCOPE_RADIUS, max(1, min(int(match.group(1)), settings.geo_max_radius_km)))
+
+
+def decode_geo_token(token: str | None) -> GeoScope | None:
+    if token in (SCOPE_CITY, SCOPE_COUNTRY):
+        return GeoScope(token)
+    if token and token.startswith("r") and token[1:].isdigit():
+        return GeoScope(SCOPE_RADIUS, int(token[1:]))
+    return None
+
+
+@dataclass(frozen=True)
+class GeoFilter:
+    scope: GeoScope
+    city_id: int | None
+    country_code: str | None
+    lat: float | None
+    lon: float | None
+
+    def clauses(self) -> list[Any]:
+        # каждое условие идёт по своему индексу (gender, city_id / country_code / geo_cell)
+        if self.scope.kind == SCOPE_CITY:
+            return [ProfileSearch.city_id == self.city_id]
+        if self.scope.kind == SCOPE_COUNTRY:
+            return [ProfileSearch.country_code == self.country_code]
+        return [ProfileSearch.geo_cell.in_(cells_within(self.lat, self.lon, self.scope.radius_km))]
+
+    def accepts(self, lat: float | None, lon: float | None) -> bool:
+        # ячейки покрывают квадрат вокруг круга — углы отсекаем точным расстоянием
+        if self.scope.kind != SCOPE_RADIUS:
+            return True
+        if lat is None or lon is None:
+            return False
+        return haversine_km(self.lat, self.lon, lat, lon) <= self.scope.radius_km
+
+
+def build_geo_filter(own: ProfileSearch | None, scope: GeoScope) -> GeoFilter | None:
+    # None — своя локация не распознана, и сравнивать не с чем
+    if own is None:
+        return None
+    if scope.kind == SCOPE_COUNTRY:
+        if own.country_code is None:
+            return None
+    elif own.city_id is None or own.lat is None or own.lon is None:
+        return None
+    return GeoFilter(scope, own.city_id, own.country_code, own.lat, own.lon)
+
+
+async def geo_candidate_ids(
+    session: AsyncSession,
+    geo: GeoFilter,
+    target_gender: str,
+    viewer_user_id: int,
+) -> list[int]:
+    res = await session.execute(
+        select(ProfileSearch.profile_id, ProfileSearch.lat, ProfileSearch.lon).where(
+            ProfileSearch.gender == target_gender,
+            ProfileSearch.user_id != viewer_user_id,
+            *geo.clauses(),
+        )
+    )
+    return [pid for pid, lat, lon in res.all() if geo.accepts(lat, lon)]
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from app.db.option_index import stem_phrase
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = Path(__file__).with_name("gazetteer.json")
+EARTH_RADIUS_KM = 6371.0
+# сетка по широте/долготе: ячейка — CELL_DEGREES x CELL_DEGREES градусов
+CELL_DEGREES = 1.0
+_COLUMNS = int(360 / CELL_DEGREES)
+_ROWS = int(180 / CELL_DEGREES)
+# «Набережные Челны», «Франкфурт на Майне» — названия до трёх слов
+_MAX_WINDOW = 3
+
+
+@dataclass(frozen=True)
+class City:
+    id: int
+    name: str
+    country: str
+    lat: float
+    lon: float
+
+
+@dataclass(frozen=True)
+class Place:
+    country: str
+    city: City | None = None
+
+
+def grid_cell(lat: float, lon: float) -> int:
+    row = min(int(math.floor((lat + 90.0) / CELL_DEGREES)), _ROWS - 1)
+    col = int(math.floor((lon + 180.0) / CELL_DEGREES)) % _COLUMNS
+    return row * _COLUMNS + col
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_within(lat: float, lon: float, radius_km: float) -> list[int]:
+    # ячейки, пересекающие описанный вокруг круга прямоугольник; точное расстояние проверяется отдельно
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    far_lat = min(89.9, abs(lat) + dlat)
+    dlon = dlat / max(math.cos(math.radians(far_lat)), 1e-6)
+    row_from = max(0, int(math.floor((lat - dlat + 90.0) / CELL_DEGREES)))
+    row_to = min(_ROWS - 1, int(math.floor((lat + dlat + 90.0) / CELL_DEGREES)))
+    if dlon >= 180.0:
+        cols = range(_COLUMNS)
+    else:
+        col_from = int(math.floor((lon - dlon + 180.0) / CELL_DEGREES))
+        col_to = int(math.floor((lon + dlon + 180.0) / CELL_DEGREES))
+        # через антимеридиан номера колонок заворачиваются
+        cols = sorted({c % _COLUMNS for c in range(col_from, col_to + 1)})
+    return [row * _COLUMNS + col for row in range(row_from, row_to + 1) for col in cols]
+
+
+class Gazetteer:
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.countries: dict[str, str] = {}
+        self.cities: dict[int, City] = {}
+        self._country_keys: dict[str, str] = {}
+        self._city_keys: dict[str, City] = {}
+        for spec in data.get("countries", []):
+            code = spec["code"]
+            self.countries[code] = spec["name"]
+            for name in (spec["name"], *spec.get("aliases", [])):
+                self._add(self._country_keys, name, code)
+        for spec in data.get("cities", []):
+            city = City(int(spec["id"]), spec["name"], spec["country"], float(spec["lat"]), float(spec["lon"]))
+            self.cities[city.id] = city
+            for name in (spec["name"], *spec.get("aliases", [])):
+                self._add(self._city_keys, name, city)
+
+    @classmethod
+    def load(cls, path: Path = GAZETTEER_PATH) -> Gazetteer:
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _add(keys: dict[str, Any], name: str, value: Any) -> None:
+        key = stem_phrase(name)
+        if not key:
+            return
+        existing = keys.setdefault(key, value)
+        if existing != value:
+            logger.warning("Gazetteer key %r is ambiguous, keeping the first entry", key)
+
+    def resolve(self, text: str | None) -> Place | None:
+        # «г. Москва, Россия», «в Казани», «Moscow» -> город и страна; «Турция» -> только страна
+        words = stem_phrase(text or "").split()
+        cities: list[City] = []
+        countries: list[str] = []
+        i = 0
+        while i < len(words):
+            for size in range(min(_MAX_WINDOW, len(words) - i), 0, -1):
+                key = " ".join(words[i : i + size])
+                city = self._city_keys.get(key)
+                country = self._country_keys.get(key)
+                if city is not None or country is not None:
+                    if city is not None:
+                        cities.append(city)
+                    if country is not None:
+                        countries.append(country)
+                    i += size
+                    break
+            else:
+                i += 1
+        country = countries[0] if countries else None
+        for city in cities:
+            if country is None or city.country == country:
+                return Place(city.country, city)
+        return Place(country) if country is not None else None
+
+
+gazetteer = Gazetteer.load()
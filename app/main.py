@@ -3,8 +3,15 @@ import logging
 
 from aiogram import Bot, Dispatcher
 
+from app.ai.attribute_extractor import close_openai_client
+from app.ai.extraction_queue import extraction_queue
+from app.ai.extraction_service import extract_and_persist_batch
 from app.core.config import settings
-from app.db.session import init_db
+from app.db.attribute_consolidation import run_consolidation_loop
+from app.db.compaction import run_compaction_loop
+from app.db.session import SessionFactory, init_db
+from app.matching.precompute import match_precomputer
+from app.matching.text_index import text_index
 from app.bot.handlers import router
 
 
@@ -13,12 +20,25 @@ async def main() -> None:
 
 
     await init_db()
+    async with SessionFactory() as session:
+        await text_index.load(session)
 
     bot = Bot(token=settings.bot_token)
     dp = Dispatcher()
     dp.include_router(router)
 
-    await dp.start_polling(bot)
+    await extraction_queue.start(extract_and_persist_batch)
+    await match_precomputer.start()
+    compaction_task = asyncio.create_task(run_compaction_loop(), name="profile-compaction")
+    consolidation_task = asyncio.create_task(run_consolidation_loop(), name="attribute-consolidation")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        consolidation_task.cancel()
+        compaction_task.cancel()
+        await match_precomputer.stop()
+        await extraction_queue.stop()
+        await close_openai_client()
 
 
 if __name__ == "__main__":
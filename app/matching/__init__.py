@@ -0,0 +1 @@
+"""Profile matching package."""
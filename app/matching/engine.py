@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.attribute_registry import attribute_registry
+from app.db.models import ProfileSearch
+
+logger = logging.getLogger(__name__)
+
+ENUM_FEATURES = ("aqida_manhaj", "marital_status", "children", "polygyny_attitude", "relocation_ready")
+GENDER_CODES = {"BROTHER": 1, "SISTER": 2}
+
+# значение компоненты, если у одной из сторон атрибут не заполнен
+_NEUTRAL = 0.5
+_AGE_SPAN = 10.0
+
+# совместимость вариантов; пары симметричны, "*" — любой вариант; равные коды по умолчанию дают 1.0.
+# если правило "*" есть у обоих кодов, берётся меньшее — матрица остаётся симметричной
+_MISMATCH = {
+    "aqida_manhaj": 0.0,
+    "marital_status": 0.5,
+    "children": 0.5,
+    "polygyny_attitude": 0.3,
+    "relocation_ready": 0.5,
+}
+_COMPAT: dict[str, dict[tuple[str, str], float]] = {
+    "aqida_manhaj": {("UNKNOWN", "*"): 0.5, ("OTHER", "*"): 0.3},
+    "children": {
+        ("UNKNOWN", "*"): 0.5,
+        ("HAS_1", "HAS_2"): 0.8,
+        ("HAS_2", "HAS_3PLUS"): 0.8,
+        ("HAS_1", "HAS_3PLUS"): 0.6,
+    },
+    "polygyny_attitude": {
+        ("MONOGAMY_ONLY", "OPEN_TO_POLYGYNY"): 0.5,
+        ("MONOGAMY_ONLY", "SEEKS_POLYGYNY"): 0.0,
+        ("MONOGAMY_ONLY", "NEUTRAL"): 0.7,
+        ("OPEN_TO_POLYGYNY", "SEEKS_POLYGYNY"): 0.9,
+        ("OPEN_TO_POLYGYNY", "NEUTRAL"): 0.8,
+        ("SEEKS_POLYGYNY", "NEUTRAL"): 0.5,
+    },
+    "relocation_ready": {
+        ("YES", "*"): 1.0,
+        ("UNKNOWN", "*"): 0.5,
+        ("DEPENDS", "DEPENDS"): 0.7,
+        ("NO", "NO"): 0.2,
+    },
+}
+
+
+def _compat_matrix(key: str, codes: list[str]) -> np.ndarray:
+    rules = _COMPAT.get(key, {})
+    mismatch = _MISMATCH.get(key, 0.0)
+    matrix = np.full((len(codes) + 1, len(codes) + 1), _NEUTRAL, dtype=np.float32)
+    for i, a in enumerate(codes, start=1):
+        for j, b in enumerate(codes, start=1):
+            explicit = rules.get((a, b), rules.get((b, a)))
+            wildcards = [rules[(c, "*")] for c in (a, b) if (c, "*") in rules]
+            if explicit is not None:
+                matrix[i, j] = explicit
+            elif wildcards:
+                matrix[i, j] = min(wildcards)
+            else:
+                matrix[i, j] = 1.0 if a == b else mismatch
+    return matrix
+
+
+@dataclass
+class CandidateMatrix:
+    profile_ids: np.ndarray  # int64, по возрастанию
+    gender: np.ndarray  # int8, GENDER_CODES
+    age: np.ndarray  # float32, NaN — не указан
+    location: np.ndarray  # int64, location_hash
+    codes: dict[str, np.ndarray]  # int16, 0 — не указан, иначе позиция варианта + 1
+    compat: dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.profile_ids)
+
+    def index_of(self, profile_id: int) -> int | None:
+        i = int(np.searchsorted(self.profile_ids, profile_id))
+        if i < len(self.profile_ids) and self.profile_ids[i] == profile_id:
+            return i
+        return None
+
+    def score(self, i: int, weights: dict[str, float]) -> np.ndarray:
+        n = len(self.profile_ids)
+        total = np.zeros(n, dtype=np.float32)
+        weight_sum = 0.0
+
+        w = weights.get("age", 0.0)
+        if w:
+            if np.isnan(self.age[i]):
+                comp = np.full(n, _NEUTRAL, dtype=np.float32)
+            else:
+                comp = 1.0 - np.minimum(np.abs(self.age - self.age[i]) / _AGE_SPAN, 1.0)
+                comp = np.where(np.isnan(comp), _NEUTRAL, comp)
+            total += w * comp
+            weight_sum += w
+
+        for key in ENUM_FEATURES:
+            w = weights.get(key, 0.0)
+            if not w or key not in self.codes:
+                continue
+            column = self.codes[key]
+            # одна строка матрицы совместимости, проиндексированная кодами всех кандидатов
+            total += w * self.compat[key][column[i]][column]
+            weight_sum += w
+
+        w = weights.get("location", 0.0)
+        if w:
+            mine = self.location[i]
+            if mine == 0:
+                comp = np.full(n, _NEUTRAL, dtype=np.float32)
+            else:
+                comp = np.where(self.location == mine, 1.0, np.where(self.location == 0, _NEUTRAL, 0.0))
+            total += w * comp
+            weight_sum += w
+
+        return total / weight_sum if weight_sum else total
+
+    def top_k(
+        self,
+        i: int,
+        target_gender: str,
+        k: int,
+        exclude_ids: np.ndarray | None = None,
+        allowed_ids: np.ndarray | None = None,
+    ) -> list[tuple[int, float]]:
+        mask = self.gender == GENDER_CODES.get(target_gender, 0)
+        if allowed_ids is not None:
+            # кандидаты, уже отобранные в БД взаимными предпочтениями
+            mask &= np.isin(self.profile_ids, allowed_ids)
+        if exclude_ids is not None and len(exclude_ids):
+            mask &= ~np.isin(self.profile_ids, exclude_ids)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates) or k <= 0:
+            return []
+        scores = self.score(i, settings.match_weights)[candidates]
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.profile_ids[candidates[t]]), float(scores[t])) for t in top]
+
+
+async def load_candidate_matrix(session: AsyncSession) -> CandidateMatrix:
+    # одна выборка из плоской таблицы profile_search вместо join по EAV
+    columns = [getattr(ProfileSearch, key) for key in ENUM_FEATURES]
+    rows = (
+        await session.execute(
+            select(ProfileSearch.profile_id, ProfileSearch.gender, ProfileSearch.age, ProfileSearch.location_id, *columns)
+            .order_by(ProfileSearch.profile_id)
+        )
+    ).all()
+    n = len(rows)
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+    gender = np.fromiter((GENDER_CODES.get(r[1] or "", 0) for r in rows), dtype=np.int8, count=n)
+    age = np.fromiter((np.nan if r[2] is None else r[2] for r in rows), dtype=np.float32, count=n)
+    location = np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=n)
+    codes: dict[str, np.ndarray] = {}
+    compat: dict[str, np.ndarray] = {}
+
+    for offset, key in enumerate(ENUM_FEATURES, start=4):
+        option_codes = attribute_registry.option_codes(key)
+        if not option_codes:
+            continue
+        positions = {code: pos for pos, code in enumerate(option_codes, start=1)}
+        codes[key] = np.fromiter((positions.get(r[offset], 0) for r in rows), dtype=np.int16, count=n)
+        compat[key] = _compat_matrix(key, option_codes)
+
+    return CandidateMatrix(ids, gender, age, location, codes, compat)
+
+
+class MatchEngine:
+    def __init__(self) -> None:
+        self._matrix: CandidateMatrix | None = None
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def _stale(self) -> bool:
+        if self._matrix is None:
+            return True
+        return self._dirty and time.monotonic() - self._loaded_at >= settings.match_refresh_interval
+
+    async def matrix(self, session: AsyncSession, force: bool = False) -> CandidateMatrix:
+        if not force and not self._stale():
+            return self._matrix
+        async with self._lock:
+            if force or self._stale():
+                # флаг снимаем до загрузки: запись во время загрузки снова пометит матрицу устаревшей
+                self._dirty = False
+                started = time.perf_counter()
+                self._matrix = await load_candidate_matrix(session)
+                self._loaded_at = time.monotonic()
+                logger.info(
+                    "Match matrix loaded: %s profiles in %.0f ms",
+                    len(self._matrix),
+                    (time.perf_counter() - started) * 1000,
+                )
+        return self._matrix
+
+    async def top_matches(
+        self,
+        session: AsyncSession,
+        profile_id: int,
+        target_gender: str,
+        k: int | None = None,
+        exclude_ids: np.ndarray | None = None,
+        allowed_ids: list[int] | None = None,
+    ) -> list[tuple[int, float]]:
+        matrix = await self.matrix(session)
+        i = matrix.index_of(profile_id)
+        if i is None and self._dirty:
+            # анкета только что создана и ещё не попала в матрицу
+            matrix = await self.matrix(session, force=True)
+            i = matrix.index_of(profile_id)
+        if i is None:
+            return []
+        allowed = None if allowed_ids is None else np.asarray(allowed_ids, dtype=np.int64)
+        return matrix.top_k(i, target_gender, k or settings.match_top_k, exclude_ids, allowed)
+
+
+match_engine = MatchEngine()
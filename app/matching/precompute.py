@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import delete, exists, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.attribute_registry import attribute_registry
+from app.db.models import ProfileMatch, ProfileSearch
+from app.db.preferences import mutual_candidate_ids
+from app.db.session import SessionFactory
+from app.matching.engine import GENDER_CODES, CandidateMatrix, load_candidate_matrix, match_engine
+
+logger = logging.getLogger(__name__)
+
+_TARGET_BY_CODE = {GENDER_CODES["BROTHER"]: "SISTER", GENDER_CODES["SISTER"]: "BROTHER"}
+_INSERT_CHUNK = 1000
+
+
+async def compute_match_list(session: AsyncSession, matrix: CandidateMatrix, profile_id: int) -> list[tuple[int, float]] | None:
+    i = matrix.index_of(profile_id)
+    if i is None:
+        return None
+    target = _TARGET_BY_CODE.get(int(matrix.gender[i]))
+    if target is None:
+        return []
+    allowed = await mutual_candidate_ids(session, profile_id, target)
+    allowed_ids = None if allowed is None else np.asarray(allowed, dtype=np.int64)
+    return matrix.top_k(i, target, settings.match_precompute_k, allowed_ids=allowed_ids)
+
+
+async def store_match_lists(session: AsyncSession, lists: dict[int, list[tuple[int, float]]]) -> None:
+    if not lists:
+        return
+    await session.execute(delete(ProfileMatch).where(ProfileMatch.profile_id.in_(list(lists))))
+    now = datetime.utcnow()
+    records = [
+        {"profile_id": pid, "rank": rank, "candidate_id": cid, "score": score, "computed_at": now}
+        for pid, matches in lists.items()
+        for rank, (cid, score) in enumerate(matches)
+    ]
+    for start in range(0, len(records), _INSERT_CHUNK):
+        await session.execute(insert(ProfileMatch), records[start : start + _INSERT_CHUNK])
+
+
+async def read_match_list(session: AsyncSession, profile_id: int, limit: int) -> list[tuple[int, float]]:
+    # чтение по первичному ключу (profile_id, rank)
+    res = await session.execute(
+        select(ProfileMatch.candidate_id, ProfileMatch.score)
+        .where(ProfileMatch.profile_id == profile_id)
+        .order_by(ProfileMatch.rank)
+        .limit(limit)
+    )
+    return [(cid, score) for cid, score in res.all()]
+
+
+class MatchPrecomputer:
+    def __init__(self) -> None:
+        self._pending: set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # profile_id -> оценка последнего места в списке; -inf, если список короче K
+        self._thresholds: dict[int, float] | None = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, profile_ids: Iterable[int]) -> None:
+        self._pending.update(profile_ids)
+        if self._pending:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        async with SessionFactory() as session:
+            # анкеты без списка: новые базы и изменения, не обработанные до перезапуска
+            res = await session.execute(
+                select(ProfileSearch.profile_id).where(
+                    ~exists().where(ProfileMatch.profile_id == ProfileSearch.profile_id)
+                )
+            )
+            self.schedule(res.scalars().all())
+        self._task = asyncio.create_task(self._loop(), name="match-precompute")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # даём накопиться пачке изменений — одна перезагрузка матрицы на пачку
+            await asyncio.sleep(settings.match_precompute_debounce)
+            self._wakeup.clear()
+            changed, self._pending = self._pending, set()
+            try:
+                async with SessionFactory() as session:
+                    updated = await self.update(session, changed)
+                    await session.commit()
+                logger.info("Match lists updated: %s changed, %s recomputed", len(changed), updated)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Match list update failed")
+                self._thresholds = None
+                self.schedule(changed)
+
+    async def _load_thresholds(self, session: AsyncSession) -> dict[int, float]:
+        if self._thresholds is None:
+            k = settings.match_precompute_k
+            res = await session.execute(
+                select(ProfileMatch.profile_id, func.count(), func.min(ProfileMatch.score)).group_by(
+                    ProfileMatch.profile_id
+                )
+            )
+            self._thresholds = {pid: (low if count >= k else -np.inf) for pid, count, low in res.all()}
+        return self._thresholds
+
+    async def update(self, session: AsyncSession, changed: set[int]) -> int:
+        if not changed:
+            return 0
+        matrix = await match_engine.matrix(session, force=True)
+        thresholds = await self._load_thresholds(session)
+
+        # списки, где изменённые анкеты уже стоят
+        res = await session.execute(
+            select(ProfileMatch.profile_id).where(ProfileMatch.candidate_id.in_(list(changed))).distinct()
+        )
+        affected = set(res.scalars().all())
+        gone: list[int] = []
+        for pid in changed:
+            i = matrix.index_of(pid)
+            if i is None:
+                gone.append(pid)
+                continue
+            affected.add(pid)
+            target = _TARGET_BY_CODE.get(int(matrix.gender[i]))
+            if target is None:
+                continue
+            # оценка и взаимные предпочтения симметричны (симметрию _compat_matrix проверяют тесты движка):
+            # вектор анкеты показывает, в чьи списки она теперь проходит
+            mask = matrix.gender == GENDER_CODES[target]
+            allowed = await mutual_candidate_ids(session, pid, target)
+            if allowed is not None:
+                mask &= np.isin(matrix.profile_ids, allowed)
+            others = np.flatnonzero(mask)
+            scores = matrix.score(i, settings.match_weights)[others]
+            others_ids = matrix.profile_ids[others]
+            limits = np.fromiter(
+                (thresholds.get(int(o), -np.inf) for o in others_ids), dtype=np.float64, count=len(others_ids)
+            )
+            affected.update(int(o) for o in others_ids[scores > limits])
+
+        if gone:
+            await session.execute(delete(ProfileMatch).where(ProfileMatch.profile_id.in_(gone)))
+            for pid in gone:
+                thresholds.pop(pid, None)
+                affected.discard(pid)
+
+        lists: dict[int, list[tuple[int, float]]] = {}
+        for pid in affected:
+            matches = await compute_match_list(session, matrix, pid)
+            if matches is None:
+                continue
+            lists[pid] = matches
+            thresholds[pid] = matches[-1][1] if len(matches) >= settings.match_precompute_k else -np.inf
+        await store_match_lists(session, lists)
+        return len(lists)
+
+
+match_precomputer = MatchPrecomputer()
+
+
+# --- полная пересборка: python -m app.matching.precompute --workers N ---
+
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_matrix: CandidateMatrix | None = None
+
+
+async def _load_worker_state() -> None:
+    global _worker_matrix
+    async with SessionFactory() as session:
+        await attribute_registry.load(session)
+        _worker_matrix = await load_candidate_matrix(session)
+
+
+def _init_worker() -> None:
+    global _worker_loop
+    # у процесса свой движок БД и свой event loop на всё время жизни пула
+    _worker_loop = asyncio.new_event_loop()
+    _worker_loop.run_until_complete(_load_worker_state())
+
+
+async def _compute_chunk_async(matrix: CandidateMatrix, ids: list[int]) -> dict[int, list[tuple[int, float]]]:
+    lists: dict[int, list[tuple[int, float]]] = {}
+    async with SessionFactory() as session:
+        for pid in ids:
+            matches = await compute_match_list(session, matrix, pid)
+            if matches is not None:
+                lists[pid] = matches
+    return lists
+
+
+def _compute_chunk(ids: list[int]) -> dict[int, list[tuple[int, float]]]:
+    return _worker_loop.run_until_complete(_compute_chunk_async(_worker_matrix, ids))
+
+
+async def rebuild_match_lists(workers: int = 1, chunk_size: int | None = None) -> int:
+    started = time.perf_counter()
+    chunk_size = chunk_size or settings.match_rebuild_chunk_size
+    async with SessionFactory() as session:
+        ids = list((await session.execute(select(ProfileSearch.profile_id).order_by(ProfileSearch.profile_id))).scalars())
+        await session.execute(delete(ProfileMatch))
+        await session.commit()
+    chunks = [ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+    done = 0
+
+    async def write(lists: dict[int, list[tuple[int, float]]]) -> None:
+        nonlocal done
+        async with SessionFactory() as session:
+            await store_match_lists(session, lists)
+            await session.commit()
+        done += len(lists)
+        logger.info("Match lists: %s/%s profiles, %.1fs", done, len(ids), time.perf_counter() - started)
+
+    if workers <= 1 or len(chunks) <= 1:
+        async with SessionFactory() as session:
+            matrix = await match_engine.matrix(session, force=True)
+        for chunk in chunks:
+            await write(await _compute_chunk_async(matrix, chunk))
+    else:
+        # воркеры только считают; пишет один родительский процесс — SQLite не любит конкурентных писателей
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = [loop.run_in_executor(pool, _compute_chunk, chunk) for chunk in chunks]
+            for future in asyncio.as_completed(futures):
+                await write(await future)
+
+    logger.info("Match lists rebuilt: %s profiles in %.1fs", done, time.perf_counter() - started)
+    return done
+
+
+async def _main(workers: int) -> None:
+    from app.db.session import init_db
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    await init_db()
+    await rebuild_match_lists(workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересчитать списки кандидатов для всех активных анкет")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    asyncio.run(_main(args.workers))
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Profile, UserSeenSet
+from app.db.session import dialect_insert
+
+_DTYPE = np.dtype("<u4")
+
+
+def decode_ids(blob: bytes | None) -> np.ndarray:
+    if not blob:
+        return np.empty(0, dtype=np.int64)
+    return np.frombuffer(blob, dtype=_DTYPE).astype(np.int64)
+
+
+def encode_ids(ids: np.ndarray) -> bytes:
+    return np.asarray(ids, dtype=_DTYPE).tobytes()
+
+
+def contains(seen: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    # seen отсортирован — бинарный поиск вместо построения множества
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(seen) or not len(ids):
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(seen, ids), len(seen) - 1)
+    return seen[pos] == ids
+
+
+def filter_unseen(seen: np.ndarray, ids: list[int]) -> list[int]:
+    if not len(seen):
+        return list(ids)
+    hit = contains(seen, np.asarray(ids, dtype=np.int64))
+    return [pid for pid, h in zip(ids, hit) if not h]
+
+
+async def load_seen(session: AsyncSession, user_id: int) -> np.ndarray:
+    blob = await session.scalar(select(UserSeenSet.profile_ids).where(UserSeenSet.user_id == user_id))
+    return decode_ids(blob)
+
+
+async def _store(session: AsyncSession, user_id: int, ids: np.ndarray) -> None:
+    values = {"profile_ids": encode_ids(ids), "count": len(ids), "updated_at": datetime.utcnow()}
+    stmt = dialect_insert(session)(UserSeenSet).values(user_id=user_id, **values)
+    await session.execute(stmt.on_conflict_do_update(index_elements=[UserSeenSet.user_id], set_=values))
+
+
+async def mark_seen(session: AsyncSession, user_id: int, profile_ids: Iterable[int]) -> np.ndarray:
+    shown = np.fromiter(profile_ids, dtype=np.int64)
+    seen = await load_seen(session, user_id)
+    if not len(shown) or contains(seen, shown).all():
+        return seen
+    seen = np.union1d(seen, shown)
+    await _store(session, user_id, seen)
+    return seen
+
+
+async def reset_seen(session: AsyncSession, user_id: int) -> None:
+    await session.execute(delete(UserSeenSet).where(UserSeenSet.user_id == user_id))
+
+
+async def prune_seen_sets(session: AsyncSession) -> int:
+    # удалённые компакцией анкеты из наборов убираем, чтобы наборы не росли бесконечно
+    existing = np.fromiter(
+        (await session.execute(select(Profile.id).order_by(Profile.id))).scalars(), dtype=np.int64
+    )
+    pruned = 0
+    res = await session.execute(select(UserSeenSet.user_id, UserSeenSet.profile_ids))
+    for user_id, blob in res.all():
+        seen = decode_ids(blob)
+        kept = seen[contains(existing, seen)]
+        if len(kept) != len(seen):
+            await _store(session, user_id, kept)
+            pruned += len(seen) - len(kept)
+    return pruned
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import time
+import zlib
+from datetime import datetime
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import Profile, ProfileSearch, ProfileTextVector
+from app.matching.engine import GENDER_CODES
+
+logger = logging.getLogger(__name__)
+
+_NGRAMS = (3, 4, 5)
+_INITIAL_CAPACITY = 1024
+_BACKFILL_BATCH = 500
+
+
+def vectorize(text: str | None, dim: int | None = None) -> np.ndarray | None:
+    dim = dim or settings.text_vector_dim
+    words = re.findall(r"\w+", (text or "").lower().replace("ё", "е"))
+    if not words:
+        return None
+    hashes = [
+        zlib.crc32(padded[i : i + n].encode("utf-8"))
+        for word in words
+        for padded in (f" {word} ",)
+        for n in _NGRAMS
+        for i in range(len(padded) - n + 1)
+    ]
+    if not hashes:
+        return None
+    hashes = np.asarray(hashes, dtype=np.uint32)
+    # знак из старшего бита гасит смещение от коллизий хэша
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+    counts = np.zeros(dim, dtype=np.float32)
+    np.add.at(counts, (hashes % dim).astype(np.int64), signs)
+    vec = np.sign(counts) * np.log1p(np.abs(counts))
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return None
+    return (vec / norm).astype(np.float32)
+
+
+def profile_vectors(about_text: str | None, looking_text: str | None) -> tuple[np.ndarray | None, np.ndarray | None]:
+    about = vectorize(about_text)
+    looking = vectorize(looking_text)
+    # «кого ищу» в опроснике не спрашивается — тогда сравниваем «о себе» с «о себе»
+    return about, looking if looking is not None else about
+
+
+def _blob(vec: np.ndarray | None) -> bytes | None:
+    return None if vec is None else vec.astype("<f4").tobytes()
+
+
+def _unblob(blob: bytes | None, dim: int) -> np.ndarray | None:
+    if not blob:
+        return None
+    vec = np.frombuffer(blob, dtype="<f4")
+    return vec if len(vec) == dim else None
+
+
+async def store_profile_vectors(
+    session: AsyncSession,
+    profile_id: int,
+    about: np.ndarray | None,
+    looking: np.ndarray | None,
+) -> None:
+    await session.execute(delete(ProfileTextVector).where(ProfileTextVector.profile_id == profile_id))
+    session.add(
+        ProfileTextVector(
+            profile_id=profile_id,
+            dim=settings.text_vector_dim,
+            about_vec=_blob(about),
+            looking_vec=_blob(looking),
+            updated_at=datetime.utcnow(),
+        )
+    )
+
+
+class TextIndex:
+    def __init__(self, path: str | None = None) -> None:
+        self._path = path
+        self.dim = settings.text_vector_dim
+        self._about: np.memmap | None = None
+        self._looking: np.memmap | None = None
+        self._capacity = 0
+        self._size = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._gender = np.zeros(0, dtype=np.int8)
+        self._rows: dict[int, int] = {}
+
+    @property
+    def path(self) -> str:
+        return self._path or settings.text_index_path
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _open(self, capacity: int) -> None:
+        # файлы — кэш для memmap: строки лежат на диске, в памяти только то, что читает matmul
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        for name in ("about", "looking"):
+            filename = f"{self.path}.{name}.f32"
+            with open(filename, "ab") as f:
+                f.truncate(capacity * self.dim * 4)
+        self._about = np.memmap(f"{self.path}.about.f32", dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._looking = np.memmap(f"{self.path}.looking.f32", dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        ids = np.zeros(capacity, dtype=np.int64)
+        gender = np.zeros(capacity, dtype=np.int8)
+        ids[: self._size] = self._ids[: self._size]
+        gender[: self._size] = self._gender[: self._size]
+        self._ids, self._gender, self._capacity = ids, gender, capacity
+
+    def _reserve(self, size: int) -> None:
+        if size <= self._capacity:
+            return
+        capacity = max(_INITIAL_CAPACITY, self._capacity)
+        while capacity < size:
+            capacity *= 2
+        if self._about is not None:
+            self._about.flush()
+            self._looking.flush()
+        self._open(capacity)
+
+    def _reset(self) -> None:
+        self._about = None
+        self._looking = None
+        self._size = 0
+        self._rows = {}
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._gender = np.zeros(0, dtype=np.int8)
+        self._capacity = 0
+        for name in ("about", "looking"):
+            try:
+                os.remove(f"{self.path}.{name}.f32")
+            except FileNotFoundError:
+                pass
+
+    def add(self, profile_id: int, gender: str | None, about: np.ndarray | None, looking: np.ndarray | None) -> None:
+        if about is None and looking is None:
+            self.remove([profile_id])
+            return
+        row = self._rows.get(profile_id)
+        if row is None:
+            # новая анкета дописывается в конец — вся матрица не пересобирается
+            row = self._size
+            self._reserve(row + 1)
+            self._size += 1
+            self._rows[profile_id] = row
+        zero = np.zeros(self.dim, dtype=np.float32)
+        self._about[row] = zero if about is None else about
+        self._looking[row] = zero if looking is None else looking
+        self._ids[row] = profile_id
+        self._gender[row] = GENDER_CODES.get(gender or "", 0)
+
+    def remove(self, profile_ids: Iterable[int]) -> None:
+        for pid in profile_ids:
+            row = self._rows.pop(pid, None)
+            if row is not None:
+                # строка остаётся «дыркой» до compact(); пол 0 исключает её из выдачи
+                self._gender[row] = 0
+                self._about[row] = 0.0
+                self._looking[row] = 0.0
+
+    @property
+    def holes(self) -> int:
+        return self._size - len(self._rows)
+
+    def compact(self) -> int:
+        # сдвигаем живые строки к началу по порядку: строка переезжает только вниз, копия на месте безопасна
+        holes = self.holes
+        if not holes:
+            return 0
+        rows: dict[int, int] = {}
+        for target, (pid, row) in enumerate(sorted(self._rows.items(), key=lambda item: item[1])):
+            if row != target:
+                self._about[target] = self._about[row]
+                self._looking[target] = self._looking[row]
+                self._ids[target] = self._ids[row]
+                self._gender[target] = self._gender[row]
+            rows[pid] = target
+        size = len(rows)
+        self._about[size : self._size] = 0.0
+        self._looking[size : self._size] = 0.0
+        self._ids[size : self._size] = 0
+        self._gender[size : self._size] = 0
+        self._rows, self._size = rows, size
+        self._about.flush()
+        self._looking.flush()
+        return holes
+
+    def top_k(
+        self,
+        profile_id: int,
+        target_gender: str,
+        k: int,
+        exclude_ids: np.ndarray | None = None,
+    ) -> list[tuple[int, float]]:
+        row = self._rows.get(profile_id)
+        if row is None or not self._size:
+            return []
+        n = self._size
+        about = self._about[:n]
+        looking = self._looking[:n]
+        # «кого ищу» одной анкеты против «о себе» другой — в обе стороны, по одному matmul на сторону
+        scores = 0.5 * (about @ self._looking[row] + looking @ self._about[row])
+        mask = self._gender[:n] == GENDER_CODES.get(target_gender, 0)
+        if exclude_ids is not None and len(exclude_ids):
+            mask &= ~np.isin(self._ids[:n], exclude_ids)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates) or k <= 0:
+            return []
+        scores = scores[candidates]
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self._ids[candidates[t]]), float(scores[t])) for t in top if scores[t] > 0]
+
+    async def load(self, session: AsyncSession) -> None:
+        started = time.perf_counter()
+        await self._backfill(session)
+        self._reset()
+        res = await session.execute(
+            select(ProfileSearch.profile_id, ProfileSearch.gender, ProfileTextVector.about_vec, ProfileTextVector.looking_vec)
+            .join(ProfileTextVector, ProfileTextVector.profile_id == ProfileSearch.profile_id)
+            .where(ProfileTextVector.dim == self.dim)
+            .order_by(ProfileSearch.profile_id)
+        )
+        rows = res.all()
+        self._reserve(max(len(rows), 1))
+        for pid, gender, about, looking in rows:
+            self.add(pid, gender, _unblob(about, self.dim), _unblob(looking, self.dim))
+        if self._about is not None:
+            self._about.flush()
+            self._looking.flush()
+        logger.info("Text index loaded: %s profiles in %.0f ms", len(self), (time.perf_counter() - started) * 1000)
+
+    async def _backfill(self, session: AsyncSession) -> None:
+        # векторы для анкет, сохранённых до появления индекса или с другой размерностью
+        while True:
+            res = await session.execute(
+                select(Profile.id, Profile.about_me_text, Profile.looking_for_text)
+                .join(ProfileSearch, ProfileSearch.profile_id == Profile.id)
+                .outerjoin(ProfileTextVector, ProfileTextVector.profile_id == Profile.id)
+                .where((ProfileTextVector.profile_id.is_(None)) | (ProfileTextVector.dim != self.dim))
+                .limit(_BACKFILL_BATCH)
+            )
+            batch = res.all()
+            if not batch:
+                return
+            ids = [pid for pid, _, _ in batch]
+            await session.execute(delete(ProfileTextVector).where(ProfileTextVector.profile_id.in_(ids)))
+            now = datetime.utcnow()
+            records = []
+            for pid, about_text, looking_text in batch:
+                about, looking = profile_vectors(about_text, looking_text)
+                records.append(
+                    {
+                        "profile_id": pid,
+                        "dim": self.dim,
+                        "about_vec": _blob(about),
+                        "looking_vec": _blob(looking),
+                        "updated_at": now,
+                    }
+                )
+            await session.execute(insert(ProfileTextVector), records)
+            await session.commit()
+            logger.info("Text vectors backfilled for %s profiles", len(records))
+
+
+text_index = TextIndex()
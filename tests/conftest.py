@@ -0,0 +1,5 @@
+import os
+
+# Settings требует токен бота; тестам хватает заглушки и отдельной базы в памяти
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_URL", "sqlite+aiosqlite:///:memory:")
@@ -0,0 +1,57 @@
+import asyncio
+
+from sqlalchemy import select
+
+from app.db.attribute_registry import attribute_registry
+from app.db.attribute_service import AttributeValueInput, _wins, merge_profile_attribute_values
+from app.db.models import ProfileAttributeValue
+from app.db.session import SessionFactory, engine, init_db
+
+
+def _ai(confidence, version, source="AI"):
+    return {"source": source, "confidence": confidence, "evidence": "цитата", "prompt_version": version}
+
+
+def test_newer_prompt_replaces_older_regardless_of_confidence():
+    assert _wins(_ai(0.4, "v4"), _ai(0.95, "v3"))
+    assert not _wins(_ai(0.95, "v3"), _ai(0.4, "v4"))
+    assert _wins(_ai(0.4, "v10"), _ai(0.95, "v9"))
+
+
+def test_legacy_ai_rows_are_older_than_any_version():
+    assert _wins(_ai(0.3, "v3"), {"source": None, "confidence": 0.9, "evidence": "цитата"})
+
+
+def test_same_version_compares_confidence():
+    assert _wins(_ai(0.9, "v3"), _ai(0.8, "v3"))
+    assert not _wins(_ai(0.7, "v3"), _ai(0.8, "v3"))
+
+
+def test_user_answers_and_rules_are_not_replaced_by_version():
+    user = {"source": "USER", "confidence": 1.0, "evidence": None, "prompt_version": None}
+    assert not _wins(_ai(0.99, "v9"), user)
+    rules = _ai(0.9, None, source="RULES")
+    assert not _wins(_ai(0.5, "v9"), rules)
+
+
+def test_backfill_with_new_prompt_overwrites_stored_value():
+    async def scenario():
+        await init_db()
+        try:
+            location = attribute_registry.get("location")
+            async with SessionFactory() as session:
+                await merge_profile_attribute_values(
+                    session, [AttributeValueInput(1, location, "Казань", None, 0.95, "Казань", "AI", "v3")]
+                )
+                result = await merge_profile_attribute_values(
+                    session, [AttributeValueInput(1, location, "Уфа", None, 0.6, "Уфа", "AI", "v4")]
+                )
+                await session.commit()
+                stored = (await session.execute(select(ProfileAttributeValue))).scalar_one()
+            return result, stored
+        finally:
+            await engine.dispose()
+
+    result, stored = asyncio.run(scenario())
+    assert result.written == 1
+    assert (stored.value_text, stored.prompt_version) == ("Уфа", "v4")
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from app.ai.extraction_queue import ExtractionQueue, add_extraction_job
+from app.ai.model_health import CircuitOpenError
+from app.core.config import settings
+from app.db.models import ExtractionJob
+from app.db.session import SessionFactory, engine, init_db
+
+
+def _run(scenario):
+    async def main():
+        await init_db()
+        try:
+            return await scenario()
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+async def _enqueue() -> int:
+    async with SessionFactory() as session:
+        job = add_extraction_job(session, 1, "текст анкеты для извлечения")
+        await session.commit()
+        return job.id
+
+
+async def _job(job_id: int) -> ExtractionJob:
+    async with SessionFactory() as session:
+        return (await session.execute(select(ExtractionJob).where(ExtractionJob.id == job_id))).scalar_one()
+
+
+async def _make_due(job_id: int) -> None:
+    async with SessionFactory() as session:
+        await session.execute(update(ExtractionJob).where(ExtractionJob.id == job_id).values(run_after=datetime.utcnow()))
+        await session.commit()
+
+
+def test_outage_does_not_use_up_attempts():
+    async def scenario():
+        queue = ExtractionQueue()
+        job_id = await _enqueue()
+        # простой длиннее всех попыток вместе взятых
+        for _ in range(settings.extraction_max_attempts * 3):
+            jobs = await queue._claim_batch(1)
+            assert len(jobs) == 1
+            await queue._fail(jobs, CircuitOpenError(60))
+            await _make_due(job_id)
+        return await _job(job_id)
+
+    job = _run(scenario)
+    assert job.status == "PENDING"
+    assert job.attempts == 0
+
+
+def test_outage_defers_until_retry_after():
+    async def scenario():
+        queue = ExtractionQueue()
+        job_id = await _enqueue()
+        await queue._fail(await queue._claim_batch(1), CircuitOpenError(60))
+        return await _job(job_id)
+
+    job = _run(scenario)
+    assert (job.run_after - datetime.utcnow()).total_seconds() >= 55
+
+
+def test_other_errors_fail_after_max_attempts():
+    async def scenario():
+        queue = ExtractionQueue()
+        job_id = await _enqueue()
+        for _ in range(settings.extraction_max_attempts):
+            await queue._fail(await queue._claim_batch(1), ValueError("bad response"))
+            await _make_due(job_id)
+        return await _job(job_id)
+
+    job = _run(scenario)
+    assert job.status == "FAILED"
+    assert job.attempts == settings.extraction_max_attempts
+
+
+class _Throttled(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": headers})()
+
+
+def test_outage_delay_reads_retry_after():
+    from app.ai.extraction_queue import _outage_delay
+
+    assert _outage_delay(_Throttled({"retry-after": "30"})) == 30.0
+    assert _outage_delay(_Throttled({})) == settings.extraction_retry_base_delay
+    assert _outage_delay(ValueError("bad response")) is None
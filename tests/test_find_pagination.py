@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.bot.handlers import browse_page, decode_cursor, encode_cursor
+from app.db.models import Profile, ProfileSearch, User
+from app.db.session import SessionFactory, engine, init_db
+
+
+def test_cursor_round_trip():
+    position = (datetime(2026, 3, 1, 12, 30, 15, 123456), 42)
+    assert decode_cursor(encode_cursor(position)) == position
+    assert decode_cursor("garbage") is None
+    assert decode_cursor("20260301:abc") is None
+
+
+async def _seed() -> tuple[int, list[int]]:
+    base = datetime(2026, 1, 1)
+    # у трёх анкет одинаковое время создания — порядок внутри группы задаёт profile_id
+    created = [base, base + timedelta(hours=1), base + timedelta(hours=1), base + timedelta(hours=1), base + timedelta(hours=2)]
+    async with SessionFactory() as session:
+        viewer = User(telegram_id=1, gender="BROTHER")
+        session.add(viewer)
+        await session.flush()
+        ids = []
+        for n, created_at in enumerate(created, start=2):
+            user = User(telegram_id=n, gender="SISTER")
+            session.add(user)
+            await session.flush()
+            profile = Profile(user_id=user.id)
+            session.add(profile)
+            await session.flush()
+            session.add(ProfileSearch(profile_id=profile.id, user_id=user.id, gender="SISTER", created_at=created_at))
+            ids.append((created_at, profile.id))
+        await session.commit()
+    expected = [pid for _, pid in sorted(ids, reverse=True)]
+    return viewer.id, expected
+
+
+def _browse_all(seen: np.ndarray | None) -> tuple[list[int], list[int]]:
+    async def scenario():
+        await init_db()
+        try:
+            viewer_id, expected = await _seed()
+            shown: list[int] = []
+            cursor = None
+            async with SessionFactory() as session:
+                while True:
+                    rows, position = await browse_page(session, "SISTER", viewer_id, cursor, 2, seen=seen)
+                    shown += [profile.id for profile, _ in rows]
+                    if position is None:
+                        break
+                    # курсор проходит через callback_data строкой
+                    cursor = decode_cursor(encode_cursor(position))
+            return shown, expected
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def test_keyset_pages_cover_every_profile_once():
+    shown, expected = _browse_all(None)
+    assert shown == expected
+
+
+def test_keyset_pages_skip_seen_profiles():
+    shown, expected = _browse_all(np.asarray([2, 4], dtype=np.int64))
+    assert shown == [pid for pid in expected if pid not in (2, 4)]
@@ -0,0 +1,43 @@
+from app.ai.local_extractor import extract_local
+
+
+def _values(extraction):
+    return {item["key"]: item["value"] for item in extraction.items}
+
+
+def test_fully_parsed_text_skips_llm():
+    extraction = extract_local("Мне 27 лет, рост 175 см, вес 70 кг")
+    assert _values(extraction) == {"age": "27", "height_cm": "175", "weight_kg": "70"}
+    assert not extraction.needs_llm
+
+
+def test_text_without_cues_still_goes_to_llm():
+    # ни одного признака известного ключа — но город, национальность и свободные атрибуты есть только у ИИ
+    extraction = extract_local("Живу в Казани, люблю готовить и путешествовать")
+    assert extraction.items == []
+    assert extraction.needs_llm
+
+
+def test_unparsed_clause_sends_text_to_llm():
+    extraction = extract_local("Мне 27 лет. Работаю программистом в Казани")
+    assert _values(extraction) == {"age": "27"}
+    assert extraction.needs_llm
+
+
+def test_decimal_comma_does_not_split_clause():
+    extraction = extract_local("рост 1,75, сунна")
+    assert _values(extraction)["height_cm"] == "175"
+    assert not extraction.needs_llm
+
+
+def test_negation_stays_in_its_clause():
+    extraction = extract_local("Мне 27 лет, не женат, детей нет")
+    assert _values(extraction) == {"age": "27", "marital_status": "NEVER_MARRIED", "children": "NONE"}
+    assert not extraction.needs_llm
+
+
+def test_negated_phrase_is_left_to_llm():
+    assert "hijab_type" in extract_local("не ношу хиджаб").unresolved
+    extraction = extract_local("замужем не была, без детей")
+    assert "marital_status" not in _values(extraction)
+    assert "marital_status" in extraction.unresolved
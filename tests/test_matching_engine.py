@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from app.db.seed import CANONICAL_ATTRIBUTES
+from app.core.config import settings
+from app.matching.engine import ENUM_FEATURES, CandidateMatrix, _compat_matrix
+
+_CODES = {spec["key"]: [code for code, _ in spec["options"]] for spec in CANONICAL_ATTRIBUTES}
+
+
+@pytest.mark.parametrize("key", ENUM_FEATURES)
+def test_compat_matrix_is_symmetric(key):
+    matrix = _compat_matrix(key, _CODES[key])
+    assert np.array_equal(matrix, matrix.T)
+
+
+def test_wildcard_rules_on_both_sides_take_the_lower_score():
+    aqida = _CODES["aqida_manhaj"]
+    matrix = _compat_matrix("aqida_manhaj", aqida)
+    unknown, other = aqida.index("UNKNOWN") + 1, aqida.index("OTHER") + 1
+    assert matrix[unknown, other] == matrix[other, unknown] == pytest.approx(0.3)
+
+    relocation = _CODES["relocation_ready"]
+    matrix = _compat_matrix("relocation_ready", relocation)
+    yes, unknown = relocation.index("YES") + 1, relocation.index("UNKNOWN") + 1
+    assert matrix[yes, unknown] == matrix[unknown, yes] == pytest.approx(0.5)
+    assert matrix[yes, yes] == pytest.approx(1.0)
+
+
+def _random_matrix(n: int, seed: int = 7) -> CandidateMatrix:
+    rng = np.random.default_rng(seed)
+    age = rng.integers(18, 50, n).astype(np.float32)
+    age[rng.random(n) < 0.2] = np.nan
+    location = rng.integers(0, 4, n).astype(np.int64)
+    codes = {key: rng.integers(0, len(_CODES[key]) + 1, n).astype(np.int16) for key in ENUM_FEATURES}
+    compat = {key: _compat_matrix(key, _CODES[key]) for key in ENUM_FEATURES}
+    return CandidateMatrix(
+        profile_ids=np.arange(1, n + 1, dtype=np.int64),
+        gender=rng.integers(1, 3, n).astype(np.int8),
+        age=age,
+        location=location,
+        codes=codes,
+        compat=compat,
+    )
+
+
+def test_profile_score_is_the_same_from_both_sides():
+    # инкрементальное обновление списков кандидатов опирается на score(i)[j] == score(j)[i]
+    matrix = _random_matrix(60)
+    scores = np.stack([matrix.score(i, settings.match_weights) for i in range(len(matrix))])
+    np.testing.assert_allclose(scores, scores.T, rtol=0, atol=1e-6)
@@ -0,0 +1,30 @@
+import time
+
+from app.ai.model_health import ModelAvailability
+
+CHAIN = ["gpt-primary", "gpt-5-nano", "gpt-5-mini"]
+
+
+def test_order_keeps_configured_chain():
+    availability = ModelAvailability(ttl=60)
+    availability.mark_available("gpt-5-nano")
+    assert availability.order(CHAIN) == CHAIN
+
+
+def test_unavailable_model_is_skipped_until_ttl_expires():
+    availability = ModelAvailability(ttl=60)
+    availability.mark_unavailable("gpt-primary")
+    availability.mark_available("gpt-5-nano")
+    assert availability.order(CHAIN) == ["gpt-5-nano", "gpt-5-mini"]
+
+    # срок памяти истёк — основная модель снова первая, хотя фолбэк всё это время отвечал
+    availability._unavailable["gpt-primary"] = time.monotonic() - 61
+    availability.mark_available("gpt-5-nano")
+    assert availability.order(CHAIN) == CHAIN
+
+
+def test_all_unavailable_still_tries_chain():
+    availability = ModelAvailability(ttl=60)
+    for model in CHAIN:
+        availability.mark_unavailable(model)
+    assert availability.order(CHAIN) == CHAIN
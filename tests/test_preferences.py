@@ -0,0 +1,46 @@
+import pytest
+
+from app.db.preferences import nationality_key, parse_age_range, parse_nationality_set
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("от 20 до 100", (20, None)),
+        ("от 10 до 30", (None, 30)),
+        ("18-100", (18, None)),
+        ("от 22 до 30 лет", (22, 30)),
+        ("25-35", (25, 35)),
+        ("25 до 30", (25, 30)),
+        ("до 30", (None, 30)),
+        ("не старше 40", (None, 40)),
+        ("не младше 25", (25, None)),
+        ("30+", (30, None)),
+        ("25 и старше", (25, None)),
+        ("30", (None, None)),
+        ("", (None, None)),
+    ],
+)
+def test_parse_age_range(text, expected):
+    assert parse_age_range(text) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("Русский(ая) мусульманин(ка)", "russian"),
+        ("русская", "russian"),
+        ("Узбек(ка)", "uzbek"),
+        ("узбечка", "uzbek"),
+        ("Таджик(ка)", "tajik"),
+        ("чеченка", "chechen"),
+        ("", None),
+    ],
+)
+def test_nationality_key(value, expected):
+    assert nationality_key(value) == expected
+
+
+def test_nationality_set_any():
+    assert parse_nationality_set("чеченка или любая") == set()
+    assert parse_nationality_set("узбечка, таджичка") == {"uzbek", "tajik"}
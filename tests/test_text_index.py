@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.matching.text_index import TextIndex, profile_vectors
+
+_TEXTS = {
+    1: ("люблю горы и походы", "ищу спокойного брата"),
+    2: ("читаю книги, учу арабский", "ищу сестру с тягой к знаниям"),
+    3: ("спокойный, люблю походы в горы", "ищу сестру, любящую природу"),
+    4: ("работаю врачом, люблю читать", "ищу спокойную семью"),
+}
+_GENDERS = {1: "SISTER", 2: "SISTER", 3: "BROTHER", 4: "SISTER"}
+
+
+def _index(tmp_path) -> TextIndex:
+    index = TextIndex(path=str(tmp_path / "text_index"))
+    for pid, (about, looking) in _TEXTS.items():
+        index.add(pid, _GENDERS[pid], *profile_vectors(about, looking))
+    return index
+
+
+def test_compact_closes_holes_and_keeps_scores(tmp_path):
+    index = _index(tmp_path)
+    before = dict(index.top_k(3, "SISTER", 10))
+    index.remove([2])
+    assert index.holes == 1
+
+    assert index.compact() == 1
+    assert index.holes == 0
+    assert len(index) == 3
+    after = dict(index.top_k(3, "SISTER", 10))
+    assert set(after) == set(before) - {2}
+    for pid, score in after.items():
+        assert np.isclose(score, before[pid])
+
+
+def test_add_after_compact_appends(tmp_path):
+    index = _index(tmp_path)
+    index.remove([1, 2])
+    index.compact()
+    index.add(5, "SISTER", *profile_vectors("люблю горы и походы", "ищу спокойного брата"))
+    assert len(index) == 3
+    assert 5 in dict(index.top_k(3, "SISTER", 10))
+    assert index.compact() == 0